@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+
+"""
+asyncio API for launching and supervising containers (Python 3.5+).
+
+`launch` resolves a launch with the same volume, abbreviation, identity
+and template logic as the `luda` command, starts the container detached
+and returns a `Container` handle to wait on, stream logs from, stop or
+remove it::
+
+    from luda import aio
+
+    async def train():
+        async with await aio.launch("nv:pytorch:24.01-py3", ["python", "train.py"],
+                                    volumes=["/nfs/data:/data:ro"]) as container:
+            async for line in container.logs():
+                print(line)
+            return await container.wait()
+
+Plan resolution (image inspection, template builds) runs in the loop's
+default executor.  With `backend: api` configured, the containers are
+created, waited on, streamed from and removed through the shared
+EngineClient, whose blocking calls also run in the default executor;
+otherwise (or when the launch uses options the API backend cannot
+translate) they are driven through the docker CLI as asyncio
+subprocesses.  Either way one event loop can supervise many launches at
+once.
+"""
+
+import asyncio
+import functools
+
+from .config import read_config
+from .engine import EngineError, UnsupportedOption, container_config, get_engine
+from .launch import build_plan
+from .luda import Volume
+
+
+class LaunchError(Exception):
+    pass
+
+
+async def docker(exe, *args):
+    """Runs `exe args...` and returns (exit code, stdout, stderr) as text."""
+    proc = await asyncio.create_subprocess_exec(exe, *args, stdout=asyncio.subprocess.PIPE,
+                                                stderr=asyncio.subprocess.PIPE)
+    stdout, stderr = await proc.communicate()
+    return proc.returncode, stdout.decode("utf-8", "replace"), stderr.decode("utf-8", "replace")
+
+
+def backend_engine(config):
+    """The shared EngineClient if `backend: api` is configured, else None for the docker CLI."""
+    if config.get("backend", "cli") != "api":
+        return None
+    return get_engine(config.get("docker_socket"))
+
+
+async def call_engine(func, *args):
+    """Runs the blocking EngineClient call `func(*args)` in the default executor."""
+    try:
+        return await asyncio.get_event_loop().run_in_executor(None, functools.partial(func, *args))
+    except EngineError as err:
+        raise LaunchError(str(err))
+
+
+def start_container(engine, plan):
+    """Creates and starts the container of a detached `plan`; returns its id."""
+    config, options = container_config(plan)
+    container_id = engine.create_container(config, name=options.get("name"))
+    engine.start_container(container_id)
+    return container_id
+
+
+class LogStream(object):
+    """
+    Async iterator over the lines (without newlines) of `docker logs`, or of
+    the Engine API's logs endpoint when an `engine` is given.
+    """
+
+    def __init__(self, exe, container_id, follow=True, engine=None, tty=False):
+        self.argv = [exe, "logs"] + (["--follow"] if follow else []) + [container_id]
+        self.proc = None
+        self.engine = engine
+        self.frames = None
+        self.buffer = b""
+        if engine is not None:
+            self.frames = engine.container_logs(container_id, follow, tty)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.frames is not None:
+            return await self._next_frame_line()
+        if self.proc is None:
+            # the container's stdout and stderr arrive interleaved, as in a terminal
+            self.proc = await asyncio.create_subprocess_exec(*self.argv, stdout=asyncio.subprocess.PIPE,
+                                                             stderr=asyncio.subprocess.STDOUT)
+        line = await self.proc.stdout.readline()
+        if not line:
+            await self.proc.wait()
+            raise StopAsyncIteration
+        return line.decode("utf-8", "replace").rstrip("\n")
+
+    async def _next_frame_line(self):
+        while b"\n" not in self.buffer:
+            frame = await call_engine(next, self.frames, None)
+            if frame is None:
+                if not self.buffer:
+                    raise StopAsyncIteration
+                self.buffer += b"\n"
+                break
+            self.buffer += frame[1]
+        line, _, self.buffer = self.buffer.partition(b"\n")
+        return line.decode("utf-8", "replace")
+
+    async def close(self):
+        if self.frames is not None:
+            self.frames.close()
+        if self.proc is not None and self.proc.returncode is None:
+            self.proc.kill()
+            await self.proc.wait()
+
+
+class Container(object):
+    """
+    A container started by `launch`.
+
+    :param container_id: id printed by `docker run -d`
+    :param plan: LaunchPlan the container was started from
+    :param remove: remove the container once `wait` has seen it exit
+    :param engine: EngineClient the container was started through, or None for the docker CLI
+    """
+
+    def __init__(self, container_id, plan, remove=True, engine=None):
+        self.id = container_id
+        self.plan = plan
+        self.exe = plan.exe
+        self.engine = engine
+        self.remove_on_exit = remove
+        self.exit_code = None
+
+    def __repr__(self):
+        return "Container({0!r}, image={1!r})".format(self.id[:12], self.plan.image)
+
+    async def wait(self):
+        """
+        Waits for the container to exit and returns its exit code.  Cancelling
+        the waiting task stops the container.
+        """
+        if self.exit_code is not None:
+            return self.exit_code
+        if self.engine is not None:
+            try:
+                self.exit_code = await call_engine(self.engine.wait_container, self.id)
+            except asyncio.CancelledError:
+                # stopping the container releases the executor thread blocked in the wait
+                await self.stop()
+                raise
+            if self.remove_on_exit:
+                await self.remove()
+            return self.exit_code
+        proc = await asyncio.create_subprocess_exec(self.exe, "wait", self.id, stdout=asyncio.subprocess.PIPE,
+                                                    stderr=asyncio.subprocess.PIPE)
+        try:
+            stdout, stderr = await proc.communicate()
+        except asyncio.CancelledError:
+            proc.kill()
+            await proc.wait()
+            await self.stop()
+            raise
+        if proc.returncode:
+            raise LaunchError("docker wait {0} failed: {1}".format(
+                self.id, stderr.decode("utf-8", "replace").strip()))
+        self.exit_code = int(stdout.decode().strip() or 0)
+        if self.remove_on_exit:
+            await self.remove()
+        return self.exit_code
+
+    def logs(self, follow=True):
+        """
+        The container's output as an async iterator of lines; with `follow`
+        it ends when the container exits.
+        """
+        return LogStream(self.exe, self.id, follow, engine=self.engine, tty="-t" in self.plan.run_args)
+
+    async def stop(self, timeout=10):
+        """Stops the container, killing it after `timeout` seconds."""
+        if self.engine is None:
+            await docker(self.exe, "stop", "--time", str(timeout), self.id)
+            return
+        try:
+            await call_engine(self.engine.stop_container, self.id, timeout)
+        except LaunchError:
+            pass
+
+    async def kill(self, signal="KILL"):
+        if self.engine is None:
+            await docker(self.exe, "kill", "--signal", signal, self.id)
+            return
+        try:
+            await call_engine(self.engine.kill_container, self.id, signal)
+        except LaunchError:
+            pass
+
+    async def cancel(self, timeout=10):
+        """Stops the container and returns its exit code."""
+        await self.stop(timeout)
+        return await self.wait()
+
+    async def remove(self):
+        if self.engine is not None:
+            await call_engine(self.engine.remove_container, self.id, True)
+            self.remove_on_exit = False
+            return
+        code, _, stderr = await docker(self.exe, "rm", "--force", self.id)
+        if code:
+            raise LaunchError("docker rm {0} failed: {1}".format(self.id, stderr.strip()))
+        self.remove_on_exit = False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        # leaving the block early (an exception, a cancelled task) takes the container down with it
+        if self.exit_code is None:
+            await self.cancel()
+        elif self.remove_on_exit:
+            await self.remove()
+
+
+def plan_launch(image, command=(), volumes=(), templates=(), template_path=None, env=None, options=(), name=None,
+                home=True, work=None, nccl=True, identity=None, resources=None, config=None, config_path=None,
+                exe=None, engine=None):
+    """
+    Resolves the detached launch of `image` into a LaunchPlan, as `luda -d`
+    would; the arguments of `launch` are described there.
+
+    :param engine: EngineClient used for image inspection and template builds instead of the CLI
+    """
+    config = read_config(config_path) if config is None else config
+    volumes = [vol if isinstance(vol, Volume) else Volume.fromString(vol) for vol in volumes]
+    plan = build_plan([image] + list(command), config, config_path=config_path, detach=True, nccl=nccl, home=home,
+                      work=work, volume=volumes, template=list(templates), template_path=template_path,
+                      exe=exe, engine=engine, identity=identity, resources=resources)
+    if name:
+        plan.add("--name", name)
+    for key in sorted(env or {}):
+        plan.add_env(key, env[key])
+    plan.add(*options)
+    return plan
+
+
+async def launch(image, command=(), volumes=(), templates=(), template_path=None, env=None, options=(),
+                 name=None, remove=True, home=True, work=None, nccl=True, identity=None, resources=None,
+                 config=None, config_path=None, exe=None):
+    """
+    Starts a container and returns its handle.
+
+    :param image: image name; abbreviations are expanded as on the command line
+    :param command: command run in the container, default the image's CMD
+    :param volumes: Volumes or volume strings as given to `-v`
+    :param templates: templates applied to the image, building it if needed
+    :param env: dict of environment variables
+    :param options: extra docker run options, e.g. `["--network", "host"]`
+    :param name: container name
+    :param remove: remove the container once it has exited and been waited for
+    :param config: configuration dictionary; read from `config_path` if not given;
+                   its `backend` selects the docker CLI or the Engine API
+    :return: Container
+    """
+    loop = asyncio.get_event_loop()
+
+    def resolve():
+        resolved_config = read_config(config_path) if config is None else config
+        engine = backend_engine(resolved_config)
+        return engine, plan_launch(image, command, volumes, templates, template_path, env, options, name, home,
+                                   work, nccl, identity, resources, resolved_config, config_path, exe, engine)
+
+    try:
+        engine, plan = await loop.run_in_executor(None, resolve)
+        if engine is not None:
+            try:
+                return Container(await call_engine(start_container, engine, plan), plan, remove, engine)
+            except UnsupportedOption:
+                pass
+        code, stdout, stderr = await docker(*plan.argv)
+    except (OSError, EngineError) as err:
+        raise LaunchError("cannot launch {0}: {1}".format(image, err))
+    container_id = stdout.strip().split("\n")[-1]
+    if code or not container_id:
+        raise LaunchError("{0} failed ({1}): {2}".format(plan, code, stderr.strip()))
+    return Container(container_id, plan, remove)
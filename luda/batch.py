@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+
+"""
+Batch launches from a job manifest.
+
+Each distinct (image, templates) combination in the manifest is resolved
+once; the jobs are then run by a fixed number of worker threads pulling
+from a shared queue, so a slot is backfilled as soon as a job finishes.
+"""
+
+import io
+import json
+import os
+import shlex
+import subprocess
+import threading
+import time
+
+try:
+    import queue
+except ImportError:  # python 2
+    import Queue as queue
+
+from .launch import build_plan, resolve_image
+from .luda import Volume
+from .utils import makedirs
+
+
+def to_bool(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "yes", "true", "on")
+    return bool(value)
+
+
+def as_list(value):
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return [value]
+
+
+class Job(object):
+    """
+    One container launch described by a manifest entry.
+    """
+
+    def __init__(self, name, image, command=None, volumes=(), templates=(), dev=False, env=None,
+                 work=None, home=True, nccl=True, resources=None, docker_args=()):
+        if not image:
+            raise ValueError("job {0}: no image given".format(name))
+        if isinstance(command, str):
+            command = shlex.split(command)
+        self.name = name
+        self.image = image
+        self.command = [str(c) for c in as_list(command)]
+        self.volumes = as_list(volumes)
+        self.templates = as_list(templates)
+        self.dev = to_bool(dev)
+        self.env = dict(env or {})
+        self.work = work
+        self.home = to_bool(home)
+        self.nccl = to_bool(nccl)
+        self.resources = resources
+        self.docker_args = [str(a) for a in as_list(docker_args)]
+
+    @classmethod
+    def fromDict(cls, name, data, defaults=None):
+        fields = dict(defaults or {})
+        fields.update(data)
+        fields.setdefault("name", name)
+        return cls(**fields)
+
+    @property
+    def image_key(self):
+        """Jobs with equal keys share one image resolution."""
+        return self.image, self.dev, tuple(self.templates)
+
+    @property
+    def docker_argv(self):
+        return [self.image] + self.command
+
+    @property
+    def run_args(self):
+        """
+        Docker run options of the job.  They are added to the resolved plan,
+        not split off the argv, because they may or may not take a value
+        (`--network host`, `--network=host`, `--privileged`).
+        """
+        args = list(self.docker_args)
+        for key in sorted(self.env):
+            args += ["--env", "{0}={1}".format(key, self.env[key])]
+        return args
+
+
+def load_jobs(path):
+    """
+    Reads a job manifest.
+
+    JSONL manifests hold one job object per line.  JSON and YAML manifests
+    hold an optional `defaults` mapping applied to every job and a `jobs`
+    mapping of job name to job (a JSON list of jobs is accepted too).
+    """
+    with io.open(path, encoding="utf-8") as handle:
+        text = handle.read()
+
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".jsonl":
+        entries = [json.loads(line) for line in text.splitlines() if line.strip()]
+        return [Job.fromDict("job{0}".format(idx), entry) for idx, entry in enumerate(entries)]
+
+    if ext == ".json":
+        data = json.loads(text)
+    else:
+        import poyo
+        data = poyo.parse_string(text)
+    if isinstance(data, list):
+        data = {"jobs": data}
+    defaults = data.get("defaults", {})
+    jobs = data.get("jobs", {})
+    if isinstance(jobs, dict):
+        return [Job.fromDict(name, entry, defaults) for name, entry in jobs.items()]
+    return [Job.fromDict("job{0}".format(idx), entry, defaults) for idx, entry in enumerate(jobs)]
+
+
+class JobResult(object):
+
+    def __init__(self, job, exit_code=None, wall_time=0.0, error=None):
+        self.job = job
+        self.exit_code = exit_code
+        self.wall_time = wall_time
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None and self.exit_code == 0
+
+    def toDict(self):
+        return {"name": self.job.name, "exit_code": self.exit_code,
+                "wall_time": round(self.wall_time, 3), "error": self.error}
+
+
+def schedule(items, work, concurrency, on_done=None):
+    """
+    Runs `work(item)` for every item with at most `concurrency` running at
+    once.  Returns the results in item order; `on_done(index, result)` is
+    called as each one completes.  Exceptions are returned as results.
+    """
+    pending = queue.Queue()
+    for idx, item in enumerate(items):
+        pending.put((idx, item))
+    results = [None] * len(items)
+
+    def worker():
+        while True:
+            try:
+                idx, item = pending.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                result = work(item)
+            except Exception as err:
+                result = err
+            results[idx] = result
+            if on_done is not None:
+                on_done(idx, result)
+
+    threads = [threading.Thread(target=worker) for _ in range(max(1, min(concurrency, len(items))))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def resolve_jobs(jobs, config, config_path=None, template_path=None, exe=None, engine=None):
+    """
+    Resolves every distinct image used by `jobs` once.
+
+    :return: dict of Job.image_key -> `resolve_image` result or exception
+    """
+    resolved = {}
+    for job in jobs:
+        key = job.image_key
+        if key in resolved:
+            continue
+        try:
+            resolved[key] = resolve_image(job.image, config, config_path=config_path, dev=job.dev,
+                                          template=job.templates, template_path=template_path,
+                                          exe=exe, engine=engine)
+        except Exception as err:
+            resolved[key] = err
+    return resolved
+
+
+def run_batch(jobs, config, concurrency, config_path=None, template_path=None, exe=None, engine=None,
+              log_dir=None, on_done=None):
+    """
+    Resolves and runs `jobs` with at most `concurrency` containers at a time.
+
+    :param log_dir: directory receiving `<job>.log` with each job's output;
+                    output is inherited when None
+    :return: list of JobResult in job order
+    """
+    resolved = resolve_jobs(jobs, config, config_path=config_path, template_path=template_path,
+                            exe=exe, engine=engine)
+
+    def run_job(job):
+        start = time.time()
+        result = JobResult(job)
+        try:
+            image = resolved[job.image_key]
+            if isinstance(image, Exception):
+                raise image
+            plan = build_plan(job.docker_argv, config, config_path=config_path, rm=True, nccl=job.nccl,
+                              resources=job.resources,
+                              home=job.home, work=job.work, volume=[Volume.fromString(v) for v in job.volumes],
+                              exe=exe, engine=engine, resolved=image)
+            plan.add(*job.run_args)
+            result.exit_code = execute_plan(plan, engine, job_log(log_dir, job))
+        except Exception as err:
+            result.error = str(err)
+        result.wall_time = time.time() - start
+        return result
+
+    wrapped = None
+    if on_done is not None:
+        wrapped = lambda idx, result: on_done(result)
+    return schedule(jobs, run_job, concurrency, wrapped)
+
+
+def job_log(log_dir, job):
+    if log_dir is None:
+        return None
+    # several workers get here at once; makedirs tolerates losing the race
+    makedirs(log_dir)
+    return os.path.join(log_dir, "{0}.log".format(job.name))
+
+
+def execute_plan(plan, engine=None, log_path=None):
+    """Runs `plan` as a child process (or over `engine`) and returns its exit code."""
+    log = io.open(log_path, "w", encoding="utf-8") if log_path else None
+    try:
+        if engine is not None:
+            return engine.run(plan, stdout=log, stderr=log)
+        return subprocess.call(plan.argv, stdout=log, stderr=subprocess.STDOUT if log else None)
+    finally:
+        if log is not None:
+            log.close()
+
+
+def format_results(results, elapsed, concurrency):
+    width = max([len("job")] + [len(r.job.name) for r in results])
+    lines = ["{0:<{w}}  {1:>5}  {2:>9}".format("job", "exit", "wall [s]", w=width)]
+    for r in results:
+        status = r.exit_code if r.error is None else "error"
+        line = "{0:<{w}}  {1:>5}  {2:9.2f}".format(r.job.name, status, r.wall_time, w=width)
+        if r.error:
+            line += "  " + r.error
+        lines.append(line)
+    failed = len([r for r in results if not r.ok])
+    lines.append("{0} jobs, {1} succeeded, {2} failed in {3:.2f} s (concurrency {4})".format(
+        len(results), len(results) - failed, failed, elapsed, concurrency))
+    return "\n".join(lines)
@@ -1,5 +1,13 @@
 #!/bin/bash
 
+# With `luda run --profile`, report phase timestamps back to the host
+mark() {
+    if [ -n "$LUDA_PROFILE" ]; then
+        echo "$1 $(date +%s%N)" >> "$LUDA_PROFILE"
+    fi
+}
+mark start
+
 # Add local user
 # Either use the HOST_USER_ID if passed in at runtime or
 # fallback
@@ -15,9 +23,11 @@ echo "Starting with GID : $GRP_ID"
 addgroup --gid ${GRP_ID} ${GRP_NAME}
 useradd --shell /bin/bash -u $USER_ID --gid $GRP_ID -o -c "" --create-home \
   -G sudo,$GRP_NAME $USER_NAME > /dev/null 2>&1
+mark useradd
 export HOME=/home/$USER_NAME
 
 echo "$USER_NAME ALL=(ALL) NOPASSWD: ALL" >> /etc/sudoers
+mark exec
 
 if [ ${#@} -eq 0 ]; then
     exec /bootstrap/su-exec $USER_NAME /bin/bash
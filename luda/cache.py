@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+
+"""On-disk caches that let repeat launches avoid talking to the docker daemon."""
+
+import hashlib
+import json
+import os
+import subprocess
+import threading
+import time
+
+from .config import get_cache_dir
+from .utils import atomic_write
+
+
+# serialises read-modify-write updates of the cache files between threads
+_lock = threading.RLock()
+
+
+def load_json(path, default=None):
+    """Decoded contents of the JSON file at `path`, or `default` if unreadable."""
+    try:
+        with open(path) as handle:
+            return json.load(handle)
+    except (IOError, OSError, ValueError):
+        return default
+
+
+def is_pinned(image_name):
+    """
+    True if `image_name` can never point at different content, i.e. it is a
+    digest reference (`repo@sha256:...`) or a bare image id (`sha256:...`).
+    """
+    return "@" in image_name or image_name.startswith("sha256:")
+
+
+def inspect_image(exe, image_name):
+    """
+    Runs a single `docker inspect` for `image_name` and returns the decoded
+    JSON object, or None if the image is not available locally.
+    """
+    proc = subprocess.Popen([exe, "inspect", "--type", "image", image_name],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, _ = proc.communicate()
+    if proc.returncode != 0:
+        return None
+    try:
+        data = json.loads(stdout.decode())
+    except ValueError:
+        return None
+    return data[0] if data else None
+
+
+class ImageMetadata(object):
+    """
+    The parts of an image's configuration luda needs to launch it.
+    """
+
+    def __init__(self, id, digests=None, entrypoint=None, cmd=None, workdir=None, user=None, labels=None, size=0):
+        self.id = id
+        self.digests = list(digests or [])
+        self.entrypoint = list(entrypoint or [])
+        self.cmd = list(cmd or [])
+        self.workdir = workdir or ""
+        self.user = user or ""
+        self.labels = dict(labels or {})
+        self.size = size or 0
+
+    @classmethod
+    def fromInspect(cls, data):
+        config = data.get("Config") or {}
+        return cls(data["Id"], digests=data.get("RepoDigests"),
+                   entrypoint=config.get("Entrypoint"), cmd=config.get("Cmd"),
+                   workdir=config.get("WorkingDir"), user=config.get("User"),
+                   labels=config.get("Labels"), size=data.get("Size"))
+
+    @classmethod
+    def fromDict(cls, data):
+        return cls(**data)
+
+    def toDict(self):
+        return dict(vars(self))
+
+
+class ImageCache(object):
+    """
+    Persistent image-metadata cache.
+
+    Metadata is stored once per image id under `<cache_dir>/images/<id>.json`;
+    `<cache_dir>/tags.json` maps image references to ids.  Pinned references
+    (digests, ids) are trusted forever.  A tag is trusted for `ttl` seconds,
+    after which it is re-inspected; if the tag has moved to a new id the old
+    mapping is replaced.  luda drops a tag's mapping whenever it pulls or
+    builds that tag itself, so only a tag moved outside luda (a `docker
+    pull` or `docker build` by hand) can be served stale, for at most `ttl`
+    seconds; `ttl=0` re-inspects tags on every lookup.
+    """
+
+    def __init__(self, cache_dir=None, ttl=300):
+        self.cache_dir = cache_dir or get_cache_dir()
+        self.ttl = ttl
+        self.images_dir = os.path.join(self.cache_dir, "images")
+        self.tags_file = os.path.join(self.cache_dir, "tags.json")
+
+    def _image_file(self, image_id):
+        return os.path.join(self.images_dir, image_id.replace(":", "-") + ".json")
+
+    def _load_tags(self):
+        return load_json(self.tags_file, {})
+
+    def lookup(self, image_name):
+        """
+        Returns cached ImageMetadata for `image_name` or None on a miss or a
+        stale tag.
+        """
+        entry = self._load_tags().get(image_name)
+        if not entry:
+            return None
+        if not is_pinned(image_name) and time.time() - entry.get("checked", 0) > self.ttl:
+            return None
+        data = load_json(self._image_file(entry["id"]))
+        return ImageMetadata.fromDict(data) if data else None
+
+    def store(self, image_name, metadata):
+        atomic_write(self._image_file(metadata.id), json.dumps(metadata.toDict()))
+        self.record_tag(image_name, metadata.id)
+
+    def record_tag(self, image_name, image_id):
+        """Points `image_name` at `image_id`, e.g. after luda built or pulled it."""
+        with _lock:
+            tags = self._load_tags()
+            tags[image_name] = {"id": image_id, "checked": time.time()}
+            atomic_write(self.tags_file, json.dumps(tags, indent=2, sort_keys=True))
+
+    def invalidate(self, image_name):
+        """Forgets where `image_name` points; called whenever luda pulls or builds the tag."""
+        with _lock:
+            tags = self._load_tags()
+            if tags.pop(image_name, None) is not None:
+                atomic_write(self.tags_file, json.dumps(tags, indent=2, sort_keys=True))
+
+    def get(self, image_name, inspect):
+        """
+        Returns ImageMetadata for `image_name`, calling `inspect(image_name)`
+        (which returns `docker inspect` JSON or None) only on a cache miss.
+        Images that cannot be inspected are not cached.
+        """
+        metadata = self.lookup(image_name)
+        if metadata is not None:
+            return metadata
+        data = inspect(image_name)
+        if not data:
+            self.invalidate(image_name)
+            return None
+        metadata = ImageMetadata.fromInspect(data)
+        self.store(image_name, metadata)
+        return metadata
+
+
+def hash_bytes(data):
+    return "sha256:" + hashlib.sha256(data).hexdigest()
+
+
+def hash_file(path, memo=None):
+    """
+    Content hash of the file at `path`.  `memo` maps paths to
+    `[size, mtime, digest]` and lets unchanged files skip re-reading.
+    """
+    st = os.stat(path)
+    if memo is not None:
+        entry = memo.get(path)
+        if entry and entry[0] == st.st_size and entry[1] == st.st_mtime:
+            return entry[2]
+    sha = hashlib.sha256()
+    with open(path, "rb") as handle:
+        for chunk in iter(lambda: handle.read(1 << 20), b""):
+            sha.update(chunk)
+    digest = "sha256:" + sha.hexdigest()
+    if memo is not None:
+        memo[path] = [st.st_size, st.st_mtime, digest]
+    return digest
+
+
+def hash_files(root, relpaths, memo=None):
+    """
+    Content hash of the listed files below `root`: relative paths, modes and
+    file contents.
+    """
+    sha = hashlib.sha256()
+    for relpath in relpaths:
+        path = os.path.join(root, relpath)
+        mode = os.stat(path).st_mode & 0o777
+        sha.update("{0}\0{1:o}\0{2}\n".format(relpath, mode, hash_file(path, memo)).encode("utf-8"))
+    return "sha256:" + sha.hexdigest()
+
+
+def hash_tree(root, exclude=(), memo=None):
+    """
+    Content hash of every file below `root`.  Names in `exclude` are skipped
+    at any depth.
+    """
+    relpaths = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if d not in exclude)
+        for name in sorted(filenames):
+            if name not in exclude:
+                relpaths.append(os.path.relpath(os.path.join(dirpath, name), root))
+    return hash_files(root, relpaths, memo)
+
+
+class BuildManifest(object):
+    """
+    Records which inputs produced each derived `luda/...` image.
+
+    An entry is keyed by tag and holds the build `key` (a hash over the
+    rendered Dockerfile, the files of its build context and the base image
+    id); a launch whose inputs hash to the same key can reuse the tag without
+    contacting the builder.
+    """
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir or get_cache_dir()
+        self.manifest_file = os.path.join(self.cache_dir, "builds.json")
+        self.memo_file = os.path.join(self.cache_dir, "filehashes.json")
+
+    def entries(self):
+        return load_json(self.manifest_file, {})
+
+    def context(self, context_dir, dockerfile_name, dockerfile):
+        """
+        BuildContext of a rendered template; file digests go through the
+        memo so unchanged files are not re-read.
+        """
+        from .context import BuildContext
+        with _lock:
+            memo = load_json(self.memo_file, {})
+            context = BuildContext(context_dir, dockerfile_name, dockerfile, memo)
+            atomic_write(self.memo_file, json.dumps(memo))
+        return context
+
+    def build_key(self, dockerfile, context_digest, base_id):
+        """Hash of all inputs that determine the content of a derived image."""
+        parts = {
+            "dockerfile": hash_bytes(dockerfile.encode("utf-8")),
+            "context": context_digest,
+            "base": base_id,
+        }
+        return hash_bytes(json.dumps(parts, sort_keys=True).encode("utf-8"))
+
+    def lookup(self, tag, key):
+        """Returns the manifest entry for `tag` if it was built from `key`."""
+        entry = self.entries().get(tag)
+        if entry and entry.get("key") == key:
+            return entry
+        return None
+
+    def record(self, tag, key, **info):
+        with _lock:
+            entries = self.entries()
+            info.update(key=key, built=time.time())
+            entries[tag] = info
+            atomic_write(self.manifest_file, json.dumps(entries, indent=2, sort_keys=True))
+
+    def forget(self, tag):
+        with _lock:
+            entries = self.entries()
+            if entries.pop(tag, None) is not None:
+                atomic_write(self.manifest_file, json.dumps(entries, indent=2, sort_keys=True))
@@ -5,11 +5,11 @@ https://denibertovic.com/posts/handling-permissions-with-docker-volumes/
 
 """
 import os
-import subprocess
+import sys
+import time
 
 import click
 
-from .luda import which, Volume, add_display, parse_tuple, expand_abbreviations, generate_dockerfile_extension
 from .config import read_config
 
 
@@ -21,6 +21,7 @@ class DockerVolumeType(click.ParamType):
     name = 'volume'
 
     def convert(self, value, param, ctx):
+        from .luda import Volume
         return Volume.fromString(value)
 
 
@@ -38,7 +39,69 @@ def exclusive(ctx_params, exclusive_params, error_message):
         raise click.UsageError(error_message)
 
 
-@click.command(context_settings=dict(
+def get_backend(backend, config):
+    """
+    Returns the shared EngineClient if the API backend is selected (on the
+    command line or in the config), else None for the docker CLI.
+    """
+    if (backend or config.get("backend", "cli")) != "api":
+        return None
+    from .engine import EngineError, get_engine
+    try:
+        return get_engine(config.get("docker_socket"))
+    except EngineError as err:
+        raise click.UsageError(str(err))
+
+
+def launch_defaults(rm, detach, tty, stdin, interactive=True):
+    """
+    The run options of a launch: as given, or `--rm -t -i` (`--rm` only when
+    not `interactive`) if none of them are.
+
+    :return: (rm, detach, tty, stdin)
+    """
+    if not (rm or detach or tty or stdin):
+        return True, detach, interactive, interactive
+    return rm, detach, tty, stdin
+
+
+def startup_report(ctx, param, value):
+    """Eager callback for `--startup-report`: print import timings and exit."""
+    if not value or ctx.resilient_parsing:
+        return
+    from .startup import report
+    text, ok = report()
+    click.echo(text)
+    ctx.exit(0 if ok else 1)
+
+
+class DefaultGroup(click.Group):
+    """
+    A group that passes anything which is not a subcommand name to its
+    default command, so `luda nvidia/cuda:8.0-devel` keeps meaning
+    `luda run nvidia/cuda:8.0-devel` while `luda batch jobs.yml` dispatches
+    to a subcommand.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.default_command = kwargs.pop('default_command')
+        super(DefaultGroup, self).__init__(*args, **kwargs)
+
+    def parse_args(self, ctx, args):
+        if args != ['--help'] and (not args or args[0] not in self.commands):
+            args.insert(0, self.default_command)
+        return super(DefaultGroup, self).parse_args(ctx, args)
+
+
+@click.group(cls=DefaultGroup, default_command='run')
+def main():
+    """ludicrously awesome [w]rapper for nvidia-docker.
+
+    `luda IMAGE ...` is shorthand for `luda run IMAGE ...`.
+    """
+
+
+@main.command('run', context_settings=dict(
     ignore_unknown_options=True,
 ))
 @click.option("--work", default=None,
@@ -46,7 +109,13 @@ def exclusive(ctx_params, exclusive_params, error_message):
                    "If None is passed, no /work or equivalent volume is mounted.")
 @click.option("--home/--no-home", default=True, help="Flag to mount ~/ to /home/$USER in the container. Default: True")
 @click.option("-v", "--volume", type=DockerVolumeType(), multiple=True,
-              help="Mounts volumes. Functions identical to docker's native '-v' command")
+              help="Mounts volumes. Functions identical to docker's native '-v' command; the extra mode " +
+                   "'prefetch' (e.g. src:dest:ro,prefetch) reads the files into the page cache during startup")
+@click.option("--prefetch", type=click.Path(exists=True), multiple=True,
+              help="Read the files below PATH into the host page cache while the container starts")
+@click.option("--stage", type=DockerVolumeType(), multiple=True,
+              help="Copy SRC to node-local storage (staging_dir) and mount the copy: --stage SRC:DEST[:ro]. " +
+                   "Repeat launches only copy changed files")
 @click.option('--display', is_flag=True,
               help="Sets up the environment to allow OpenGL contexts to be created")
 @click.option('--docker', is_flag=True, help="Mounts the Docker socket inside the container")
@@ -56,150 +125,399 @@ def exclusive(ctx_params, exclusive_params, error_message):
                    "container")
 @click.option('--nccl/--no-nccl', is_flag=True, default=True,
               help='Flag to provide proper system resources for NCCL enabled applications.')
+@click.option('--resources', default=None,
+              help="Resource profile sizing shm, IPC and ulimits for --nccl: nccl, small, dataloader or one " +
+                   "from resource_profiles in config.yml (default from config: resource_profile)")
 @click.option('--template', multiple=True, help="Apply template to extend the named image")
 @click.option('--template-path', type=click.Path(exists=True, dir_okay=True, file_okay=False, resolve_path=True), 
                                                  help="Customer directory containing templates.")
+@click.option('--intermediates/--no-intermediates', default=None,
+              help="Tag the image of every --template in a chain instead of building the chain as a single " +
+                   "multi-stage image (default from config: template_intermediates)")
 @click.option('--rm', is_flag=True, help="Automatically remove the container when it exits (incompatible with -d)")
 @click.option('-c', '--config_path', default=None, help="Location of luda config files")
 @click.option('-t', '--tty', is_flag=True, help="Allocate a pseudo-tty")
 @click.option('-i', '--stdin', is_flag=True, help="Keep STDIN open even if not attached")
 @click.option('-d', '--detach', is_flag=True,
               help="Detached mode: Run container in the background, print new container id")
+@click.option('--exec/--no-exec', 'exec_', default=True,
+              help="Replace the luda process with docker (default) or run docker as a child process")
+@click.option('--backend', type=click.Choice(['cli', 'api']), default=None,
+              help="Talk to docker through its CLI or directly via the Engine API socket (default from config: cli)")
+@click.option('--identity', type=click.Choice(['bootstrap', 'baked', 'user']), default=None,
+              help="Create the host user at container start (bootstrap), run a cached image with the user " +
+                   "already created (baked) or run as --user uid:gid with the image's own entrypoint and " +
+                   "no sudo (user); default from config: bootstrap")
+@click.option('--session', is_flag=True,
+              help="Run in a warm session container, started on first use and reused via docker exec by " +
+                   "launches with the same image, volumes and env")
+@click.option('--hosts', 'hostfile', type=click.Path(exists=True, dir_okay=False), default=None,
+              help="Launch on every host in HOSTFILE at once (one host per line, optional slots=N) with " +
+                   "RANK/WORLD_SIZE/MASTER_ADDR set for each rank")
+@click.option('--transport', default=None,
+              help="Remote-exec transport for --hosts: ssh, local or module:Class (default from config: " +
+                   "fanout_transport)")
+@click.option('--per-gpu', is_flag=True,
+              help="Launch one container per GPU (or per --gpus-per-worker GPUs) pinned to the CPUs and NUMA " +
+                   "node the GPUs are attached to")
+@click.option('--gpus-per-worker', type=int, default=1, help="GPUs given to each --per-gpu worker")
+@click.option('--profile', 'profile_path', type=click.Path(dir_okay=False), default=None,
+              help="Time each launch phase, including the in-container bootstrap, and write a Chrome trace " +
+                   "to PROFILE_PATH; implies --no-exec")
+@click.option('--startup-report', is_flag=True, expose_value=False, is_eager=True, callback=startup_report,
+              help="Report the import time of the luda entry point against its cold-start budget and exit")
 @click.argument('docker_args', nargs=-1, type=click.UNPROCESSED)
-def main(docker_args, display, docker, dev, rm=None, detach=None, tty=None, stdin=None, config_path=None,
-         template=None, template_path=None, work=None, home=None, volume=None, nccl=True):
-    """Console script for luda.
+def run(docker_args, display, docker, dev, rm=None, detach=None, tty=None, stdin=None, config_path=None,
+         template=None, template_path=None, work=None, home=None, volume=None, nccl=True, exec_=True,
+         backend=None, identity=None, session=False, profile_path=None, hostfile=None, transport=None,
+         per_gpu=False, gpus_per_worker=1, resources=None, stage=(), prefetch=(), intermediates=None):
+    """Launch a container as the host user.
 
     For best results, use a `--` before the image name to ensure all arguments after the image are ignored by luda.
     """
-    config = read_config(config_path)
+    # the launch machinery is imported by the command that needs it, not by every `luda` invocation
+    from .launch import build_plan
+    from .luda import Volume
+    from .trace import span
+    tracer = None
+    if profile_path is not None:
+        from .trace import start_tracing
+        tracer = start_tracing()
+        exec_ = False
+
+    with span("read_config"):
+        config = read_config(config_path)
     exclusive(click.get_current_context().params, ['detach', 'rm'], 'd and rm are mutually exclusive')
 
-    # if no run options are given, set defaults
-    if not (rm or detach or tty or stdin):
-        rm = True
-        tty = True
-        stdin = True
-
-    # get some data about the user: name, uid, gid
-    import getpass
-    from pwd import getpwnam
-    import grp
-
-    user = getpass.getuser()
-    uid = getpwnam(user).pw_uid
-    gid = getpwnam(user).pw_gid
-    group = grp.getgrgid(gid).gr_name
-
-    # get bootstrap directory
-    import luda
-    bootstrap_path = os.path.join(os.path.dirname(luda.__file__), "bootstrap")
-    bootstrap_vol = Volume(bootstrap_path, "/bootstrap", "ro")
-
-    # prefer nvidia-docker over docker
-    exe = which("nvidia-docker") or "docker"
-    args = ["run"]
-
-    # run arguments
-    if rm:
-        args.append("--rm")
-    if detach:
-        args.append("-d")
-    if tty:
-        args.append("-t")
-    if stdin:
-        args.append("-i")
-
-    if nccl:
-      args.append("--shm-size=1g")
-      args.append("--ulimit")
-      args.append("memlock=-1")
-    
-    # override the entrypoint with luda's custom bootstrap
-    entrypoint_str = " --entrypoint /bootstrap/init.sh" \
-                     " --env HOST_USER_ID={uid}" \
-                     " --env HOST_GROUP_ID={gid}" \
-                     " --env HOST_USER={user}"\
-                     " --env HOST_GROUP={group}".format(**locals())
-    args.append(bootstrap_vol.string)
-    args.append(entrypoint_str)
-
-    # map in the user's home directory [optional]
-    if home:
-        home_vol = Volume("~", "/home/{0}".format(user))
-        if home_vol.host_path not in [v.host_path for v in volume]:
-            args.append(home_vol.string)
-
-    # map in the current working directory - can be overridden or ignored
-    work_vol = None
-    if work is None:
-        work_vol = Volume(os.getcwd(), "/work")
-    elif work.lower() != "none":
-        work_vol = Volume.fromString(work)
-    if work_vol:
-        args.append("{0} --workdir {1}".format(work_vol.string, work_vol.container_path))
-
-    if display:
-        args.append(add_display())
-
-    # look at the remaining arugments to find the container image name
-    image_and_args = ()
-    docker_args_iter = iter(docker_args)
-
-    # Remove pairs of arguments that start before the docker image
-    for d_arg in docker_args_iter:
-        if not image_and_args and d_arg.strip().startswith("-"):
-            # skip the next two
-            next(docker_args_iter, None)
-            continue
-
-        # otherwise, add it to the image and image args
-        image_and_args += (d_arg,)
-
-    # expand image_name if abbreviations are present
-    abbreviations = config.get("abbreviations", {})
-    image_name = expand_abbreviations(image_and_args[0], abbreviations)
-
-    # Determine if the container image has an entrypoint
-    ep_str = subprocess.Popen([exe, 'inspect', '-f "{{.Config.Entrypoint}}"', image_name],
-                                  stdout=subprocess.PIPE).stdout.read().decode()
-    ep_str = parse_tuple(ep_str)
-
-    # if no default commands are given, inspect the container image for default commands
-    if len(image_and_args) == 1:
-        # outputs an array of cmds
-        curr_cmd = subprocess.Popen([exe, 'inspect', '-f "{{.Config.Cmd}}"', image_name],
-                                    stdout=subprocess.PIPE).stdout.read().decode()
-        # click.echo(curr_cmd)
-        curr_cmd = parse_tuple(curr_cmd)
-
-        if curr_cmd:
-            docker_args += (curr_cmd,)
-
-    # update the image_name in the actual argument list in case the image_name was abbreviated
-    docker_args = list(docker_args)
-    image_index = next((idx for idx, arg in enumerate(docker_args) if arg == image_and_args[0]), -1)
-    docker_args[image_index] = image_name
-
-    # if the container image contained an entrypoint, add it immediately after the image name
-    if ep_str and len(ep_str) > 0:
-        docker_args.insert(image_index+1, ep_str)
-
-    # generate dev template and adjust the image_name
-    if dev:
-        image = generate_dockerfile_extension(docker_args[image_index], "dev", template_path or config_path)
-        docker_args[image_index] = image
-
-    # generate templates in order they are entered on the commandline
-    for t in template:
-        image = generate_dockerfile_extension(docker_args[image_index], t, template_path or config_path)
-        docker_args[image_index] = image
-
-    # generate docker commandline and execute it (this should probably be an exec instead of a subprocess)
-    nvargs = [exe] + args + [v.string for v in volume] + docker_args
-    cmd = " ".join(nvargs)
-    click.echo(cmd)
-    subprocess.call(cmd, shell=True)
+    # fanned out ranks have no terminal
+    rm, detach, tty, stdin = launch_defaults(rm, detach, tty, stdin, interactive=hostfile is None and not per_gpu)
+
+    engine = get_backend(backend, config)
+    engine_errors = ()
+    if engine is not None:
+        from .engine import EngineError, UnsupportedOption
+        engine_errors = (EngineError,)
+
+    try:
+        with span("build_plan"):
+            plan = build_plan(docker_args, config, config_path=config_path, rm=rm, detach=detach, tty=tty,
+                              stdin=stdin, nccl=nccl, home=home, work=work, display=display, volume=volume,
+                              dev=dev, template=template, template_path=template_path, engine=engine,
+                              identity=identity, resources=resources, stage=stage,
+                              intermediates=intermediates)
+    except engine_errors as err:
+        raise click.ClickException(str(err))
+    except ValueError as err:
+        raise click.UsageError(str(err))
+
+    if (hostfile is not None or per_gpu) and session:
+        raise click.UsageError("--session cannot be combined with --hosts or --per-gpu")
+    if hostfile is not None:
+        if per_gpu:
+            raise click.UsageError("--hosts and --per-gpu are mutually exclusive")
+        sys.exit(launch_hosts(plan, hostfile, transport, config))
+    if per_gpu:
+        sys.exit(launch_per_gpu(plan, gpus_per_worker, config))
+
+    if session:
+        # sessions are driven through the docker CLI
+        from .launch import identity_mode
+        from .session import SessionError, SessionManager
+        manager = SessionManager(plan.exe, ttl=config.get("session_ttl", 1800), limit=config.get("max_sessions", 4))
+        try:
+            with span("session attach"):
+                plan = manager.attach(plan, identity_mode(identity, config), tty=tty, stdin=stdin, detach=detach)
+        except SessionError as err:
+            raise click.ClickException(str(err))
+        engine = None
+
+    marks_dir = None
+    if tracer is not None and not session:
+        # the bootstrap appends its phase marks to a file in this directory
+        import tempfile
+        from .trace import CONTAINER_PROFILE_DIR, MARKS_FILE
+        marks_dir = tempfile.mkdtemp(prefix="luda-profile-")
+        plan.add_volume(Volume(marks_dir, CONTAINER_PROFILE_DIR))
+        plan.add_env("LUDA_PROFILE", "{0}/{1}".format(CONTAINER_PROFILE_DIR, MARKS_FILE))
+
+    # print the docker commandline, then run it over the API backend or replace
+    # luda with docker (or wait on it with --no-exec)
+    click.echo(str(plan))
+    prefetch_paths = plan.prefetch + [os.path.abspath(path) for path in prefetch]
+    if prefetch_paths:
+        from .prefetch import start_prefetch
+        from .resources import parse_size
+        budget = config.get("prefetch_budget")
+        log_path = start_prefetch(prefetch_paths, parse_size(budget) if budget else None,
+                                  config.get("prefetch_concurrency", 8), detach=exec_ and engine is None)
+        click.echo("luda: prefetching {0} path(s) into the page cache; progress in {1}".format(
+            len(prefetch_paths), log_path), err=True)
+    exit_code = None
+    launched = time.time()
+    if engine is not None:
+        try:
+            with span("docker run (api)"):
+                exit_code = engine.run(plan)
+        except UnsupportedOption as err:
+            click.echo("luda: {0}; using the docker CLI".format(err), err=True)
+        except EngineError as err:
+            raise click.ClickException(str(err))
+    if exit_code is None:
+        sys.stdout.flush()
+        with span("docker exec" if session else "docker run"):
+            exit_code = plan.execute(exec_=exec_)
+
+    if tracer is not None:
+        write_profile(tracer, profile_path, marks_dir, launched)
+    sys.exit(exit_code)
+
+
+def launch_hosts(plan, hostfile, transport, config):
+    """Fans `plan` out to the hosts in `hostfile`; returns the exit code for luda."""
+    from .fanout import fan_out, format_results, get_transport, read_hostfile
+    try:
+        hosts = read_hostfile(hostfile)
+        transport = get_transport(transport or config.get("fanout_transport", "ssh"))
+    except (ImportError, AttributeError, ValueError) as err:
+        raise click.UsageError(str(err))
+    click.echo(str(plan))
+    results = fan_out(plan, hosts, transport, master_port=config.get("master_port", 29500), echo=click.echo)
+    click.echo(format_results(results), err=True)
+    return 0 if all(r.ok for r in results) else 1
+
+
+def launch_per_gpu(plan, gpus_per_worker, config):
+    """Runs one worker per GPU group on this node; returns the exit code for luda."""
+    from .fanout import LocalTransport, fan_out, format_results
+    from .topology import get_topology, gpu_groups, group_args
+    try:
+        topology = get_topology(config.get("topology", "sysfs"), config.get("sysfs_root", "/"))
+        groups = gpu_groups(topology.gpus(), gpus_per_worker)
+    except (ImportError, AttributeError, ValueError) as err:
+        raise click.UsageError(str(err))
+    if not groups:
+        raise click.UsageError("--per-gpu: no GPUs found")
+    click.echo(str(plan))
+    results = fan_out(plan, ["localhost"] * len(groups), LocalTransport(),
+                      master_port=config.get("master_port", 29500), echo=click.echo,
+                      rank_args=[group_args(group) for group in groups])
+    click.echo(format_results(results), err=True)
+    return 0 if all(r.ok for r in results) else 1
+
+
+def write_profile(tracer, profile_path, marks_dir, launched):
+    """Adds the bootstrap's marks to the trace, writes it and prints a summary."""
+    import shutil
+    from .trace import stop_tracing, MARKS_FILE
+    if marks_dir is not None:
+        tracer.add_container_marks(os.path.join(marks_dir, MARKS_FILE), launched, time.time())
+        shutil.rmtree(marks_dir, ignore_errors=True)
+    stop_tracing()
+    tracer.write(profile_path)
+    click.echo(tracer.summary(), err=True)
+    click.echo("luda: trace written to {0}".format(profile_path), err=True)
+
+
+@main.command()
+@click.option('--socket', 'socket_path', default=None,
+              help="Unix socket to listen on. Default: $LUDA_DAEMON_SOCKET, $XDG_RUNTIME_DIR/luda.sock or "
+                   "$TMPDIR/luda-<uid>/luda.sock")
+@click.option('-c', '--config_path', default=None, help="Location of luda config files")
+@click.option('--stop', is_flag=True, help="Stop the daemon listening on the socket")
+def daemon(socket_path=None, config_path=None, stop=False):
+    """Serve launch plans to the `luda` client over a Unix socket.
+
+    The daemon keeps imports, config, the user's identity and the docker
+    connection warm, so launches skip the interpreter's cold start work.
+    """
+    from .daemon import DaemonError, LudaDaemon, stop as stop_daemon
+    if stop:
+        if not stop_daemon(socket_path):
+            raise click.ClickException("no luda daemon is listening")
+        return
+    try:
+        server = LudaDaemon(socket_path, config_path)
+    except DaemonError as err:
+        raise click.ClickException(str(err))
+    click.echo("luda: daemon listening on {0}".format(server.socket_path), err=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+
+@main.command()
+@click.argument('manifest', type=click.Path(exists=True, dir_okay=False))
+@click.option('-j', '--jobs', 'concurrency', type=int, default=None,
+              help="Maximum number of containers running at once (default from config: batch_concurrency)")
+@click.option('--template-path', type=click.Path(exists=True, dir_okay=True, file_okay=False, resolve_path=True),
+              help="Customer directory containing templates.")
+@click.option('-c', '--config_path', default=None, help="Location of luda config files")
+@click.option('--backend', type=click.Choice(['cli', 'api']), default=None,
+              help="Talk to docker through its CLI or directly via the Engine API socket")
+@click.option('--log-dir', type=click.Path(file_okay=False), default=None,
+              help="Write each job's output to LOG_DIR/<job>.log instead of the terminal")
+@click.option('--json', 'as_json', is_flag=True, help="Print the results as JSON")
+def batch(manifest, concurrency=None, template_path=None, config_path=None, backend=None, log_dir=None,
+          as_json=False):
+    """Run the jobs in a YAML, JSON or JSONL manifest.
+
+    Every distinct image and template combination is resolved once, then the
+    jobs run with at most `--jobs` containers at a time.
+    """
+    import json
+    import time
+    from .batch import load_jobs, run_batch, format_results
+
+    config = read_config(config_path)
+    concurrency = concurrency or config.get("batch_concurrency", 4)
+    engine = get_backend(backend, config)
+    try:
+        jobs = load_jobs(manifest)
+    except (ValueError, TypeError) as err:
+        raise click.UsageError("{0}: {1}".format(manifest, err))
+
+    def report(result):
+        if not as_json:
+            status = result.exit_code if result.error is None else result.error
+            click.echo("luda: {0} finished ({1}) in {2:.2f} s".format(result.job.name, status, result.wall_time),
+                       err=True)
+
+    start = time.time()
+    results = run_batch(jobs, config, concurrency, config_path=config_path, template_path=template_path,
+                        engine=engine, log_dir=log_dir, on_done=report)
+    elapsed = time.time() - start
+    if as_json:
+        click.echo(json.dumps({"elapsed": round(elapsed, 3), "concurrency": concurrency,
+                               "jobs": [r.toDict() for r in results]}, indent=2))
+    else:
+        click.echo(format_results(results, elapsed, concurrency))
+    sys.exit(0 if all(r.ok for r in results) else 1)
+
+
+@main.command()
+@click.argument('images', nargs=-1)
+@click.option('-t', '--template', 'templates', multiple=True,
+              help="Template to build for every image; may be repeated (default from config: prebuild.templates)")
+@click.option('-j', '--jobs', 'concurrency', type=int, default=None,
+              help="Maximum number of builds running at once (default from config: prebuild.concurrency)")
+@click.option('--template-path', type=click.Path(exists=True, dir_okay=True, file_okay=False, resolve_path=True),
+              help="Customer directory containing templates.")
+@click.option('-c', '--config_path', default=None, help="Location of luda config files")
+@click.option('--backend', type=click.Choice(['cli', 'api']), default=None,
+              help="Talk to docker through its CLI or directly via the Engine API socket")
+@click.option('--force', is_flag=True, help="Rebuild even if the build manifest is up to date")
+@click.option('--json', 'as_json', is_flag=True, help="Print the summary as JSON")
+def prebuild(images, templates=(), concurrency=None, template_path=None, config_path=None, backend=None,
+             force=False, as_json=False):
+    """Build luda/<base>:<template> for every IMAGE and template.
+
+    Images may use abbreviations, e.g. `nv:pytorch:17.10`.  Without
+    arguments the `prebuild` section of config.yml supplies the images and
+    templates.
+    """
+    import json
+    import time
+    from .prebuild import prebuild as run_prebuild, format_summary
+
+    config = read_config(config_path)
+    settings = config.get("prebuild", {})
+    images = list(images) or settings.get("images", [])
+    templates = list(templates) or settings.get("templates", [])
+    concurrency = concurrency or settings.get("concurrency", 2)
+    if not images or not templates:
+        raise click.UsageError("prebuild needs at least one image and one template")
+    engine = get_backend(backend, config)
+
+    def report(result):
+        if not as_json:
+            click.echo("luda: {0} {1} in {2:.2f} s".format(result.image, result.status, result.elapsed), err=True)
+
+    start = time.time()
+    results = run_prebuild(images, templates, config, concurrency, config_path=config_path,
+                           template_path=template_path, engine=engine, force=force, on_done=report)
+    elapsed = time.time() - start
+    if as_json:
+        click.echo(json.dumps({"elapsed": round(elapsed, 3), "concurrency": concurrency,
+                               "images": [r.toDict() for r in results]}, indent=2))
+    else:
+        click.echo(format_summary(results, elapsed, concurrency))
+    sys.exit(0 if all(r.error is None for r in results) else 1)
+
+
+@main.command()
+@click.argument('images', nargs=-1)
+@click.option('-t', '--template', 'templates', multiple=True,
+              help="Template applied (in order) to every IMAGE; the template images are pinned too")
+@click.option('--lockfile', 'lockfile_path', type=click.Path(dir_okay=False), default=None,
+              help="Lockfile to update. Default: the `lockfile` config key (luda.lock) in the current directory")
+@click.option('--pull/--no-pull', default=True, help="Pull tags before pinning them. Default: True")
+@click.option('-j', '--jobs', 'concurrency', type=int, default=4, help="Images resolved and built at once")
+@click.option('--template-path', type=click.Path(exists=True, dir_okay=True, file_okay=False, resolve_path=True),
+              help="Customer directory containing templates.")
+@click.option('-c', '--config_path', default=None, help="Location of luda config files")
+@click.option('--backend', type=click.Choice(['cli', 'api']), default=None,
+              help="Talk to docker through its CLI or directly via the Engine API socket")
+def lock(images, templates=(), lockfile_path=None, pull=True, concurrency=4, template_path=None, config_path=None,
+         backend=None):
+    """Pin IMAGEs and their template images to content digests.
+
+    Launches from a directory with a lockfile run the pinned digests
+    instead of the tags.  Without arguments, every image already in the
+    lockfile is resolved again.
+    """
+    from .lockfile import LOCKFILE, Lockfile, lock_images
+
+    config = read_config(config_path)
+    path = lockfile_path or os.path.join(os.getcwd(), config.get("lockfile") or LOCKFILE)
+    try:
+        lockfile = Lockfile.fromFile(path)
+        specs = [(image, list(templates)) for image in images] or lockfile.specs()
+        if not specs:
+            raise click.UsageError("{0} is empty; name the images to lock".format(path))
+        lock_images(specs, config, lockfile, config_path=config_path, template_path=template_path,
+                    engine=get_backend(backend, config), pull=pull, concurrency=concurrency)
+    except ValueError as err:
+        raise click.ClickException(str(err))
+    lockfile.write()
+    for image in sorted(lockfile.images):
+        click.echo("{0} -> {1}".format(image, lockfile.images[image]["digest"]))
+    click.echo("luda: wrote {0}".format(path), err=True)
+
+
+@main.command()
+@click.option('--budget', default=None,
+              help="Disk space the images luda built may use, e.g. 200g. Default: config `image_budget`")
+@click.option('-n', '--dry-run', is_flag=True, help="Only print the images that would be removed")
+@click.option('-c', '--config_path', default=None, help="Location of luda config files")
+@click.option('--json', 'as_json', is_flag=True, help="Print the result as JSON")
+def gc(budget=None, dry_run=False, config_path=None, as_json=False):
+    """Remove least recently used luda/* images to stay within a disk budget.
+
+    Images that containers were created from and images other luda images
+    are built on are kept.
+    """
+    import json
+    from .gc import ImageCollector, format_result
+    from .launch import which
+    from .resources import parse_size
+
+    config = read_config(config_path)
+    budget = budget or config.get("image_budget")
+    if not budget:
+        raise click.UsageError("no disk budget; pass --budget or set image_budget in config.yml")
+    try:
+        budget = parse_size(budget)
+    except ValueError:
+        raise click.UsageError("cannot parse budget {0!r}".format(budget))
+    result = ImageCollector(which("nvidia-docker") or "docker", budget).collect(dry_run=dry_run)
+    if as_json:
+        click.echo(json.dumps(result.toDict(), indent=2))
+    else:
+        click.echo(format_result(result))
+    sys.exit(1 if result.failed else 0)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+"""
+Thin client of the resident luda daemon (`luda.daemon`).
+
+This is the `luda` console script.  It only imports the standard library,
+asks the daemon listening on `socket_path()` for the launch plan and
+replaces itself with docker, so a warm launch costs a socket round trip
+instead of importing click and resolving the image.  Without a daemon,
+with `LUDA_NO_DAEMON` set, or for anything the daemon leaves to the full
+CLI, it runs `luda.cli.main` in-process.
+
+The client runs whatever command the daemon replies with, so it only talks
+to a socket that is owned by the user, sits in a directory nobody else can
+write to and whose peer runs as the user.
+"""
+
+import json
+import os
+import socket
+import stat
+import struct
+import sys
+
+
+# subcommands that always run in-process
+LOCAL_COMMANDS = ("batch", "prebuild", "daemon", "lock", "gc")
+
+# seconds to wait for a launch plan; the daemon leaves slow launches (image builds) to the client
+REQUEST_TIMEOUT = 10
+
+
+def socket_path():
+    """
+    `$LUDA_DAEMON_SOCKET`, else `$XDG_RUNTIME_DIR/luda.sock`, else
+    `luda.sock` in the private directory `$TMPDIR/luda-<uid>`.
+    """
+    path = os.environ.get("LUDA_DAEMON_SOCKET")
+    if path:
+        return path
+    runtime = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime:
+        return os.path.join(runtime, "luda.sock")
+    return os.path.join(os.environ.get("TMPDIR") or "/tmp", "luda-{0}".format(os.getuid()), "luda.sock")
+
+
+def trusted_socket(path):
+    """
+    True if `path` is a socket owned by the user in a directory owned by the
+    user (or root) that no one else can write to.
+    """
+    try:
+        info = os.lstat(path)
+        parent = os.stat(os.path.dirname(os.path.abspath(path)))
+    except OSError:
+        return False
+    return stat.S_ISSOCK(info.st_mode) and info.st_uid == os.getuid() and \
+        parent.st_uid in (os.getuid(), 0) and not parent.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+
+def peer_uid(sock):
+    """uid of the process on the other end of a Unix socket, or None where SO_PEERCRED is unavailable."""
+    if not hasattr(socket, "SO_PEERCRED"):
+        return None
+    creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+    return struct.unpack("3i", creds)[1]
+
+
+def request(path, payload, timeout=None):
+    """
+    Sends one request to the daemon on `path` and returns its reply.
+    Raises OSError if the daemon does not run as the user.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(timeout)
+        sock.connect(path)
+        uid = peer_uid(sock)
+        if uid is not None and uid != os.getuid():
+            raise OSError("{0} is served by uid {1}".format(path, uid))
+        sock.sendall(json.dumps(payload).encode("utf-8") + b"\n")
+        data = b""
+        while not data.endswith(b"\n"):
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+    finally:
+        sock.close()
+    return json.loads(data.decode("utf-8"))
+
+
+def main(args=None):
+    args = sys.argv[1:] if args is None else list(args)
+    path = socket_path()
+    reply = None
+    if not os.environ.get("LUDA_NO_DAEMON") and args[:1] != ["--help"] and \
+            not (args and args[0] in LOCAL_COMMANDS) and trusted_socket(path):
+        try:
+            reply = request(path, {"op": "run", "args": args, "cwd": os.getcwd(), "env": dict(os.environ)},
+                            timeout=REQUEST_TIMEOUT)
+        except (IOError, OSError, ValueError):
+            reply = None  # no (trustworthy) daemon behind the socket, or it did not answer in time
+    if reply is None or "command" not in reply:
+        from .cli import main as cli_main
+        return cli_main(args=args, prog_name="luda")
+
+    sys.stdout.write(reply["command"] + "\n")
+    if "container" in reply:
+        sys.stdout.write(reply["container"] + "\n")
+        sys.exit(0)
+    sys.stdout.flush()
+    argv = reply["argv"]
+    if reply.get("exec", True):
+        os.execvp(argv[0], argv)
+    import subprocess
+    sys.exit(subprocess.call(argv))
@@ -2,13 +2,20 @@
 
 """Global configuration handling."""
 
-import collections
 import copy
+import hashlib
 import io
+import json
+import marshal
 import os
+import sys
+
+try:
+    from collections.abc import Mapping
+except ImportError:  # python 2
+    from collections import Mapping
 
 import click
-import poyo
 
 
 APP_NAME = 'luda'
@@ -19,34 +26,166 @@ BUILTIN_ABBREVIATIONS = {
 
 DEFAULT_CONFIG = {
     'abbreviations': BUILTIN_ABBREVIATIONS,
+    # seconds a tag -> image id mapping is trusted before re-inspecting; luda's own
+    # pulls and builds refresh it at once, so only a tag moved outside luda (a manual
+    # `docker pull`/`docker build`) can be served stale that long.  0 always re-inspects
+    'image_cache_ttl': 300,
+    # 'cli' shells out to docker/nvidia-docker, 'api' talks to the daemon socket directly
+    'backend': 'cli',
+    # containers `luda batch` runs at once
+    'batch_concurrency': 4,
+    # 'bootstrap' creates the host user at every container start, 'baked' builds it into a cached image,
+    # 'user' skips the bootstrap and runs as --user uid:gid with generated passwd/group files
+    'identity': 'bootstrap',
+    # seconds an idle `--session` container is kept after its last launch, and sessions kept per user
+    'session_ttl': 1800,
+    'max_sessions': 4,
+    # remote-exec transport of `luda --hosts` (ssh, local or module:Class) and the rendezvous port
+    'fanout_transport': 'ssh',
+    'master_port': 29500,
+    # GPU topology source of `--per-gpu` (sysfs or module:Class) and the root it reads from
+    'topology': 'sysfs',
+    'sysfs_root': '/',
+    # profile sizing shm, IPC, ulimits and hugepages for --nccl; see luda.resources
+    'resource_profile': 'nccl',
+    # `--stage`: node-local staging area (default $TMPDIR/luda-staging-<uid>), its size (default 90% of the
+    # filesystem), 'lru' or 'none' eviction, seconds unused entries are kept (None: forever), parallel copies
+    'staging_dir': None,
+    'staging_budget': None,
+    'staging_eviction': 'lru',
+    'staging_ttl': None,
+    'staging_concurrency': 8,
+    # bytes read into the page cache by `prefetch` volumes (default: half the available memory), parallel reads
+    'prefetch_budget': None,
+    'prefetch_concurrency': 8,
+    # lockfile in the work directory pinning images to digests (`luda lock`); empty to ignore lockfiles
+    'lockfile': 'luda.lock',
+    # disk budget of the images luda builds (`luda gc`), and whether launches collect when it is exceeded
+    'image_budget': None,
+    'gc_auto': False,
+    # tag every image of a `--template` chain instead of building the chain as one multi-stage image
+    'template_intermediates': False,
 }
 
 
+# layered config files, merged in this order before the user's config.yml
+SYSTEM_CONFIG_FILE = '/etc/luda/config.yml'
+SITE_CONFIG_ENV = 'LUDA_SITE_CONFIG'
+
+
 def update(d, u):
-    for k, v in u.iteritems():
-        if isinstance(v, collections.Mapping):
+    for k, v in u.items():
+        if isinstance(v, Mapping):
             r = update(d.get(k, {}), v)
             d[k] = r
         else:
             d[k] = u[k]
     return d
 
-def read_config(config_path):
 
+def config_files(config_path):
+    """
+    The config files merged over DEFAULT_CONFIG, lowest precedence first:
+    system (/etc/luda/config.yml), site ($LUDA_SITE_CONFIG) and user
+    (`config_path`/config.yml).
+    """
     if not config_path:
         config_path = click.get_app_dir(APP_NAME)
     else:
         config_path = os.path.abspath(config_path)
 
-    config_file = os.path.join(config_path, 'config.yml')
-    config_dict = copy.copy(DEFAULT_CONFIG)
-    if os.path.exists(config_file):
-        with io.open(config_file, encoding='utf-8') as file_handle:
-            yaml_dict = poyo.parse_string(file_handle.read())
-        update(config_dict, yaml_dict)
+    files = [SYSTEM_CONFIG_FILE]
+    if os.environ.get(SITE_CONFIG_ENV):
+        files.append(os.path.abspath(os.environ[SITE_CONFIG_ENV]))
+    files.append(os.path.join(config_path, 'config.yml'))
+    return files
+
+
+def file_signature(path):
+    """(path, mtime, size) of `path`, or (path, None, None) if it does not exist."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return [path, None, None]
+    return [path, st.st_mtime, st.st_size]
+
+
+def defaults_signature():
+    """
+    luda's version and a hash of DEFAULT_CONFIG (built-in abbreviations
+    included), so an upgrade that changes the defaults invalidates
+    compiled configs.
+    """
+    from . import __version__
+    defaults = json.dumps(DEFAULT_CONFIG, sort_keys=True, default=repr).encode('utf-8')
+    return [__version__, hashlib.sha1(defaults).hexdigest()]
+
+
+def compile_config(files):
+    """Parses and deep-merges `files` over a copy of DEFAULT_CONFIG."""
+    config_dict = copy.deepcopy(DEFAULT_CONFIG)
+    for config_file in files:
+        if os.path.exists(config_file):
+            import poyo
+            with io.open(config_file, encoding='utf-8') as file_handle:
+                yaml_dict = poyo.parse_string(file_handle.read())
+            update(config_dict, yaml_dict or {})
+    return config_dict
+
+
+def compiled_config_file(files):
+    """
+    Location of the compiled config for a set of source files.  The
+    interpreter version is part of the name because marshal's format is
+    version specific.
+    """
+    key = hashlib.sha1("\0".join(files).encode('utf-8')).hexdigest()[:16]
+    name = "config-{0}-py{1}{2}.marshal".format(key, *sys.version_info[:2])
+    return os.path.join(get_cache_dir(), name)
+
+
+def read_config(config_path):
+    """
+    Returns the merged configuration.
+
+    The merged result is cached on disk with marshal together with the
+    mtime and size of every source file (including ones that do not exist
+    yet) and the defaults' signature; it is only re-parsed when one of them
+    changes.
+    """
+    files = config_files(config_path)
+    signature = [file_signature(f) for f in files] + [defaults_signature()]
+    compiled = compiled_config_file(files)
+    try:
+        with open(compiled, 'rb') as handle:
+            cached = marshal.load(handle)
+        if cached['sources'] == signature:
+            return cached['config']
+    except (IOError, OSError, EOFError, ValueError, TypeError, KeyError):
+        pass
+
+    config_dict = compile_config(files)
+    try:
+        from .utils import atomic_write
+        atomic_write(compiled, marshal.dumps({'sources': signature, 'config': config_dict}))
+    except (IOError, OSError, ValueError):
+        # unwritable cache or unmarshallable values: use the config uncached
+        pass
     return config_dict
 
 
+def get_cache_dir():
+    """
+    Directory holding luda's on-disk caches. `$LUDA_CACHE_DIR` wins, otherwise
+    `$XDG_CACHE_HOME/luda` (default `~/.cache/luda`).
+    """
+    cache_dir = os.environ.get('LUDA_CACHE_DIR')
+    if not cache_dir:
+        cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+        cache_dir = os.path.join(cache_home, APP_NAME)
+    return cache_dir
+
+
 def get_template_path(template_name, config_path):
 
     if not config_path:
@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+
+"""
+Build contexts for template images, assembled in memory.
+
+Only the files a Dockerfile can reach through COPY/ADD are sent to the
+builder, minus anything excluded by `.dockerignore`.  The archive of those
+files is cached by content hash, so a repeat build (e.g. the same template
+on a new base image) appends the rendered Dockerfile to a cached tarball
+instead of re-archiving the template directory.
+"""
+
+import io
+import json
+import os
+import posixpath
+import re
+import tarfile
+import time
+
+from .cache import hash_bytes, hash_files
+from .config import get_cache_dir
+from .utils import atomic_write, makedirs
+
+
+# number of cached context tarballs kept in `<cache_dir>/contexts`
+CONTEXT_CACHE_ENTRIES = 8
+
+
+def add_bytes(tar, name, data, mode=0o644):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mode = mode
+    info.mtime = int(time.time())
+    tar.addfile(info, io.BytesIO(data))
+
+
+def instructions(dockerfile):
+    """
+    Yields (INSTRUCTION, arguments) from a Dockerfile, joining continuation
+    lines and skipping comments.
+    """
+    pending = ""
+    for line in dockerfile.splitlines():
+        stripped = line.strip()
+        if not pending and (not stripped or stripped.startswith("#")):
+            continue
+        if stripped.endswith("\\"):
+            pending += stripped[:-1] + " "
+            continue
+        pending += stripped
+        instruction, _, args = pending.partition(" ")
+        pending = ""
+        yield instruction.upper(), args.strip()
+
+
+def split_flags(args):
+    """(leading `--flag` words, remaining arguments) of a COPY/ADD instruction."""
+    flags = []
+    args = args.strip()
+    while args.startswith("--"):
+        parts = args.split(None, 1)
+        flags.append(parts[0])
+        args = parts[1] if len(parts) > 1 else ""
+    return flags, args
+
+
+def copy_sources(dockerfile):
+    """
+    Source paths of every COPY/ADD instruction that reads from the build
+    context.  Returns None if a source cannot be determined statically
+    (e.g. it uses a variable), meaning the whole context is needed.
+    """
+    sources = []
+    for instruction, args in instructions(dockerfile):
+        if instruction not in ("COPY", "ADD"):
+            continue
+        flags, args = split_flags(args)
+        if any(f.startswith("--from") for f in flags):
+            continue
+        if args.startswith("["):
+            try:
+                words = json.loads(args)
+            except ValueError:
+                return None
+        else:
+            words = args.split()
+        for path in words[:-1]:
+            if instruction == "ADD" and re.match(r"^[a-z]+://", path):
+                continue
+            if "$" in path:
+                return None
+            sources.append(path)
+    return sources
+
+
+def prefix_sources(dockerfile, prefix):
+    """
+    `dockerfile` with the build context sources of its COPY/ADD
+    instructions moved below `prefix/`.  Rewritten instructions are joined
+    onto one line; every other line is kept as is.
+    """
+    lines = []
+    pending = []
+    for line in dockerfile.splitlines():
+        stripped = line.strip()
+        if not pending and (not stripped or stripped.startswith("#")):
+            lines.append(line)
+            continue
+        pending.append(line)
+        if stripped.endswith("\\"):
+            continue
+        joined = " ".join(part.strip()[:-1].strip() if part.strip().endswith("\\") else part.strip()
+                          for part in pending)
+        instruction, _, args = joined.partition(" ")
+        if instruction.upper() in ("COPY", "ADD"):
+            lines.append("{0} {1}".format(instruction, prefix_args(instruction.upper(), args.strip(), prefix)))
+        else:
+            lines.extend(pending)
+        pending = []
+    lines.extend(pending)
+    return "\n".join(lines)
+
+
+def prefix_args(instruction, args, prefix):
+    """The arguments of a COPY/ADD instruction with its context sources below `prefix/`."""
+    def move(path):
+        if instruction == "ADD" and re.match(r"^[a-z]+://", path):
+            return path
+        return posixpath.join(prefix, normalize(path))
+
+    flags, rest = split_flags(args)
+    if any(flag.startswith("--from") for flag in flags):
+        return args
+    if rest.startswith("["):
+        words = json.loads(rest)
+        return " ".join(flags + [json.dumps([move(path) for path in words[:-1]] + words[-1:])])
+    words = rest.split()
+    return " ".join(flags + [move(path) for path in words[:-1]] + words[-1:])
+
+
+def translate(pattern):
+    """
+    Regular expression for a docker path pattern: `*` and `?` stay within a
+    path component, `**` matches any number of components.
+    """
+    regex = ""
+    idx = 0
+    while idx < len(pattern):
+        char = pattern[idx]
+        if pattern.startswith("**", idx):
+            regex += ".*"
+            idx += 2
+            if pattern.startswith("/", idx):
+                regex += "/?"
+                idx += 1
+            continue
+        if char == "*":
+            regex += "[^/]*"
+        elif char == "?":
+            regex += "[^/]"
+        elif char == "[":
+            end = pattern.find("]", idx)
+            if end == -1:
+                regex += re.escape(char)
+            else:
+                regex += pattern[idx:end + 1].replace("[!", "[^")
+                idx = end
+        else:
+            regex += re.escape(char)
+        idx += 1
+    return re.compile("^" + regex + "$")
+
+
+def normalize(path):
+    path = posixpath.normpath(path.replace(os.sep, "/")).lstrip("/")
+    return "" if path == "." else path
+
+
+def matches(regex, relpath):
+    """True if `relpath` or one of its parent directories matches."""
+    parts = relpath.split("/")
+    return any(regex.match("/".join(parts[:n])) for n in range(1, len(parts) + 1))
+
+
+class DockerIgnore(object):
+    """Exclusion rules read from a `.dockerignore` file; the last matching rule wins."""
+
+    def __init__(self, patterns=()):
+        self.rules = []
+        for pattern in patterns:
+            pattern = pattern.strip()
+            if not pattern or pattern.startswith("#"):
+                continue
+            include = pattern.startswith("!")
+            pattern = normalize(pattern[1:] if include else pattern)
+            if pattern:
+                self.rules.append((translate(pattern), include))
+
+    @classmethod
+    def fromDirectory(cls, path):
+        ignore_file = os.path.join(path, ".dockerignore")
+        if not os.path.isfile(ignore_file):
+            return cls()
+        with io.open(ignore_file, encoding="utf-8") as handle:
+            return cls(handle.read().splitlines())
+
+    def excluded(self, relpath):
+        excluded = False
+        for regex, include in self.rules:
+            if matches(regex, relpath):
+                excluded = not include
+        return excluded
+
+
+def list_files(root):
+    """Relative paths of every file below `root`."""
+    files = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            files.append(normalize(os.path.relpath(os.path.join(dirpath, name), root)))
+    return files
+
+
+def select_files(context_dir, dockerfile, skip=()):
+    """
+    Relative paths of the files in `context_dir` the Dockerfile's COPY/ADD
+    instructions can read, honouring `.dockerignore`.
+    """
+    ignore = DockerIgnore.fromDirectory(context_dir)
+    candidates = [f for f in list_files(context_dir) if f not in skip and not ignore.excluded(f)]
+    sources = copy_sources(dockerfile)
+    if sources is None:
+        return candidates
+    regexes = [translate(normalize(source)) for source in sources if normalize(source)]
+    if len(regexes) < len(sources):
+        # a source of `.` copies the whole context
+        return candidates
+    return [f for f in candidates if any(matches(regex, f) for regex in regexes)]
+
+
+class BuildContext(object):
+    """
+    The minimal build context of a rendered template.
+
+    :param context_dir: template directory, or None for a context without files
+    :param dockerfile_name: name the rendered Dockerfile gets in the archive
+    :param dockerfile: rendered Dockerfile contents
+    :param memo: file digest memo (see `luda.cache.hash_file`)
+    """
+
+    def __init__(self, context_dir, dockerfile_name, dockerfile, memo=None):
+        self.context_dir = context_dir
+        self.dockerfile_name = dockerfile_name
+        self.dockerfile = dockerfile
+        self.files = []
+        if context_dir is not None:
+            self.files = select_files(context_dir, dockerfile, skip=(dockerfile_name,))
+        self.digest = hash_files(context_dir, self.files, memo)
+
+    def _archive_files(self):
+        buf = io.BytesIO()
+        with tarfile.open(fileobj=buf, mode="w") as tar:
+            for relpath in self.files:
+                info = tar.gettarinfo(os.path.join(self.context_dir, relpath), arcname=relpath)
+                info.uid = info.gid = 0
+                info.uname = info.gname = ""
+                with open(os.path.join(self.context_dir, relpath), "rb") as handle:
+                    tar.addfile(info, handle)
+        return buf.getvalue()
+
+    def files_tarball(self, cache_dir=None, keep=CONTEXT_CACHE_ENTRIES):
+        """
+        Archive of the selected files, read from `<cache_dir>/contexts` when
+        an archive with the same content hash exists.
+        """
+        contexts_dir = os.path.join(cache_dir or get_cache_dir(), "contexts")
+        path = os.path.join(contexts_dir, self.digest.replace("sha256:", "") + ".tar")
+        if os.path.exists(path):
+            os.utime(path, None)
+            with open(path, "rb") as handle:
+                return handle.read()
+        data = self._archive_files()
+        atomic_write(path, data)
+        evict(contexts_dir, keep)
+        return data
+
+    def tarball(self, cache_dir=None):
+        """The complete build context: the selected files plus the rendered Dockerfile."""
+        buf = io.BytesIO(self.files_tarball(cache_dir))
+        with tarfile.open(fileobj=buf, mode="a") as tar:
+            add_bytes(tar, self.dockerfile_name, self.dockerfile.encode("utf-8"))
+        return buf.getvalue()
+
+
+def evict(directory, keep):
+    """Removes all but the `keep` most recently used tarballs in `directory`."""
+    makedirs(directory)
+    entries = [os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(".tar")]
+    entries.sort(key=lambda path: os.path.getmtime(path), reverse=True)
+    for path in entries[keep:]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class FusedContext(object):
+    """
+    The build context of a multi-stage Dockerfile fused from several
+    templates: the files of each stage's BuildContext are placed below the
+    stage's prefix.
+
+    :param stages: list of (prefix, BuildContext)
+    :param dockerfile_name: name the fused Dockerfile gets in the archive
+    :param dockerfile: fused Dockerfile contents
+    """
+
+    def __init__(self, stages, dockerfile_name, dockerfile):
+        self.stages = stages
+        self.dockerfile_name = dockerfile_name
+        self.dockerfile = dockerfile
+        self.digest = hash_bytes(json.dumps([[prefix, context.digest] for prefix, context in stages]).encode("utf-8"))
+
+    def tarball(self, cache_dir=None):
+        buf = io.BytesIO()
+        with tarfile.open(fileobj=buf, mode="w") as tar:
+            for prefix, context in self.stages:
+                # each stage's files come from its own cached archive
+                with tarfile.open(fileobj=io.BytesIO(context.files_tarball(cache_dir))) as files:
+                    for member in files.getmembers():
+                        data = files.extractfile(member) if member.isfile() else None
+                        member.name = posixpath.join(prefix, member.name)
+                        tar.addfile(member, data)
+            add_bytes(tar, self.dockerfile_name, self.dockerfile.encode("utf-8"))
+        return buf.getvalue()
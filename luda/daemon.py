@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+
+"""
+Resident luda daemon.
+
+`luda daemon` keeps what every launch otherwise redoes in a fresh
+interpreter warm in one long-lived process: the imported modules (click,
+jinja2/j2docker, docker-py), the parsed config, the user's identity, the
+docker executable and the API backend's connection.  It serves launch
+plans over a Unix socket, created with mode 0600 so a daemon serves its
+own user only, to the thin client in `luda.client`.
+
+The protocol is one JSON object per line in each direction and one request
+per connection:
+
+    {"op": "run", "args": [...], "cwd": "...", "env": {...}}  ->  {"command": "...", "argv": [...], "exec": true}
+                                                 |  {"command": "...", "container": "<id>"}
+                                                 |  {"fallback": true}
+    {"op": "ping"}                              ->  {"pid": 123, "version": "0.5.0"}
+    {"op": "shutdown"}                          ->  {"ok": true}
+
+A `fallback` reply asks the client to run the launch in-process: the
+daemon only handles plain launches and leaves everything that needs the
+client's terminal, environment or process (sessions, fan-outs, profiling,
+prefetch, `--display`) and every error to the full CLI, which reports it
+exactly as it would without a daemon.  A launch is resolved in the
+client's working directory and environment (config layers, cache
+directory, `HOME`, `PATH`, `-e VAR`), so it gets the plan the client would
+have built itself.  Launches that have to build an
+image are left to the client too, so the build output reaches the user's
+terminal and a long build does not hold up other clients.
+
+The socket lives in a directory only the user can write to; the client
+refuses sockets that are not (see `luda.client.trusted_socket`).
+"""
+
+import json
+import os
+import stat
+import threading
+import traceback
+
+try:
+    import socketserver
+    from io import StringIO
+except ImportError:  # python 2
+    import SocketServer as socketserver
+    from StringIO import StringIO
+
+from . import __version__
+from .client import request, socket_path as default_socket_path, trusted_socket
+from .utils import cd, environ, makedirs
+
+
+# `run` options the daemon leaves to the client
+LOCAL_OPTIONS = ("session", "hostfile", "per_gpu", "profile_path", "prefetch", "display", "stage")
+
+# arguments whose callbacks print to the terminal
+LOCAL_ARGS = ("--help", "--startup-report")
+
+
+class DaemonError(Exception):
+    pass
+
+
+def private_directory(path):
+    """Creates the directory `path` with mode 0700 if it is missing; raises DaemonError if others can write to it."""
+    if not os.path.isdir(path):
+        makedirs(os.path.dirname(path))
+        try:
+            os.mkdir(path, 0o700)
+        except OSError:
+            if not os.path.isdir(path):
+                raise
+    info = os.stat(path)
+    if info.st_uid not in (os.getuid(), 0) or info.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        raise DaemonError("{0} is writable by other users; refusing to serve from it".format(path))
+    return path
+
+
+class DaemonHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        try:
+            req = json.loads(self.rfile.readline().decode("utf-8"))
+        except ValueError:
+            reply = {"error": "malformed request"}
+        else:
+            reply = self.server.luda.dispatch(req)
+        self.wfile.write(json.dumps(reply).encode("utf-8") + b"\n")
+        if reply.get("ok") and req.get("op") == "shutdown":
+            # shutdown() waits for serve_forever, so it cannot run on the serving thread's behalf inline
+            threading.Thread(target=self.server.shutdown).start()
+
+
+class DaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class LudaDaemon(object):
+    """
+    :param socket_path: Unix socket to listen on; defaults to `luda.client.socket_path()`
+    :param config_path: location of luda config files, warmed at start
+    """
+
+    def __init__(self, socket_path=None, config_path=None):
+        from .config import read_config
+        from .launch import get_user_identity, which
+        self.socket_path = socket_path or default_socket_path()
+        self.config_path = config_path
+        # launches change directory to the client's cwd while they resolve, so one resolves at a time
+        self.lock = threading.Lock()
+        self.exe = which("nvidia-docker") or "docker"
+        get_user_identity()
+        read_config(config_path)
+        try:
+            import j2docker  # noqa: F401 -- warm the template build path
+        except ImportError:
+            pass
+        self.server = self._bind()
+
+    def _bind(self):
+        private_directory(os.path.dirname(os.path.abspath(self.socket_path)))
+        if os.path.lexists(self.socket_path):
+            if not trusted_socket(self.socket_path):
+                raise DaemonError("{0} exists and is not this user's socket".format(self.socket_path))
+            try:
+                request(self.socket_path, {"op": "ping"}, timeout=1)
+            except (IOError, OSError, ValueError):
+                os.remove(self.socket_path)  # left behind by a daemon that died
+            else:
+                raise DaemonError("a luda daemon is already listening on {0}".format(self.socket_path))
+        umask = os.umask(0o177)
+        try:
+            server = DaemonServer(self.socket_path, DaemonHandler)
+        finally:
+            os.umask(umask)
+        server.luda = self
+        return server
+
+    def serve_forever(self):
+        self.server.serve_forever()
+
+    def shutdown(self):
+        self.server.shutdown()
+
+    def close(self):
+        self.server.server_close()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+    def dispatch(self, req):
+        op = req.get("op")
+        if op == "ping":
+            return {"pid": os.getpid(), "version": __version__}
+        if op == "shutdown":
+            return {"ok": True}
+        if op == "run":
+            try:
+                return self.run(list(req.get("args") or []), req.get("cwd") or os.getcwd(), req.get("env"))
+            except Exception:
+                # whatever went wrong, the in-process CLI reports it properly
+                traceback.print_exc()
+                return {"fallback": True}
+        return {"error": "unknown op {0!r}".format(op)}
+
+    def run(self, args, cwd, env=None):
+        """
+        Resolves `luda run` arguments into the reply for the client.
+
+        :param env: the client's environment, in which the launch is resolved; None for the daemon's own
+        """
+        import click
+        from .cli import get_backend, launch_defaults, run
+        from .config import read_config
+        from .launch import build_plan, which
+        from .luda import BuildRequired, no_builds
+
+        if args[:1] == ["run"]:
+            args = args[1:]
+        if any(arg in LOCAL_ARGS for arg in args):
+            return {"fallback": True}
+
+        # the lock serialises the process-wide cwd and environment; staging and builds never run under it
+        with self.lock, cd(cwd), environ(env), no_builds():
+            try:
+                # paths given on the command line resolve against the client's cwd
+                params = run.make_context("luda", args).params
+                if any(params.get(name) for name in LOCAL_OPTIONS):
+                    return {"fallback": True}
+                rm, detach, tty, stdin = launch_defaults(params["rm"], params["detach"], params["tty"],
+                                                         params["stdin"])
+                if rm and detach:
+                    return {"fallback": True}
+                config = read_config(params["config_path"])
+                engine = get_backend(params["backend"], config)
+                if engine is not None and not detach:
+                    # attached API launches stream through this process
+                    return {"fallback": True}
+                # nvidia-docker or docker as found on the client's PATH
+                exe = which("nvidia-docker") or "docker"
+                plan = build_plan(params["docker_args"], config, config_path=params["config_path"], rm=rm,
+                                  detach=detach, tty=tty, stdin=stdin, nccl=params["nccl"], home=params["home"],
+                                  work=params["work"], volume=params["volume"], dev=params["dev"],
+                                  template=params["template"], template_path=params["template_path"],
+                                  exe=exe, engine=engine, identity=params["identity"],
+                                  resources=params["resources"], intermediates=params["intermediates"])
+            except (click.ClickException, click.exceptions.Exit, ValueError, BuildRequired):
+                return {"fallback": True}
+            if plan.prefetch:
+                return {"fallback": True}
+
+            if engine is not None:
+                from .engine import UnsupportedOption
+                stdout = StringIO()
+                try:
+                    engine.run(plan, stdout=stdout)
+                except UnsupportedOption:
+                    return {"command": str(plan), "argv": plan.argv, "exec": params["exec_"]}
+                return {"command": str(plan), "container": stdout.getvalue().strip()}
+        return {"command": str(plan), "argv": plan.argv, "exec": params["exec_"]}
+
+
+def stop(socket_path=None):
+    """Asks the daemon on `socket_path` to exit; False if none is listening."""
+    try:
+        request(socket_path or default_socket_path(), {"op": "shutdown"}, timeout=5)
+    except (IOError, OSError, ValueError):
+        return False
+    return True
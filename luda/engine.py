@@ -0,0 +1,411 @@
+# -*- coding: utf-8 -*-
+
+"""
+Minimal Docker Engine API client speaking HTTP over the daemon's Unix socket.
+
+Unlike the CLI backend, which forks `docker`/`nvidia-docker` for every
+inspect and run, an EngineClient keeps a small pool of keep-alive
+connections and reuses them for inspect, build, create, start, attach,
+logs and wait.  Only the options luda itself generates (and a few common
+docker options) are translated into a container config; anything else
+raises UnsupportedOption so the caller can fall back to the CLI.
+"""
+
+from __future__ import print_function
+import json
+import os
+import socket
+import struct
+import sys
+
+try:
+    import http.client as httplib
+    from urllib.parse import urlencode
+    import queue
+except ImportError:  # python 2
+    import httplib
+    from urllib import urlencode
+    import Queue as queue
+
+from .trace import span
+
+
+DEFAULT_SOCKET = "/var/run/docker.sock"
+
+STDOUT = 1
+STDERR = 2
+
+
+class EngineError(Exception):
+    """An error response (or no response) from the docker daemon."""
+
+    def __init__(self, message, status=None):
+        super(EngineError, self).__init__(message)
+        self.status = status
+
+
+class UnsupportedOption(ValueError):
+    """A docker run option the API backend cannot translate."""
+
+
+def socket_from_env():
+    """
+    Path of the daemon socket taken from `$DOCKER_HOST` (unix:// only),
+    falling back to /var/run/docker.sock.
+    """
+    host = os.environ.get("DOCKER_HOST")
+    if not host:
+        return DEFAULT_SOCKET
+    if host.startswith("unix://"):
+        return host[len("unix://"):]
+    raise EngineError("DOCKER_HOST={0} is not a unix socket".format(host))
+
+
+class UnixHTTPConnection(httplib.HTTPConnection):
+
+    def __init__(self, socket_path, timeout=None):
+        httplib.HTTPConnection.__init__(self, "localhost")
+        self.socket_path = socket_path
+        self.socket_timeout = timeout
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.socket_timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+
+def demux(stream):
+    """
+    Splits a multiplexed attach/logs stream into (stream_type, data) frames.
+    """
+    while True:
+        header = stream.read(8)
+        if len(header) < 8:
+            return
+        stream_type, size = struct.unpack(">BxxxL", header)
+        data = stream.read(size)
+        yield stream_type, data
+
+
+def json_stream(stream):
+    """Decodes a newline-delimited JSON progress stream."""
+    for line in iter(stream.readline, b""):
+        line = line.strip()
+        if line:
+            yield json.loads(line.decode("utf-8"))
+
+
+def read_available(stream, size=4096):
+    """Reads whatever is available (up to `size` bytes) without waiting for a full buffer."""
+    read1 = getattr(stream, "read1", None)
+    return read1(size) if read1 else stream.read(1)
+
+
+class EngineClient(object):
+    """
+    Docker Engine API client over a pooled Unix-socket connection.
+
+    Requests borrow a keep-alive connection from the pool and return it when
+    the response has been read; streaming responses (attach, build) take a
+    connection out of the pool for their lifetime.
+    """
+
+    def __init__(self, socket_path=None, pool_size=4, timeout=None, api_version=None):
+        self.socket_path = socket_path or socket_from_env()
+        self.timeout = timeout
+        self.prefix = "/v{0}".format(api_version) if api_version else ""
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+        self.connections_opened = 0
+
+    def _new_connection(self):
+        self.connections_opened += 1
+        return UnixHTTPConnection(self.socket_path, self.timeout)
+
+    def _get_connection(self):
+        """Returns (connection, reused)."""
+        try:
+            return self._pool.get_nowait(), True
+        except queue.Empty:
+            return self._new_connection(), False
+
+    def _put_connection(self, conn):
+        try:
+            self._pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close(self):
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def _send(self, method, path, params=None, body=None, headers=None):
+        url = self.prefix + path
+        if params:
+            url += "?" + urlencode(params)
+        headers = dict(headers or {})
+        if isinstance(body, dict):
+            body = json.dumps(body).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+
+        conn, reused = self._get_connection()
+        while True:
+            try:
+                conn.request(method, url, body=body, headers=headers)
+                return conn, conn.getresponse()
+            except (socket.error, httplib.HTTPException) as err:
+                conn.close()
+                if not reused:
+                    raise EngineError("cannot reach docker daemon at {0}: {1}".format(self.socket_path, err))
+                # a pooled keep-alive connection may have been closed by the daemon
+                conn, reused = self._new_connection(), False
+
+    def _check(self, response, data):
+        if response.status >= 400:
+            try:
+                message = json.loads(data.decode("utf-8")).get("message", "")
+            except ValueError:
+                message = data.decode("utf-8", "replace")
+            raise EngineError(message or response.reason, response.status)
+
+    def request(self, method, path, params=None, body=None, headers=None):
+        """Performs a request and returns the decoded JSON body (or None)."""
+        conn, response = self._send(method, path, params, body, headers)
+        data = response.read()
+        if response.will_close:
+            conn.close()
+        else:
+            self._put_connection(conn)
+        self._check(response, data)
+        if data and response.getheader("Content-Type", "").startswith("application/json"):
+            return json.loads(data.decode("utf-8"))
+        return data or None
+
+    def stream(self, method, path, params=None, body=None, headers=None):
+        """
+        Performs a request whose response is consumed incrementally.  The
+        connection is dedicated to the returned response and closed with it.
+        """
+        conn, response = self._send(method, path, params, body, headers)
+        if response.status >= 400:
+            data = response.read()
+            conn.close()
+            self._check(response, data)
+        return response
+
+    def ping(self):
+        return self.request("GET", "/_ping") == b"OK"
+
+    def inspect_image(self, image_name):
+        """`docker inspect` JSON for `image_name`, or None if it is not present."""
+        try:
+            return self.request("GET", "/images/{0}/json".format(image_name))
+        except EngineError as err:
+            if err.status == 404:
+                return None
+            raise
+
+    def build(self, context, tag, dockerfile="Dockerfile"):
+        """
+        Builds `context` (tarball bytes) and yields the decoded progress
+        messages as they arrive.
+        """
+        params = {"t": tag, "dockerfile": dockerfile, "rm": 1}
+        response = self.stream("POST", "/build", params=params, body=context,
+                               headers={"Content-Type": "application/x-tar"})
+        for chunk in json_stream(response):
+            if "error" in chunk:
+                raise EngineError(chunk["error"])
+            yield chunk
+
+    def create_container(self, config, name=None):
+        params = {"name": name} if name else None
+        return self.request("POST", "/containers/create", params=params, body=config)["Id"]
+
+    def start_container(self, container_id):
+        self.request("POST", "/containers/{0}/start".format(container_id))
+
+    def attach_container(self, container_id, tty=False):
+        """
+        Attaches to the container's stdout/stderr and returns an iterator of
+        (stream_type, data).  A tty stream is not multiplexed and is reported
+        as STDOUT.  The request is sent before returning, so attaching ahead
+        of `start_container` captures all output.
+        """
+        params = {"stream": 1, "stdout": 1, "stderr": 1}
+        response = self.stream("POST", "/containers/{0}/attach".format(container_id), params=params)
+        if tty:
+            return ((STDOUT, data) for data in iter(lambda: read_available(response), b""))
+        return demux(response)
+
+    def container_logs(self, container_id, follow=True, tty=False):
+        """
+        Yields the container's output as (stream_type, data), like
+        `attach_container`; with `follow` it ends when the container exits.
+        Closing the generator closes its connection.
+        """
+        params = {"follow": int(follow), "stdout": 1, "stderr": 1}
+        response = self.stream("GET", "/containers/{0}/logs".format(container_id), params=params)
+        try:
+            if tty:
+                for data in iter(lambda: read_available(response), b""):
+                    yield STDOUT, data
+            else:
+                for frame in demux(response):
+                    yield frame
+        finally:
+            response.close()
+
+    def wait_container(self, container_id):
+        return self.request("POST", "/containers/{0}/wait".format(container_id))["StatusCode"]
+
+    def remove_container(self, container_id, force=False):
+        self.request("DELETE", "/containers/{0}".format(container_id), params={"force": int(force)})
+
+    def stop_container(self, container_id, timeout=10):
+        self.request("POST", "/containers/{0}/stop".format(container_id), params={"t": timeout})
+
+    def kill_container(self, container_id, signal="SIGKILL"):
+        self.request("POST", "/containers/{0}/kill".format(container_id), params={"signal": signal})
+
+    def run(self, plan, stdout=None, stderr=None):
+        """
+        Runs a LaunchPlan: create, attach, start and wait.  Returns the exit
+        code, or 0 after printing the container id when detached.
+        """
+        stdout = stdout or sys.stdout
+        stderr = stderr or sys.stderr
+        config, options = container_config(plan)
+        if config.get("OpenStdin"):
+            raise UnsupportedOption("-i: the API backend does not forward stdin")
+
+        with span("engine: create"):
+            container_id = self.create_container(config, name=options.get("name"))
+        if options.get("detach"):
+            with span("engine: start"):
+                self.start_container(container_id)
+            print(container_id, file=stdout)
+            return 0
+
+        try:
+            output = self.attach_container(container_id, tty=config.get("Tty", False))
+            with span("engine: start"):
+                self.start_container(container_id)
+            with span("engine: attach"):
+                for stream_type, data in output:
+                    target = stderr if stream_type == STDERR else stdout
+                    write_bytes(target, data)
+            return self.wait_container(container_id)
+        finally:
+            if options.get("rm"):
+                with span("engine: remove"):
+                    self.remove_container(container_id, force=True)
+
+
+def write_bytes(stream, data):
+    buf = getattr(stream, "buffer", None)
+    if buf is not None:
+        buf.write(data)
+        buf.flush()
+    else:
+        stream.write(data.decode("utf-8", "replace"))
+        stream.flush()
+
+
+def parse_ulimit(value):
+    name, _, limits = value.partition("=")
+    soft, _, hard = limits.partition(":")
+    return {"Name": name, "Soft": int(soft), "Hard": int(hard or soft)}
+
+
+def container_config(plan):
+    """
+    Translates a LaunchPlan into an Engine API container config.
+
+    :return: (config, options) where options holds the client-side flags
+             `rm`, `detach` and `name`
+    :raises UnsupportedOption: for run options that cannot be translated
+    """
+    from .resources import parse_size
+
+    host = {"Binds": [], "Ulimits": []}
+    config = {"Image": plan.image, "Env": [], "HostConfig": host}
+    if plan.command:
+        config["Cmd"] = list(plan.command)
+    if os.path.basename(plan.exe) == "nvidia-docker":
+        host["Runtime"] = "nvidia"
+    options = {"rm": False, "detach": False}
+
+    args = iter(plan.run_args)
+    for arg in args:
+        if arg.startswith("--") and "=" in arg:
+            name, _, value = arg.partition("=")
+        else:
+            name, value = arg, None
+
+        def val():
+            if value is not None:
+                return value
+            try:
+                return next(args)
+            except StopIteration:
+                raise UnsupportedOption("{0} requires a value".format(name))
+
+        if name == "--rm":
+            options["rm"] = True
+        elif name in ("-d", "--detach"):
+            options["detach"] = True
+        elif name in ("-t", "--tty"):
+            config["Tty"] = True
+        elif name in ("-i", "--interactive"):
+            config.update(OpenStdin=True, StdinOnce=True, AttachStdin=True)
+        elif name in ("-v", "--volume"):
+            host["Binds"].append(val())
+        elif name == "--entrypoint":
+            config["Entrypoint"] = [val()]
+        elif name in ("-e", "--env"):
+            env = val()
+            if "=" not in env:
+                if env not in os.environ:
+                    continue
+                env = "{0}={1}".format(env, os.environ[env])
+            config["Env"].append(env)
+        elif name in ("-w", "--workdir"):
+            config["WorkingDir"] = val()
+        elif name in ("-u", "--user"):
+            config["User"] = val()
+        elif name == "--name":
+            options["name"] = val()
+        elif name == "--shm-size":
+            host["ShmSize"] = parse_size(val())
+        elif name == "--ulimit":
+            host["Ulimits"].append(parse_ulimit(val()))
+        elif name == "--ipc":
+            host["IpcMode"] = val()
+        elif name in ("--network", "--net"):
+            host["NetworkMode"] = val()
+        elif name == "--cpuset-cpus":
+            host["CpusetCpus"] = val()
+        elif name == "--cpuset-mems":
+            host["CpusetMems"] = val()
+        else:
+            raise UnsupportedOption("{0}: not supported by the API backend".format(arg))
+    return config, options
+
+
+_clients = {}
+
+
+def get_engine(socket_path=None):
+    """
+    Returns the process-wide EngineClient for `socket_path` so every caller
+    shares one connection pool.
+    """
+    socket_path = socket_path or socket_from_env()
+    client = _clients.get(socket_path)
+    if client is None:
+        client = _clients[socket_path] = EngineClient(socket_path)
+    return client
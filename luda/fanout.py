@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+
+"""
+Multi-node launches from a hostfile.
+
+The launch plan is resolved once on the submitting node and pushed to every
+node at the same time over a remote-exec transport.  Each rank gets `RANK`,
+`WORLD_SIZE`, `LOCAL_RANK`, `LOCAL_WORLD_SIZE`, `MASTER_ADDR` and
+`MASTER_PORT` in its environment.  The nodes run the same docker command
+line, so they need the resolved image and the mounted host paths (luda's
+bootstrap directory, the working directory) at the same locations, e.g.
+via a shared filesystem.
+"""
+
+import importlib
+import os
+import subprocess
+import threading
+import time
+
+try:
+    from shlex import quote
+except ImportError:  # python 2
+    from pipes import quote
+
+from .batch import schedule
+from .launch import LaunchPlan
+
+
+DEFAULT_MASTER_PORT = 29500
+
+# options of the launch plan that need a terminal on the submitting side
+INTERACTIVE_OPTIONS = ("-t", "-i")
+
+
+def read_hostfile(path):
+    """
+    Hosts listed in a hostfile, one per line with an optional `slots=N`
+    (ranks on that host); `#` starts a comment.
+
+    :return: list of host names, a host repeated once per slot
+    """
+    hosts = []
+    with open(path) as handle:
+        for line in handle:
+            words = line.split("#", 1)[0].split()
+            if not words:
+                continue
+            slots = 1
+            for word in words[1:]:
+                key, _, value = word.partition("=")
+                if key in ("slots", "max_slots") and value.isdigit():
+                    slots = int(value)
+                else:
+                    raise ValueError("{0}: cannot parse {1!r}".format(path, line.strip()))
+            hosts.extend([words[0]] * slots)
+    if not hosts:
+        raise ValueError("{0}: no hosts".format(path))
+    return hosts
+
+
+class SSHTransport(object):
+    """Runs a node's command over `ssh` without a terminal."""
+
+    def __init__(self, options=("-n", "-o", "BatchMode=yes")):
+        self.options = list(options)
+
+    def argv(self, host, command):
+        # resolve docker through the remote PATH rather than the local path
+        command = [os.path.basename(command[0])] + list(command[1:])
+        return ["ssh"] + self.options + [host, " ".join(quote(arg) for arg in command)]
+
+    def spawn(self, host, command):
+        # the ranks never read stdin; sharing the terminal's would make them compete for the user's input
+        # and get a backgrounded luda stopped by SIGTTIN
+        with open(os.devnull, "rb") as devnull:
+            return subprocess.Popen(self.argv(host, command), stdin=devnull, stdout=subprocess.PIPE,
+                                    stderr=subprocess.STDOUT)
+
+
+class LocalTransport(SSHTransport):
+    """Runs every node's command on this machine, for tests and single-node dry runs."""
+
+    def argv(self, host, command):
+        return list(command)
+
+
+TRANSPORTS = {
+    "ssh": SSHTransport,
+    "local": LocalTransport,
+}
+
+
+def get_transport(name):
+    """
+    Transport registered as `name`, or a class given as `package.module:Class`
+    providing `spawn(host, argv)` that returns a `subprocess.Popen`-like
+    object with a `stdout` pipe.
+    """
+    if name in TRANSPORTS:
+        return TRANSPORTS[name]()
+    module_name, _, class_name = name.partition(":")
+    if not class_name:
+        raise ValueError("unknown transport {0!r}, expected one of {1} or module:Class".format(
+            name, ", ".join(sorted(TRANSPORTS))))
+    return getattr(importlib.import_module(module_name), class_name)()
+
+
+class NodeResult(object):
+
+    def __init__(self, rank, host, exit_code=None, started=0.0, elapsed=0.0, error=None):
+        self.rank = rank
+        self.host = host
+        self.exit_code = exit_code
+        self.started = started
+        self.elapsed = elapsed
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None and self.exit_code == 0
+
+    def toDict(self):
+        return {"rank": self.rank, "host": self.host, "exit_code": self.exit_code,
+                "started": round(self.started, 3), "elapsed": round(self.elapsed, 3), "error": self.error}
+
+
+def rank_plans(plan, hosts, master_port=DEFAULT_MASTER_PORT, rank_args=None):
+    """
+    One LaunchPlan per rank, non-interactive, with the rank environment added.
+
+    :param rank_args: optional list with extra docker run options for each rank
+    """
+    local_ranks = {}
+    plans = []
+    for rank, host in enumerate(hosts):
+        local_rank = local_ranks[host] = local_ranks.get(host, -1) + 1
+        node = LaunchPlan(plan.exe, plan.image, [arg for arg in plan.run_args if arg not in INTERACTIVE_OPTIONS],
+                          plan.command)
+        node.add_env("RANK", rank)
+        node.add_env("WORLD_SIZE", len(hosts))
+        node.add_env("LOCAL_RANK", local_rank)
+        node.add_env("LOCAL_WORLD_SIZE", hosts.count(host))
+        node.add_env("MASTER_ADDR", hosts[0])
+        node.add_env("MASTER_PORT", master_port)
+        if rank_args is not None:
+            node.add(*rank_args[rank])
+        plans.append(node)
+    return plans
+
+
+def fan_out(plan, hosts, transport, master_port=DEFAULT_MASTER_PORT, echo=None, on_done=None, rank_args=None):
+    """
+    Starts `plan` on every host at once and waits for all of them.
+
+    :param rank_args: see `rank_plans`
+    :param echo: called with each output line, prefixed with the rank
+    :return: list of NodeResult in rank order; `started` is the time from the
+             start of the fan-out until the node's transport was spawned
+    """
+    plans = rank_plans(plan, hosts, master_port, rank_args)
+    lock = threading.Lock()
+    start = time.time()
+
+    def launch(rank):
+        result = NodeResult(rank, hosts[rank])
+        try:
+            proc = transport.spawn(hosts[rank], plans[rank].argv)
+            result.started = time.time() - start
+            for line in iter(proc.stdout.readline, b""):
+                if echo is not None:
+                    with lock:
+                        echo("[{0}] {1}".format(rank, line.decode("utf-8", "replace").rstrip("\n")))
+            result.exit_code = proc.wait()
+        except OSError as err:
+            result.error = str(err)
+        result.elapsed = time.time() - start
+        return result
+
+    wrapped = None
+    if on_done is not None:
+        wrapped = lambda idx, result: on_done(result)
+    return schedule(list(range(len(hosts))), launch, len(hosts), wrapped)
+
+
+def format_results(results):
+    width = max([len("host")] + [len(r.host) for r in results])
+    lines = ["{0:>4}  {1:<{w}}  {2:>5}  {3:>11}  {4:>9}".format("rank", "host", "exit", "started [s]", "wall [s]",
+                                                                w=width)]
+    for r in results:
+        status = r.exit_code if r.error is None else "error"
+        line = "{0:>4}  {1:<{w}}  {2:>5}  {3:11.3f}  {4:9.2f}".format(r.rank, r.host, status, r.started,
+                                                                       r.elapsed, w=width)
+        if r.error:
+            line += "  " + r.error
+        lines.append(line)
+    skew = max(r.started for r in results) - min(r.started for r in results)
+    failed = len([r for r in results if not r.ok])
+    lines.append("{0} ranks, {1} failed, startup skew {2:.3f} s".format(len(results), failed, skew))
+    return "\n".join(lines)
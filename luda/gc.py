@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+
+"""
+Disk-budgeted garbage collection of the images luda builds.
+
+Every template and identity image luda builds is recorded in the build
+manifest together with its size, and launches record when each one was
+last used (`image-usage.json` in the cache directory).  `luda gc` removes
+the least recently used images until the rest fit in `image_budget`
+bytes.  With `gc_auto` the same check runs after each launch that resolves
+a luda image, contacting docker only when the budget is exceeded.
+
+An image's size is that of its own layers (the image size less its base
+image's), so base layers shared by several images are not counted once
+per image.  Removing an image that another luda image is built on frees
+nothing, so only leaves are removed, and never an image that a container,
+running or stopped, was created from.
+"""
+
+import json
+import os
+import subprocess
+import time
+
+from .cache import BuildManifest, ImageCache, _lock, load_json
+from .config import get_cache_dir
+from .utils import atomic_write
+
+
+USAGE_FILE = "image-usage.json"
+
+
+def usage_file(cache_dir=None):
+    return os.path.join(cache_dir or get_cache_dir(), USAGE_FILE)
+
+
+def record_use(image_name, cache_dir=None):
+    """Marks `image_name` as used now."""
+    path = usage_file(cache_dir)
+    with _lock:
+        usage = load_json(path, {})
+        usage[image_name] = time.time()
+        atomic_write(path, json.dumps(usage, indent=2, sort_keys=True))
+
+
+class BuiltImage(object):
+
+    def __init__(self, tag, id=None, base_id=None, size=None, last_used=0.0):
+        self.tag = tag
+        self.id = id
+        self.base_id = base_id
+        self.size = size
+        self.last_used = last_used
+
+    def toDict(self):
+        return dict(vars(self), last_used=round(self.last_used, 3))
+
+
+def select_victims(images, budget, in_use=(), keep=()):
+    """
+    The images to remove, least recently used first, so the remaining ones
+    use at most `budget` bytes; images in `in_use` (by id), in `keep` (by
+    tag) and images other remaining images are built on are kept.
+
+    :param images: list of BuiltImage
+    """
+    remaining = list(images)
+    total = sum(image.size or 0 for image in remaining)
+    victims = []
+    while total > budget:
+        bases = set(image.base_id for image in remaining)
+        candidates = [image for image in sorted(remaining, key=lambda image: image.last_used)
+                      if image.id not in in_use and image.id not in bases and image.tag not in keep]
+        if not candidates:
+            break
+        victim = candidates[0]
+        victims.append(victim)
+        remaining.remove(victim)
+        total -= victim.size or 0
+    return victims
+
+
+class GcResult(object):
+
+    def __init__(self, budget, total, removed=(), failed=(), dry_run=False):
+        self.budget = budget
+        self.total = total
+        self.removed = list(removed)
+        self.failed = list(failed)
+        self.dry_run = dry_run
+
+    @property
+    def freed(self):
+        return sum(image.size or 0 for image in self.removed)
+
+    def toDict(self):
+        return {"budget": self.budget, "total": self.total, "freed": self.freed, "dry_run": self.dry_run,
+                "removed": [image.toDict() for image in self.removed],
+                "failed": [image.toDict() for image in self.failed]}
+
+
+class ImageCollector(object):
+    """
+    :param exe: docker executable
+    :param budget: bytes the images luda built may use
+    """
+
+    def __init__(self, exe, budget, cache_dir=None):
+        self.exe = exe
+        self.budget = budget
+        self.cache_dir = cache_dir or get_cache_dir()
+        self.manifest = BuildManifest(self.cache_dir)
+        self.image_cache = ImageCache(self.cache_dir)
+
+    def _inspect(self, kind, names):
+        """`docker inspect` of the existing objects among `names`."""
+        if not names:
+            return []
+        proc = subprocess.Popen([self.exe, "inspect", "--type", kind] + list(names),
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stdout, _ = proc.communicate()
+        try:
+            return json.loads(stdout.decode() or "[]")
+        except ValueError:
+            return []
+
+    def images(self):
+        """BuiltImage for every recorded build; sizes the manifest lacks are looked up."""
+        usage = load_json(usage_file(self.cache_dir), {})
+        images = [BuiltImage(tag, entry.get("image_id"), entry.get("base_id"), entry.get("size"),
+                             usage.get(tag, entry.get("built", 0.0)))
+                  for tag, entry in sorted(self.manifest.entries().items())]
+        unsized = [image for image in images if image.size is None]
+        sizes = dict((data["Id"], data.get("Size", 0)) for data in self._inspect(
+            "image", [image.tag for image in unsized] + [image.base_id for image in unsized if image.base_id]))
+        for image in unsized:
+            image.size = max(0, sizes.get(image.id, 0) - sizes.get(image.base_id, 0))
+        return images
+
+    def in_use(self):
+        """Ids of the images of all containers."""
+        proc = subprocess.Popen([self.exe, "ps", "--all", "--quiet", "--no-trunc"],
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stdout, _ = proc.communicate()
+        return set(data.get("Image") for data in self._inspect("container", stdout.decode().split()))
+
+    def remove(self, image):
+        with open(os.devnull, "w") as devnull:
+            code = subprocess.call([self.exe, "rmi", image.tag], stdout=devnull, stderr=devnull)
+        # an image removed behind luda's back only needs forgetting
+        if code != 0 and self._inspect("image", [image.tag]):
+            return False
+        self.manifest.forget(image.tag)
+        self.image_cache.invalidate(image.tag)
+        with _lock:
+            usage = load_json(usage_file(self.cache_dir), {})
+            if usage.pop(image.tag, None) is not None:
+                atomic_write(usage_file(self.cache_dir), json.dumps(usage, indent=2, sort_keys=True))
+        return True
+
+    def collect(self, dry_run=False, keep=()):
+        """
+        :param keep: tags never to remove, e.g. the image being launched
+        """
+        images = self.images()
+        result = GcResult(self.budget, sum(image.size or 0 for image in images), dry_run=dry_run)
+        if result.total <= self.budget:
+            return result
+        for image in select_victims(images, self.budget, self.in_use(), keep):
+            if dry_run or self.remove(image):
+                result.removed.append(image)
+            else:
+                result.failed.append(image)
+        return result
+
+
+def collect_over_budget(exe, budget, keep=(), cache_dir=None):
+    """Collects only if the recorded sizes exceed `budget`; None if they do not."""
+    manifest = BuildManifest(cache_dir)
+    if sum(entry.get("size") or 0 for entry in manifest.entries().values()) <= budget:
+        return None
+    return ImageCollector(exe, budget, cache_dir).collect(keep=keep)
+
+
+def format_result(result):
+    mib = lambda size: (size or 0) / float(1 << 20)
+    verb = "would remove" if result.dry_run else "removed"
+    lines = ["{0} {1} ({2:.1f} MiB)".format(verb, image.tag, mib(image.size)) for image in result.removed]
+    lines.extend("could not remove {0}".format(image.tag) for image in result.failed)
+    lines.append("{0} image(s), {1:.1f} MiB {2}; luda's images use {3:.1f} MiB (budget {4:.1f} MiB)".format(
+        len(result.removed), mib(result.freed), "would be freed" if result.dry_run else "freed", mib(result.total),
+        mib(result.budget)))
+    return "\n".join(lines)
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+"""
+Per-user identity images and files.
+
+`/bootstrap/init.sh` creates the host user inside the container on every
+start.  In `baked` identity mode luda instead builds (once per base image
+and user) a thin derived image that already contains the user, group and
+sudoers entry, and launches it straight into `su-exec`.  In `user` mode
+there is no bootstrap at all: the container runs with `--user uid:gid`
+and the image's own `passwd`/`group` files, with the host user merged in,
+are mounted over `/etc/passwd` and `/etc/group`.
+"""
+
+import os
+import subprocess
+
+from .config import get_cache_dir
+from .luda import build_image, derived_image_name
+from .utils import atomic_write
+
+
+IDENTITY_DOCKERFILE = """FROM {base_image}
+USER root
+RUN (addgroup --gid {gid} {group} || groupadd -g {gid} {group} || true) > /dev/null 2>&1 && \\
+    (useradd --shell /bin/bash -u {uid} --gid {gid} -o -c "" --create-home -G sudo,{group} {user} || \\
+     useradd --shell /bin/bash -u {uid} --gid {gid} -o -c "" --create-home {user}) > /dev/null 2>&1 && \\
+    echo "{user} ALL=(ALL) NOPASSWD: ALL" >> /etc/sudoers
+LABEL luda.identity="{user}:{uid}:{group}:{gid}"
+"""
+
+
+def identity_dockerfile(base_image, identity):
+    user, uid, group, gid = identity
+    return IDENTITY_DOCKERFILE.format(base_image=base_image, user=user, uid=uid, group=group, gid=gid).strip()
+
+
+def identity_image_name(base_image, identity):
+    """e.g. `luda/nvidia-cuda-8.0-devel:id1000-1000` for uid 1000, gid 1000."""
+    _, uid, _, gid = identity
+    return derived_image_name(base_image, "id{0}-{1}".format(uid, gid))
+
+
+def build_identity_image(base_image, identity, inspect=None, image_cache=None, manifest=None, engine=None,
+                         force=False, verbose=True):
+    """
+    Builds the identity layer for `identity` = (user, uid, group, gid) on top
+    of `base_image`.  The build manifest keys it on the base image id, so it
+    is reused until the base image changes.
+
+    :return: (name of the identity image, True if it was built)
+    """
+    return build_image(identity_image_name(base_image, identity), base_image,
+                       identity_dockerfile(base_image, identity), None, inspect=inspect,
+                       image_cache=image_cache, manifest=manifest, engine=engine, force=force,
+                       verbose=verbose, template="identity")
+
+
+def image_accounts(image, image_id, exe="docker", cache_dir=None):
+    """
+    Reads `/etc/passwd` and `/etc/group` out of `image`.  They are read once
+    per image id and kept below `<cache_dir>/identity/images/`; a file the
+    image lacks (or cannot `cat`) reads as empty.
+
+    :return: (passwd contents, group contents)
+    """
+    directory = os.path.join(cache_dir or get_cache_dir(), "identity", "images", image_id.split(":")[-1])
+    contents = []
+    for name in ("passwd", "group"):
+        path = os.path.join(directory, name)
+        try:
+            with open(path) as handle:
+                contents.append(handle.read())
+            continue
+        except IOError:
+            pass
+        proc = subprocess.Popen([exe, "run", "--rm", "--entrypoint", "cat", image, "/etc/" + name],
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stdout, _ = proc.communicate()
+        data = stdout.decode("utf-8", "replace") if proc.returncode == 0 else ""
+        atomic_write(path, data)
+        contents.append(data)
+    return tuple(contents)
+
+
+def _merge(entries, name, id_, line):
+    """Replaces the entries of `entries` named `name` or numbered `id_` with `line`."""
+    kept = [entry for entry in entries.splitlines()
+            if entry.strip() and entry.split(":")[0] != name and entry.split(":")[2:3] != [str(id_)]]
+    return "\n".join(kept + [line]) + "\n"
+
+
+def passwd_entries(identity, base=None):
+    """
+    Contents of the (passwd, group) files for `user` mode: the image's own
+    accounts from `base` = (passwd, group), or just root, plus the host user.
+    """
+    user, uid, group, gid = identity
+    passwd, groups = base or ("", "")
+    if not passwd.strip():
+        passwd = "root:x:0:0:root:/root:/bin/sh\n"
+    if not groups.strip():
+        groups = "root:x:0:\n"
+    passwd = _merge(passwd, user, uid, "{0}:x:{1}:{2}::/home/{0}:/bin/bash".format(user, uid, gid))
+    if gid != 0:
+        groups = _merge(groups, group, gid, "{0}:x:{1}:{2}".format(group, gid, user))
+    return passwd, groups
+
+
+def identity_files(identity, cache_dir=None, base=None, image_id=None):
+    """
+    Writes the `passwd` and `group` files for `identity`, merged into the
+    image's `base` = (passwd, group), below `<cache_dir>/identity/` (only
+    when their contents change) so they can be mounted read-only over
+    `/etc/passwd` and `/etc/group`.
+
+    :param image_id: id of the image `base` was read from; keeps the files of different images apart
+    :return: (passwd path, group path)
+    """
+    user, uid, _, gid = identity
+    directory = os.path.join(cache_dir or get_cache_dir(), "identity", "{0}-{1}-{2}".format(user, uid, gid))
+    if image_id:
+        directory = os.path.join(directory, image_id.split(":")[-1][:12])
+    paths = []
+    for name, contents in zip(("passwd", "group"), passwd_entries(identity, base)):
+        path = os.path.join(directory, name)
+        try:
+            with open(path) as handle:
+                current = handle.read()
+        except IOError:
+            current = None
+        if current != contents:
+            atomic_write(path, contents)
+            os.chmod(path, 0o644)
+        paths.append(path)
+    return tuple(paths)
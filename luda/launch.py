@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+
+"""Construction and execution of the `docker run` command line."""
+
+import os
+import subprocess
+
+try:
+    from shlex import quote
+except ImportError:  # python 2
+    from pipes import quote
+
+from .cache import ImageCache, inspect_image
+from .lockfile import Lockfile
+from .resources import DEFAULT_PROFILE, get_host_resources, get_profile, parse_size, resource_args
+from .trace import span
+from .luda import which, Volume, add_display, build_template_chain, expand_abbreviations, generate_dockerfile_extension
+
+
+class LaunchPlan(object):
+    """
+    A `docker run` invocation held as an argv list.
+
+    `run_args` are the options placed before the image name and `command`
+    the arguments placed after it.
+    """
+
+    def __init__(self, exe, image=None, run_args=None, command=None):
+        self.exe = exe
+        self.image = image
+        self.run_args = list(run_args or [])
+        self.command = list(command or [])
+        # host paths to read into the page cache while the container starts
+        self.prefetch = []
+
+    def add(self, *args):
+        self.run_args.extend(args)
+
+    def add_volume(self, volume):
+        self.run_args.extend(volume.args)
+
+    def add_env(self, name, value):
+        self.run_args.extend(["--env", "{0}={1}".format(name, value)])
+
+    @property
+    def argv(self):
+        return [self.exe, "run"] + self.run_args + [self.image] + self.command
+
+    def __str__(self):
+        return " ".join(quote(arg) for arg in self.argv)
+
+    def execute(self, exec_=True):
+        """
+        Runs the plan.  With `exec_` the current process is replaced by docker
+        via `os.execvp` (never returns); otherwise docker is run as a child
+        process and its exit code is returned.
+        """
+        if exec_:
+            os.execvp(self.exe, self.argv)
+        return subprocess.call(self.argv)
+
+
+IDENTITY_MODES = ("bootstrap", "baked", "user")
+
+_identity = None
+
+
+def get_user_identity():
+    """
+    Returns (user, uid, group, gid) of the user running luda.
+    """
+    global _identity
+    if _identity is None:
+        import getpass
+        from pwd import getpwnam
+        import grp
+
+        user = getpass.getuser()
+        pw = getpwnam(user)
+        group = grp.getgrgid(pw.pw_gid).gr_name
+        _identity = (user, pw.pw_uid, group, pw.pw_gid)
+    return _identity
+
+
+def split_docker_args(docker_args):
+    """
+    Splits the unprocessed arguments into (options, image, command).  Options
+    given before the image are assumed to take a value, e.g. `--network host`.
+    """
+    docker_args = list(docker_args)
+    idx = 0
+    while idx < len(docker_args) and docker_args[idx].strip().startswith("-"):
+        idx += 2
+    if idx >= len(docker_args):
+        return docker_args, None, []
+    return docker_args[:idx], docker_args[idx], docker_args[idx + 1:]
+
+
+def identity_mode(identity, config):
+    """The identity mode, `bootstrap`, `baked` or `user`, given on the command line or in the config."""
+    mode = identity or config.get("identity", "bootstrap")
+    if mode not in IDENTITY_MODES:
+        raise ValueError("unknown identity mode {0!r}, expected one of {1}".format(mode, ", ".join(IDENTITY_MODES)))
+    return mode
+
+
+def resolve_image(image_arg, config, config_path=None, dev=False, template=(), template_path=None,
+                  exe=None, engine=None, identity=None, intermediates=None):
+    """
+    Expands abbreviations, pins the image to its digest if the work
+    directory has a lockfile, looks up the image's metadata and applies the
+    templates in order.  A chain of several templates is built as one
+    multi-stage image unless `intermediates` (default: the
+    `template_intermediates` config key) asks for every step to be tagged.
+    In `baked` identity mode the user's identity layer is added on top.
+    The use of a luda-built image is recorded for `luda gc`.
+
+    :return: (image name to run, ImageMetadata of the base image or None)
+    """
+    exe = exe or which("nvidia-docker") or "docker"
+
+    # expand image_name if abbreviations are present
+    abbreviations = config.get("abbreviations", {})
+    image_name = expand_abbreviations(image_arg, abbreviations)
+    # a lockfile in the work directory pins the image to a digest
+    lock = Lockfile.find(config)
+    if lock is not None:
+        image_name = lock.pinned(image_arg, image_name)
+
+    # Determine the container image's entrypoint and default command; a single
+    # `docker inspect` populates the metadata cache on a miss
+    image_cache = ImageCache(ttl=config.get("image_cache_ttl", 300))
+    if engine is not None:
+        inspect = engine.inspect_image
+    else:
+        inspect = lambda name: inspect_image(exe, name)
+    with span("inspect", image=image_name):
+        metadata = image_cache.get(image_name, inspect)
+
+    # generate dev template then the remaining templates in order they are entered
+    templates = (["dev"] if dev else []) + list(template)
+    pinned = lock.pinned_derived(image_name, templates) if lock is not None and templates else None
+    if pinned is not None and getattr(image_cache.get(pinned["image"], inspect), "id", None) == pinned["id"]:
+        # the locked template image is still the local one; nothing to render or check
+        templates = []
+        image_name = pinned["image"]
+    if intermediates is None:
+        intermediates = config.get("template_intermediates", False)
+    if len(templates) > 1 and not intermediates:
+        with span("template", template="+".join(templates)):
+            image_name, _ = build_template_chain(image_name, templates, template_path or config_path,
+                                                 inspect=inspect, image_cache=image_cache, engine=engine)
+        templates = []
+    for t in templates:
+        with span("template", template=t):
+            image_name = generate_dockerfile_extension(image_name, t, template_path or config_path,
+                                                       inspect=inspect, image_cache=image_cache, engine=engine)
+
+    if identity_mode(identity, config) == "baked":
+        from .identity import build_identity_image
+        with span("identity image"):
+            image_name, _ = build_identity_image(image_name, get_user_identity(), inspect=inspect,
+                                                 image_cache=image_cache, engine=engine)
+
+    if image_name.startswith("luda/"):
+        from .gc import collect_over_budget, record_use
+        record_use(image_name)
+        if config.get("gc_auto") and config.get("image_budget"):
+            collect_over_budget(exe, parse_size(config["image_budget"]), keep=[image_name])
+    return image_name, metadata
+
+
+def build_plan(docker_args, config, config_path=None, rm=False, detach=False, tty=False, stdin=False,
+               nccl=True, home=True, work=None, display=False, volume=(), dev=False, template=(),
+               template_path=None, exe=None, engine=None, resolved=None, identity=None, resources=None,
+               stage=(), intermediates=None):
+    """
+    Resolves a luda launch into a LaunchPlan.
+
+    :param docker_args: arguments not consumed by luda: docker options, image name and command
+    :param config: configuration dictionary as returned by `read_config`
+    :param engine: EngineClient used for image inspection and template builds instead of the CLI
+    :param resolved: result of `resolve_image` for this image and templates, if already known
+    :param identity: `bootstrap` to create the user at container start, `baked` to run an image
+                     that already contains it, `user` to run as `--user uid:gid` without a bootstrap;
+                     defaults to the `identity` config key
+    :param resources: resource profile sizing shm, IPC and ulimits when `nccl` is set;
+                      defaults to the `resource_profile` config key
+    :param stage: Volumes whose host path is copied to the node-local staging area and mounted from there
+    :param intermediates: tag the image of every template in a chain instead of building the chain at once;
+                          defaults to the `template_intermediates` config key
+    :return: LaunchPlan
+    """
+    user, uid, group, gid = get_user_identity()
+    mode = identity_mode(identity, config)
+
+    # get bootstrap directory
+    bootstrap_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bootstrap")
+    bootstrap_vol = Volume(bootstrap_path, "/bootstrap", "ro")
+
+    # prefer nvidia-docker over docker
+    exe = exe or which("nvidia-docker") or "docker"
+    options, image_arg, command = split_docker_args(docker_args)
+    if image_arg is None:
+        raise ValueError("no container image given")
+    plan = LaunchPlan(exe)
+
+    # run arguments
+    if rm:
+        plan.add("--rm")
+    if detach:
+        plan.add("-d")
+    if tty:
+        plan.add("-t")
+    if stdin:
+        plan.add("-i")
+
+    if nccl:
+        profile = get_profile(resources or config.get("resource_profile", DEFAULT_PROFILE), config)
+        plan.add(*resource_args(profile, get_host_resources(config)))
+
+    # override the entrypoint with luda's custom bootstrap; a baked identity
+    # image already has the user, so only the switch to it remains.  `user`
+    # mode keeps the image's entrypoint and only maps in the user's identity
+    # once the image is resolved
+    if mode == "user":
+        plan.add("--user", "{0}:{1}".format(uid, gid))
+        plan.add_env("HOME", "/home/{0}".format(user))
+    elif mode == "baked":
+        plan.add_volume(bootstrap_vol)
+        plan.add("--entrypoint", "/bootstrap/su-exec")
+    else:
+        plan.add_volume(bootstrap_vol)
+        plan.add("--entrypoint", "/bootstrap/init.sh")
+        plan.add_env("HOST_USER_ID", uid)
+        plan.add_env("HOST_GROUP_ID", gid)
+        plan.add_env("HOST_USER", user)
+        plan.add_env("HOST_GROUP", group)
+
+    # map in the user's home directory [optional]
+    if home:
+        home_vol = Volume("~", "/home/{0}".format(user))
+        if home_vol.host_path not in [v.host_path for v in volume]:
+            plan.add_volume(home_vol)
+
+    # map in the current working directory - can be overridden or ignored
+    work_vol = None
+    if work is None:
+        work_vol = Volume(os.getcwd(), "/work")
+    elif work.lower() != "none":
+        work_vol = Volume.fromString(work)
+    if work_vol:
+        plan.add_volume(work_vol)
+        plan.add("--workdir", work_vol.container_path)
+
+    if display:
+        plan.add(*add_display())
+
+    for v in volume:
+        plan.add_volume(v)
+        if v.prefetch:
+            plan.prefetch.append(v.host_path)
+
+    if stage:
+        from .staging import Stager
+        stager = Stager.fromConfig(config, exe)
+        for v in stage:
+            with span("stage", source=v.host_path):
+                staged = stager.stage(v.host_path)
+            plan.add_volume(Volume(staged.path, v.container_path, "ro" if v.readonly else None))
+            if v.prefetch:
+                plan.prefetch.append(staged.path)
+    plan.add(*options)
+
+    if resolved is None:
+        resolved = resolve_image(image_arg, config, config_path=config_path, dev=dev, template=template,
+                                 template_path=template_path, exe=exe, engine=engine, identity=identity,
+                                 intermediates=intermediates)
+    plan.image, metadata = resolved
+
+    # docker applies the image's own entrypoint and default command; the
+    # image's accounts are kept and the host user is merged into them
+    if mode == "user":
+        from .identity import identity_files, image_accounts
+        base = image_id = None
+        if metadata and metadata.id:
+            image_id = metadata.id
+            base = image_accounts(plan.image, image_id, exe=exe)
+        passwd, group_file = identity_files((user, uid, group, gid), base=base, image_id=image_id)
+        plan.add_volume(Volume(passwd, "/etc/passwd", "ro"))
+        plan.add_volume(Volume(group_file, "/etc/group", "ro"))
+        plan.command.extend(command)
+        return plan
+
+    # the bootstrap replaces the entrypoint, so pass it on as the first arguments;
+    # if no command is given, use the container image's default command
+    if metadata:
+        plan.command.extend(metadata.entrypoint)
+    if command:
+        plan.command.extend(command)
+    elif metadata:
+        plan.command.extend(metadata.cmd)
+    if mode == "baked":
+        # su-exec takes the user first and, unlike init.sh, has no default shell
+        plan.command = [user] + (plan.command or ["/bin/bash"])
+    return plan
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+
+"""
+Image lockfile.
+
+`luda lock` resolves the images a project uses, abbreviations and tags
+included, to content digests and writes them to `luda.lock` (the
+`lockfile` config key) in the work directory.  While the lockfile is
+present, launches from that directory run the pinned digest instead of
+the tag: a digest reference never needs re-inspecting (the image cache
+trusts it forever, on every node sharing the cache) and every node of a
+job runs the same content.  Template images are built on top of the
+pinned base; the lockfile records each derived image's id, so a launch
+uses the local `luda/...` image directly while it still has that id.
+"""
+
+import json
+import os
+import subprocess
+
+from .cache import ImageCache, inspect_image, is_pinned, load_json
+from .luda import build_template_chain, expand_abbreviations, generate_dockerfile_extension, which
+from .utils import atomic_write
+
+
+LOCKFILE = "luda.lock"
+VERSION = 1
+
+
+def repository(image_name):
+    """`image_name` without its tag or digest, e.g. `nvcr.io/nvidia/pytorch`."""
+    name = image_name.partition("@")[0]
+    head, _, last = name.rpartition("/")
+    return (head + "/" if head else "") + last.partition(":")[0]
+
+
+def pin_digest(image_name, metadata):
+    """The `repo@sha256:...` reference of `image_name`'s content, or its image id if it was never pushed."""
+    repo = repository(image_name)
+    for digest in metadata.digests:
+        if repository(digest) == repo:
+            return digest
+    return metadata.digests[0] if metadata.digests else metadata.id
+
+
+def derived_key(base_digest, templates):
+    return "+".join([base_digest] + list(templates))
+
+
+class Lockfile(object):
+    """
+    :param path: location of the lockfile
+    :param images: image as given (e.g. `nv:pytorch:17.10`) -> {image, digest, id, templates}
+    :param derived: `<base digest>+<template>...` -> {image, id}
+    """
+
+    def __init__(self, path, images=None, derived=None):
+        self.path = path
+        self.images = dict(images or {})
+        self.derived = dict(derived or {})
+
+    @classmethod
+    def fromFile(cls, path):
+        """The lockfile at `path`; empty if there is none."""
+        data = load_json(path, {})
+        if data.get("version", VERSION) != VERSION:
+            raise ValueError("{0}: unsupported lockfile version {1}".format(path, data.get("version")))
+        return cls(path, data.get("images"), data.get("derived"))
+
+    @classmethod
+    def find(cls, config, directory=None):
+        """The lockfile of the work directory (default: the current one), or None."""
+        name = config.get("lockfile", LOCKFILE)
+        if not name:
+            return None
+        path = os.path.join(directory or os.getcwd(), os.path.expanduser(name))
+        return cls.fromFile(path) if os.path.isfile(path) else None
+
+    def pinned(self, image_arg, image_name):
+        """The pinned digest of an image given as `image_arg` (expanded to `image_name`), else `image_name`."""
+        entry = self.images.get(image_arg) or self.images.get(image_name)
+        return entry["digest"] if entry else image_name
+
+    def pinned_derived(self, base_digest, templates):
+        return self.derived.get(derived_key(base_digest, templates))
+
+    def pin(self, image_arg, image_name, digest, image_id):
+        chains = (self.images.get(image_arg) or {}).get("templates", [])
+        self.images[image_arg] = {"image": image_name, "digest": digest, "id": image_id, "templates": chains}
+
+    def add_chain(self, image_arg, templates):
+        chains = self.images[image_arg]["templates"]
+        if list(templates) not in chains:
+            chains.append(list(templates))
+
+    def pin_derived(self, base_digest, templates, image_name, image_id):
+        self.derived[derived_key(base_digest, templates)] = {"image": image_name, "id": image_id}
+
+    def prune(self):
+        """Drops derived images of bases that are no longer pinned."""
+        digests = set(entry["digest"] for entry in self.images.values())
+        self.derived = dict((key, entry) for key, entry in self.derived.items()
+                            if any(key.startswith(digest + "+") for digest in digests))
+
+    def specs(self):
+        """(image, templates) for every locked image and template chain."""
+        specs = []
+        for image_arg in sorted(self.images):
+            specs.append((image_arg, []))
+            specs.extend((image_arg, chain) for chain in self.images[image_arg].get("templates", []))
+        return specs
+
+    def toDict(self):
+        return {"version": VERSION, "images": self.images, "derived": self.derived}
+
+    def write(self):
+        atomic_write(self.path, json.dumps(self.toDict(), indent=2, sort_keys=True) + "\n")
+
+
+def pull_image(exe, image_name, image_cache=None):
+    """
+    Pulls `image_name`; a pull may move the tag, so its entry in
+    `image_cache` is dropped afterwards.
+
+    :return: True if the pull succeeded
+    """
+    pulled = subprocess.call([exe, "pull", image_name], stdout=subprocess.PIPE) == 0
+    if image_cache is not None:
+        image_cache.invalidate(image_name)
+    return pulled
+
+
+def lock_images(specs, config, lockfile, config_path=None, template_path=None, exe=None, engine=None, pull=True,
+                concurrency=4):
+    """
+    Pins every `(image, templates)` in `specs` in `lockfile`: the image's tag
+    is resolved afresh (pulled first with `pull`) to its digest, then the
+    templates are applied in order on top of the digest; a chain built as
+    one multi-stage image only pins its final image.
+
+    :return: `lockfile`, updated but not written
+    """
+    # luda.batch imports launch, which imports this module
+    from .batch import schedule
+
+    abbreviations = config.get("abbreviations", {})
+    image_cache = ImageCache(ttl=config.get("image_cache_ttl", 300))
+    exe = exe or which("nvidia-docker") or "docker"
+    if engine is not None:
+        inspect = engine.inspect_image
+    else:
+        inspect = lambda name: inspect_image(exe, name)
+
+    def resolve(image_arg):
+        image_name = expand_abbreviations(image_arg, abbreviations)
+        if not is_pinned(image_name):
+            # the point of locking is the tag's current content, not a cached mapping
+            image_cache.invalidate(image_name)
+            if pull:
+                pull_image(exe, image_name, image_cache)
+        metadata = image_cache.get(image_name, inspect)
+        if metadata is None:
+            raise ValueError("cannot resolve image {0}".format(image_arg))
+        digest = pin_digest(image_name, metadata)
+        # the digest is what launches will ask the cache for
+        image_cache.store(digest, metadata)
+        return image_name, digest, metadata.id
+
+    image_args = sorted(set(image_arg for image_arg, _ in specs))
+    resolved = dict(zip(image_args, schedule(image_args, resolve, concurrency)))
+    for image_arg in image_args:
+        if isinstance(resolved[image_arg], Exception):
+            raise resolved[image_arg]
+
+    fuse = not config.get("template_intermediates", False)
+
+    def build(spec):
+        image_arg, templates = spec
+        _, digest, _ = resolved[image_arg]
+        image_name = digest
+        pins = []
+        if fuse and len(templates) > 1:
+            # a fused chain has no intermediate images to pin
+            image_name, _ = build_template_chain(image_name, templates, template_path or config_path,
+                                                 inspect=inspect, image_cache=image_cache, engine=engine)
+            metadata = image_cache.get(image_name, inspect)
+            if metadata is None:
+                raise ValueError("templates {0} did not produce {1}".format("+".join(templates), image_name))
+            return [(templates, image_name, metadata.id)]
+        for idx, template in enumerate(templates):
+            image_name = generate_dockerfile_extension(image_name, template, template_path or config_path,
+                                                       inspect=inspect, image_cache=image_cache, engine=engine)
+            metadata = image_cache.get(image_name, inspect)
+            if metadata is None:
+                raise ValueError("template {0} did not produce {1}".format(template, image_name))
+            pins.append((templates[:idx + 1], image_name, metadata.id))
+        return pins
+
+    for image_arg in image_args:
+        lockfile.pin(image_arg, *resolved[image_arg])
+
+    chains = [(image_arg, list(templates)) for image_arg, templates in specs if templates]
+    for (image_arg, templates), pins in zip(chains, schedule(chains, build, concurrency)):
+        if isinstance(pins, Exception):
+            raise pins
+        lockfile.add_chain(image_arg, templates)
+        for chain, derived_name, derived_id in pins:
+            lockfile.pin_derived(resolved[image_arg][1], chain, derived_name, derived_id)
+    lockfile.prune()
+    return lockfile
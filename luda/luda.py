@@ -1,14 +1,14 @@
 # -*- coding: utf-8 -*-
 from __future__ import print_function
+import contextlib
+import json
 import os
+import threading
 
 import click
-import docker
-
-from j2docker import j2docker
 
+from .cache import BuildManifest, ImageCache, hash_bytes
 from .config import get_template_path
-from .utils import cd
 
 class Volume(object):
 
@@ -24,16 +24,26 @@ class Volume(object):
         if not container_path:
             container_path = os.path.join("/", os.path.basename(host_path))
 
-        readonly = ":ro" if readonly and readonly.lower() == "ro" else ""
+        # mode options: `ro`, and `prefetch` (luda only) to read the files into the page cache
+        modes = [mode.strip().lower() for mode in (readonly or "").split(",")]
+        readonly = ":ro" if "ro" in modes else ""
 
         self.host_path = host_path
         self.container_path = container_path
         self.readonly = readonly
+        self.prefetch = "prefetch" in modes
+
+    @property
+    def spec(self):
+        return "{host_path}:{container_path}{readonly}".format(**vars(self))
+
+    @property
+    def args(self):
+        return ["-v", self.spec]
 
     @property
     def string(self):
-        string = " -v {host_path}:{container_path}{readonly}"
-        return string.format(**vars(self))
+        return " -v " + self.spec
 
     @classmethod
     def fromString(cls, string):
@@ -80,10 +90,10 @@ def add_display():
     """
     try:
         vol = Volume("/tmp/.X11-unix", "/tmp/.X11-unix")
-        return "--env=\"DISPLAY\""
+        return ["--env=DISPLAY"]
     except:
         print("Warning: DISPLAY not passed thru")
-        return ""
+        return []
 
 def parse_tuple(tuple_string):
     """
@@ -108,33 +118,246 @@ def expand_abbreviations(template, abbreviations):
 
     return template
 
-def generate_dockerfile_extension(base_image, template_name, config_path):
+def derived_image_name(base_image, template_name):
+    """
+    Name of the image produced by extending `base_image` with `template_name`,
+    e.g. `luda/nvidia-cuda-8.0-devel:dev` or `luda/nvidia-cuda-8.0-devel:dev-tools`; a digest base
+    `nvidia/cuda@sha256:...` gives `luda/nvidia-cuda-sha256-...:dev`.
+    """
+    if base_image.startswith("luda/"):
+        _, _, image_name = base_image.partition("luda/")
+        image_name, _, tag = image_name.partition(":")
+        return "luda/{0}:{1}-{2}".format(image_name, tag, template_name)
+    return "luda/{0}:{1}".format(base_image.replace('/', '-').replace(':', '-').replace('@', '-'), template_name)
+
+
+def docker_py_inspect(client):
+    """
+    Returns an inspect callable for `ImageCache.get` backed by a docker-py client.
+    """
+    import docker
+
+    def inspect(image_name):
+        try:
+            return client.api.inspect_image(image_name)
+        except docker.errors.APIError:
+            return None
+    return inspect
+
+
+def generate_dockerfile_extension(base_image, template_name, config_path, inspect=None,
+                                  image_cache=None, manifest=None, engine=None):
     """
     Extends the base_image with a named template.
-    
+
     :param base_image: 
     :param template_name: 
     :return: name of created docker image (type=string)
     """
+    return build_derived_image(base_image, template_name, config_path, inspect=inspect,
+                               image_cache=image_cache, manifest=manifest, engine=engine)[0]
+
+
+def render_template(base_image, template_name, config_path):
+    """
+    Renders a named template on top of `base_image`.
+
+    :return: (template directory, rendered Dockerfile)
+    """
+    # jinja2 is only imported on the template path; plain launches never pay for it
+    from j2docker import j2docker
+
     template_path = get_template_path(template_name, config_path)
     template_file = os.path.join(template_path, "Dockerfile")
+    return template_path, j2docker.render(base_image, template_file).decode().strip()
+
+
+def build_derived_image(base_image, template_name, config_path, inspect=None, image_cache=None,
+                        manifest=None, engine=None, force=False, verbose=True):
+    """
+    Builds `base_image` extended with a named template; see `build_image`.
+
+    :return: (name of the derived image, True if it was built)
+    """
+    template_path, docker_str = render_template(base_image, template_name, config_path)
+    return build_image(derived_image_name(base_image, template_name), base_image, docker_str, template_path,
+                       inspect=inspect, image_cache=image_cache, manifest=manifest, engine=engine,
+                       force=force, verbose=verbose, template=template_name)
+
+
+FUSED_STAGE = "luda-stage-{0}"
+
+
+def name_final_stage(docker_str, stage):
+    """
+    `docker_str` with its last FROM named `stage`, and the name the stage
+    is referred to by: an existing `AS` name is kept.
+    """
+    lines = docker_str.splitlines()
+    for idx in reversed(range(len(lines))):
+        words = lines[idx].split()
+        if words and words[0].upper() == "FROM":
+            if len(words) >= 4 and words[-2].upper() == "AS":
+                return docker_str, words[-1]
+            lines[idx] = "{0} AS {1}".format(lines[idx].rstrip(), stage)
+            return "\n".join(lines), stage
+    raise ValueError("Dockerfile has no FROM instruction:\n{0}".format(docker_str))
+
+
+def fuse_templates(base_image, templates, config_path, manifest=None):
+    """
+    Renders a chain of templates into one multi-stage Dockerfile: the first
+    template extends `base_image`, every later one the previous stage.  Each
+    template's COPY/ADD sources are moved below a directory of its own, so
+    the stages share one build context.
+
+    :return: FusedContext
+    """
+    from .context import FusedContext, prefix_sources
+
+    manifest = manifest or BuildManifest()
     dockerfile = ".Dockerfile.luda"
+    stages = []
+    parts = []
+    base = base_image
+    for idx, template_name in enumerate(templates):
+        template_path, docker_str = render_template(base, template_name, config_path)
+        prefix = FUSED_STAGE.format(idx)
+        if idx < len(templates) - 1:
+            docker_str, base = name_final_stage(docker_str, prefix)
+        stages.append((prefix, manifest.context(template_path, dockerfile, docker_str)))
+        parts.append("# template: {0}\n{1}".format(template_name, prefix_sources(docker_str, prefix)))
+    return FusedContext(stages, dockerfile, "\n\n".join(parts) + "\n")
 
-    def remove():
-        if os.path.exists(dockerfile):
-            os.remove(dockerfile)
 
-    with cd(template_path, remove):
-        with open(dockerfile, "w") as output:
-            docker_str = j2docker.render(base_image, template_file).decode().strip()
-            output.write(docker_str)
-        client = docker.from_env()
-        if base_image.startswith("luda/"):
-            _, _, image_name = base_image.partition("luda/")
-            image_name, _, tag = image_name.partition(":")
-            image_name = "luda/{0}:{1}-{2}".format(image_name, tag, template_name)
-        else:
-            image_name = "luda/{0}:{1}".format(base_image.replace('/', '-').replace(':', '-'), template_name)
-        click.echo("Building image: {0} ...".format(image_name))
-        client.images.build(path=os.getcwd(), tag=image_name, dockerfile=dockerfile) # This line doesn't work with Python 3...
+def fused_image_name(base_image, templates, context):
+    """
+    Content-addressed name of the image a fused template chain produces,
+    e.g. `luda/nvidia-cuda-8.0-devel:dev-tools-0123456789ab`.
+    """
+    digest = hash_bytes(json.dumps([hash_bytes(context.dockerfile.encode("utf-8")), context.digest]).encode("utf-8"))
+    suffix = digest.replace("sha256:", "")[:12]
+    image_name = derived_image_name(base_image, "-".join(list(templates) + [suffix]))
+    # docker tags are limited to 128 characters
+    if len(image_name.partition(":")[2]) > 128:
+        image_name = derived_image_name(base_image, suffix)
     return image_name
+
+
+def build_template_chain(base_image, templates, config_path, inspect=None, image_cache=None, manifest=None,
+                         engine=None, force=False, verbose=True):
+    """
+    Builds `base_image` extended with a chain of templates as a single
+    multi-stage build; no intermediate image is tagged.
+
+    :return: (name of the derived image, True if it was built)
+    """
+    manifest = manifest or BuildManifest()
+    context = fuse_templates(base_image, templates, config_path, manifest)
+    return build_image(fused_image_name(base_image, templates, context), base_image, context.dockerfile, None,
+                       inspect=inspect, image_cache=image_cache, manifest=manifest, engine=engine, force=force,
+                       verbose=verbose, context=context, template="+".join(templates))
+
+
+class BuildRequired(Exception):
+    """Raised by `build_image` instead of building while builds are disabled (see `no_builds`)."""
+    pass
+
+
+_builds = threading.local()
+
+
+@contextlib.contextmanager
+def no_builds():
+    """Makes `build_image` raise BuildRequired in this thread instead of building an image."""
+    _builds.disabled = True
+    try:
+        yield
+    finally:
+        _builds.disabled = False
+
+
+def build_image(image_name, base_image, docker_str, context_path, inspect=None, image_cache=None,
+                manifest=None, engine=None, force=False, verbose=True, context=None, **info):
+    """
+    Builds the rendered Dockerfile `docker_str` (which extends `base_image`)
+    as `image_name` unless the build manifest shows the image was already
+    produced from the same Dockerfile, build context files and base image id
+    and `image_name` still refers to the image recorded then.
+
+    The build context holds only the files in `context_path` that COPY/ADD
+    reference and is assembled in memory, so concurrent builds (of the same
+    template for different base images) do not interfere.
+
+    :param context_path: directory the build context is taken from, or None for an empty context
+    :param inspect: callable returning `docker inspect` JSON for an image or None
+    :param image_cache: ImageCache used to resolve image ids
+    :param manifest: BuildManifest recording previous builds
+    :param engine: EngineClient to inspect and build with instead of docker-py
+    :param context: prepared build context (e.g. a FusedContext) used instead of `context_path`
+    :param force: build even if the manifest has a matching entry
+    :param verbose: stream the build output and print a per-step timing table
+    :param info: extra fields stored with the manifest entry and build timings
+    :return: (image_name, True if it was built)
+    """
+    from .progress import BuildTimer, record_build_times
+    from .trace import span
+
+    dockerfile = ".Dockerfile.luda"
+    image_cache = image_cache or ImageCache()
+    manifest = manifest or BuildManifest()
+    client = None
+    if inspect is None and engine is not None:
+        inspect = engine.inspect_image
+    elif inspect is None:
+        import docker
+        client = docker.from_env()
+        inspect = docker_py_inspect(client)
+
+    # only the files COPY/ADD can reach count towards the key and the context
+    if context is None:
+        with span("build context"):
+            context = manifest.context(context_path, dockerfile, docker_str)
+    key = None
+    base = image_cache.get(base_image, inspect)
+    if base is not None:
+        key = manifest.build_key(docker_str, context.digest, base.id)
+        entry = None if force else manifest.lookup(image_name, key)
+        # the tag may have been removed (`docker rmi`, `docker image prune`) or rebuilt since
+        if entry and getattr(image_cache.get(image_name, inspect), "id", None) == entry.get("image_id"):
+            return image_name, False
+    if getattr(_builds, "disabled", False):
+        raise BuildRequired(image_name)
+
+    click.echo("Building image: {0} ...".format(image_name))
+    timer = BuildTimer(image_name, echo=(lambda text: click.echo(text, nl=False)) if verbose else None)
+    with span("build context"):
+        tarball = context.tarball(manifest.cache_dir)
+    if engine is not None:
+        chunks = engine.build(tarball, image_name, dockerfile)
+    else:
+        import io
+        import docker
+        client = client or docker.from_env()
+        chunks = client.api.build(fileobj=io.BytesIO(tarball), custom_context=True, tag=image_name,
+                                  dockerfile=dockerfile, rm=True, decode=True)
+    with span("docker build", image=image_name):
+        timer.consume(chunks)
+    if verbose:
+        click.echo(timer.table())
+
+    # the build may have pulled the base image; re-resolve so the key is complete
+    image_cache.invalidate(image_name)
+    if base is None:
+        base = image_cache.get(base_image, inspect)
+        if base is not None:
+            key = manifest.build_key(docker_str, context.digest, base.id)
+    built = image_cache.get(image_name, inspect)
+    record_build_times(timer, cache_dir=manifest.cache_dir, base_image=base_image,
+                       base_id=base.id if base else None, **info)
+    if key is not None and built is not None:
+        # the size of the image's own layers, for `luda gc`
+        manifest.record(image_name, key, base_image=base_image, base_id=base.id, context_path=context_path,
+                        image_id=built.id, build_time=round(timer.elapsed, 3),
+                        size=max(0, built.size - base.size) if built.size else None, **info)
+    return image_name, True
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+"""
+Warm the derived template images for a set of base images ahead of use.
+"""
+
+import time
+
+from .batch import schedule
+from .cache import BuildManifest, ImageCache, inspect_image
+from .luda import build_derived_image, derived_image_name, expand_abbreviations, which
+
+
+class PrebuildResult(object):
+
+    def __init__(self, base_image, template, image=None, built=False, elapsed=0.0, error=None):
+        self.base_image = base_image
+        self.template = template
+        self.image = image
+        self.built = built
+        self.elapsed = elapsed
+        self.error = error
+
+    @property
+    def status(self):
+        if self.error is not None:
+            return "error"
+        return "built" if self.built else "hit"
+
+    def toDict(self):
+        return {"base_image": self.base_image, "template": self.template, "image": self.image,
+                "status": self.status, "elapsed": round(self.elapsed, 3), "error": self.error}
+
+
+def prebuild(images, templates, config, concurrency, config_path=None, template_path=None, exe=None,
+             engine=None, force=False, on_done=None):
+    """
+    Builds `luda/<base>:<template>` for every base image and template.
+
+    Base images are inspected once up front so concurrent builds sharing a
+    base do not race to inspect it; the matrix is then built with at most
+    `concurrency` builds in flight.
+
+    :return: list of PrebuildResult in (image, template) order
+    """
+    abbreviations = config.get("abbreviations", {})
+    images = [expand_abbreviations(image, abbreviations) for image in images]
+    image_cache = ImageCache(ttl=config.get("image_cache_ttl", 300))
+    manifest = BuildManifest()
+    if engine is not None:
+        inspect = engine.inspect_image
+    else:
+        exe = exe or which("nvidia-docker") or "docker"
+        inspect = lambda name: inspect_image(exe, name)
+
+    schedule(images, lambda image: image_cache.get(image, inspect), concurrency)
+
+    def build(item):
+        base_image, template = item
+        start = time.time()
+        result = PrebuildResult(base_image, template, derived_image_name(base_image, template))
+        try:
+            result.image, result.built = build_derived_image(
+                base_image, template, template_path or config_path, inspect=inspect, image_cache=image_cache,
+                manifest=manifest, engine=engine, force=force, verbose=False)
+        except Exception as err:
+            result.error = str(err)
+        result.elapsed = time.time() - start
+        return result
+
+    matrix = [(image, template) for image in images for template in templates]
+    wrapped = None
+    if on_done is not None:
+        wrapped = lambda idx, result: on_done(result)
+    return schedule(matrix, build, concurrency, wrapped)
+
+
+def format_summary(results, elapsed, concurrency):
+    width = max([len("image")] + [len(r.image or "") for r in results])
+    lines = ["{0:<{w}}  {1:>6}  {2:>8}".format("image", "status", "time [s]", w=width)]
+    for r in results:
+        line = "{0:<{w}}  {1:>6}  {2:8.2f}".format(r.image, r.status, r.elapsed, w=width)
+        if r.error:
+            line += "  " + r.error
+        lines.append(line)
+    counts = dict((status, len([r for r in results if r.status == status])) for status in ("hit", "built", "error"))
+    build_time = sum(r.elapsed for r in results if r.status == "built")
+    lines.append("{0} images: {1} cache hits, {2} built ({3:.2f} s build time), {4} errors in {5:.2f} s "
+                 "(parallelism {6})".format(len(results), counts["hit"], counts["built"], build_time,
+                                            counts["error"], elapsed, concurrency))
+    return "\n".join(lines)
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+
+"""
+Page-cache prefetch of input files while the container starts.
+
+Files below the given paths are read into the host page cache by a pool of
+threads, up to a byte budget, so the container's first pass over them is
+served from memory rather than the network filesystem.  Each file gets
+`POSIX_FADV_SEQUENTIAL`/`POSIX_FADV_WILLNEED` hints before it is read.
+Because luda normally replaces itself with docker, the prefetch runs in a
+detached child process and reports progress as JSON lines to a log file.
+"""
+
+import json
+import os
+import threading
+import time
+
+from .batch import schedule
+from .config import get_cache_dir
+from .resources import meminfo
+from .utils import makedirs
+
+
+CHUNK = 1 << 20
+
+# progress is logged after every this many bytes
+REPORT_EVERY = 256 << 20
+
+
+def default_budget():
+    """Half of the host's available memory."""
+    info = meminfo()
+    return int(info.get("MemAvailable", info.get("MemTotal", 0)) / 2)
+
+
+def list_files(paths):
+    """Files below `paths` (files or directories) in walk order."""
+    files = []
+    for path in paths:
+        if os.path.isfile(path):
+            files.append(path)
+            continue
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            files.extend(os.path.join(dirpath, name) for name in sorted(filenames))
+    return files
+
+
+def advise(fd, size):
+    if hasattr(os, "posix_fadvise"):
+        os.posix_fadvise(fd, 0, size, os.POSIX_FADV_SEQUENTIAL)
+        os.posix_fadvise(fd, 0, size, os.POSIX_FADV_WILLNEED)
+
+
+class Prefetcher(object):
+    """
+    :param paths: files or directories to prefetch
+    :param budget: maximum number of bytes read
+    :param concurrency: files read at once
+    :param on_progress: called with the Prefetcher after every `REPORT_EVERY` bytes and at the end
+    """
+
+    def __init__(self, paths, budget, concurrency=8, on_progress=None):
+        self.paths = list(paths)
+        self.budget = budget
+        self.concurrency = concurrency
+        self.on_progress = on_progress
+        self.files = 0
+        self.bytes = 0
+        self.reserved = 0
+        self.start = None
+        self.end = None
+        self._lock = threading.Lock()
+        self._reported = 0
+
+    def reserve(self, size):
+        """Claims up to `size` bytes of the budget."""
+        with self._lock:
+            claim = max(0, min(size, self.budget - self.reserved))
+            self.reserved += claim
+            return claim
+
+    def _progress(self, nbytes):
+        report = False
+        with self._lock:
+            self.bytes += nbytes
+            if self.bytes - self._reported >= REPORT_EVERY:
+                self._reported = self.bytes
+                report = True
+        if report and self.on_progress is not None:
+            self.on_progress(self)
+
+    def fetch(self, path):
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            return 0
+        try:
+            size = os.fstat(fd).st_size
+            limit = self.reserve(size)
+            if not limit:
+                return 0
+            advise(fd, limit)
+            done = 0
+            while done < limit:
+                data = os.read(fd, min(CHUNK, limit - done))
+                if not data:
+                    break
+                done += len(data)
+                self._progress(len(data))
+            with self._lock:
+                self.files += 1
+            return done
+        finally:
+            os.close(fd)
+
+    def run(self):
+        self.start = time.time()
+        schedule(list_files(self.paths), self.fetch, self.concurrency)
+        self.end = time.time()
+        if self.on_progress is not None:
+            self.on_progress(self)
+        return self
+
+    def toDict(self):
+        elapsed = (self.end or time.time()) - (self.start or time.time())
+        return {"files": self.files, "bytes": self.bytes, "budget": self.budget, "elapsed": round(elapsed, 3),
+                "done": self.end is not None}
+
+
+def prefetch_log(cache_dir=None):
+    return os.path.join(cache_dir or get_cache_dir(), "prefetch.log")
+
+
+def log_progress(path):
+    def report(prefetcher):
+        record = prefetcher.toDict()
+        record["time"] = round(time.time(), 3)
+        with open(path, "a") as handle:
+            handle.write(json.dumps(record, sort_keys=True) + "\n")
+    return report
+
+
+def start_prefetch(paths, budget=None, concurrency=8, log_path=None, detach=True):
+    """
+    Starts prefetching `paths` in the background and returns immediately.
+
+    :param detach: run in a detached (double-forked) process that outlives an
+                   `exec` of docker; otherwise in a daemon thread of this process
+    :return: path of the progress log
+    """
+    log_path = log_path or prefetch_log()
+    makedirs(os.path.dirname(log_path))
+    prefetcher = Prefetcher(paths, default_budget() if budget is None else budget, concurrency,
+                            log_progress(log_path))
+    if not detach:
+        thread = threading.Thread(target=prefetcher.run)
+        thread.daemon = True
+        thread.start()
+        return log_path
+
+    pid = os.fork()
+    if pid:
+        os.waitpid(pid, 0)
+        return log_path
+    # the intermediate child exits at once so the prefetcher is never left as a zombie of docker
+    try:
+        if os.fork() == 0:
+            try:
+                os.setsid()
+                # holding luda's stdout open would keep `luda ... | tee` or `$(luda ...)` waiting for the prefetch
+                devnull = os.open(os.devnull, os.O_RDWR)
+                for fd in (0, 1, 2):
+                    os.dup2(devnull, fd)
+                os.close(devnull)
+                prefetcher.run()
+            finally:
+                os._exit(0)
+    finally:
+        os._exit(0)
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+"""Streaming build output with per-step timing."""
+
+import json
+import os
+import re
+import time
+
+from .config import get_cache_dir
+from .utils import makedirs
+
+
+STEP_RE = re.compile(r"^Step (\d+)(?:/(\d+))? : (.*)$")
+
+UPLOAD_STEP = "(context upload)"
+
+
+class BuildError(Exception):
+    """The builder reported an error."""
+
+
+class BuildStep(object):
+
+    def __init__(self, number, instruction, start):
+        self.number = number
+        self.instruction = instruction
+        self.start = start
+        self.end = None
+
+    @property
+    def elapsed(self):
+        return (self.end or time.time()) - self.start
+
+    def toDict(self):
+        return {"step": self.number, "instruction": self.instruction, "elapsed": round(self.elapsed, 3)}
+
+
+class BuildTimer(object):
+    """
+    Consumes decoded build progress messages (as yielded by docker-py's
+    `APIClient.build(decode=True)` or `EngineClient.build`), echoes the
+    output as it arrives and records how long each Dockerfile step took.
+    The time until the first message is recorded as the context upload.
+    """
+
+    def __init__(self, image_name, echo=None):
+        self.image_name = image_name
+        self.echo = echo
+        self.start = time.time()
+        self.end = None
+        self.steps = []
+
+    def _begin(self, number, instruction):
+        now = time.time()
+        if self.steps and self.steps[-1].end is None:
+            self.steps[-1].end = now
+        self.steps.append(BuildStep(number, instruction, now))
+
+    def feed(self, chunk):
+        if not self.steps:
+            upload = BuildStep(0, UPLOAD_STEP, self.start)
+            upload.end = time.time()
+            self.steps.append(upload)
+        if "error" in chunk:
+            raise BuildError(chunk["error"].strip())
+        text = chunk.get("stream", "")
+        for line in text.splitlines():
+            match = STEP_RE.match(line.strip())
+            if match:
+                self._begin(int(match.group(1)), match.group(3))
+        if text and self.echo is not None:
+            self.echo(text)
+
+    def consume(self, chunks):
+        for chunk in chunks:
+            self.feed(chunk)
+        self.finish()
+        return self
+
+    def finish(self):
+        if self.steps and self.steps[-1].end is None:
+            self.steps[-1].end = time.time()
+        self.end = time.time()
+
+    @property
+    def elapsed(self):
+        return (self.end or time.time()) - self.start
+
+    def toDict(self):
+        return {"image": self.image_name, "elapsed": round(self.elapsed, 3),
+                "steps": [step.toDict() for step in self.steps]}
+
+    def table(self):
+        lines = ["{0:>5}  {1:>8}  {2}".format("step", "time [s]", "instruction")]
+        for step in self.steps:
+            instruction = step.instruction if len(step.instruction) <= 60 else step.instruction[:57] + "..."
+            lines.append("{0:>5}  {1:8.2f}  {2}".format(step.number or "", step.elapsed, instruction))
+        lines.append("{0:>5}  {1:8.2f}  {2}".format("", self.elapsed, "total: " + self.image_name))
+        return "\n".join(lines)
+
+
+def build_times_file(cache_dir=None):
+    return os.path.join(cache_dir or get_cache_dir(), "build-times.jsonl")
+
+
+def record_build_times(timer, cache_dir=None, **info):
+    """
+    Appends the timer's step timings as one JSON line to
+    `<cache_dir>/build-times.jsonl` for tracking build-time regressions.
+    """
+    record = timer.toDict()
+    record.update(info, finished=round(time.time(), 3))
+    path = build_times_file(cache_dir)
+    makedirs(os.path.dirname(path))
+    with open(path, "a") as handle:
+        handle.write(json.dumps(record, sort_keys=True) + "\n")
+    return record
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+
+"""
+IPC, shared memory and ulimit settings for GPU workloads.
+
+A resource profile (see `BUILTIN_PROFILES`, extended or overridden by
+`resource_profiles` in config.yml) describes how to size `/dev/shm` from
+the host's memory and GPU count, which ulimits to raise, the IPC mode and
+whether to mount the host's hugepages.  The computed values end up as
+plain docker options in the printed command line.
+"""
+
+import os
+
+from .topology import get_topology
+
+
+GIB = 1 << 30
+MIB = 1 << 20
+
+BUILTIN_PROFILES = {
+    # multi-GPU training: NCCL's shared memory transport plus DataLoader workers
+    'nccl': {
+        'shm_per_gpu': '2g',
+        'shm_min': '1g',
+        'shm_max_fraction': 0.5,
+        'ulimits': {'memlock': -1, 'stack': 67108864},
+    },
+    # short single-process jobs
+    'small': {
+        'shm_size': '256m',
+        'ulimits': {'memlock': -1},
+    },
+    # many DataLoader workers exchanging large batches through /dev/shm
+    'dataloader': {
+        'shm_per_gpu': '8g',
+        'shm_min': '2g',
+        'shm_max_fraction': 0.75,
+        'ulimits': {'memlock': -1, 'stack': 67108864, 'nofile': 1048576},
+    },
+}
+
+DEFAULT_PROFILE = 'nccl'
+
+
+def parse_size(value):
+    """Bytes in a docker size such as `512m` or `2g`; integers are bytes."""
+    if isinstance(value, (int, float)):
+        return int(value)
+    units = {"b": 1, "k": 1 << 10, "m": MIB, "g": GIB, "t": 1 << 40}
+    value = str(value).strip().lower()
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+
+def format_size(size):
+    """Size in whole GiB or MiB (rounded down) for a docker option."""
+    if size >= GIB and size % GIB == 0:
+        return "{0}g".format(size // GIB)
+    return "{0}m".format(max(1, size // MIB))
+
+
+def meminfo(path="/proc/meminfo"):
+    """`/proc/meminfo` as a dict of name -> bytes (or counts for HugePages_*)."""
+    info = {}
+    try:
+        with open(path) as handle:
+            for line in handle:
+                name, _, value = line.partition(":")
+                words = value.split()
+                if words and words[0].isdigit():
+                    info[name] = int(words[0]) * (1024 if words[1:] == ["kB"] else 1)
+    except (IOError, OSError):
+        pass
+    return info
+
+
+class HostResources(object):
+    """
+    Memory, GPU count and hugepage availability of the host.  With `gpus`
+    left as None the GPUs are counted from the host's topology the first
+    time a profile sizes something per GPU.
+    """
+
+    def __init__(self, memory, gpus=0, hugepages=False, config=None):
+        self.memory = memory
+        self._gpus = gpus
+        self.hugepages = hugepages
+        self.config = config or {}
+
+    @property
+    def gpus(self):
+        if self._gpus is None:
+            config = self.config
+            try:
+                self._gpus = len(get_topology(config.get("topology", "sysfs"), config.get("sysfs_root", "/")).gpus())
+            except (ImportError, AttributeError, ValueError):
+                self._gpus = 0
+        return self._gpus
+
+    @classmethod
+    def fromHost(cls, config=None):
+        info = meminfo()
+        memory = info.get("MemTotal") or os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+        return cls(memory, None, info.get("HugePages_Total", 0) > 0, config)
+
+
+def get_profile(name, config):
+    """The resource profile `name`: the built-in one updated with `resource_profiles.<name>` from the config."""
+    profiles = config.get("resource_profiles") or {}
+    if name not in BUILTIN_PROFILES and name not in profiles:
+        raise ValueError("unknown resource profile {0!r}, expected one of {1}".format(
+            name, ", ".join(sorted(set(BUILTIN_PROFILES) | set(profiles)))))
+    profile = dict(BUILTIN_PROFILES.get(name, {}))
+    profile.update(profiles.get(name) or {})
+    return profile
+
+
+def shm_size(profile, host):
+    """
+    Explicit `shm_size`, else `shm_per_gpu` times the GPU count, at least
+    `shm_min` and at most `shm_max_fraction` of host memory.
+    """
+    if profile.get('shm_size'):
+        return parse_size(profile['shm_size'])
+    size = parse_size(profile.get('shm_per_gpu', '1g')) * host.gpus
+    size = max(size, parse_size(profile.get('shm_min', '1g')))
+    if host.memory:
+        size = min(size, int(host.memory * float(profile.get('shm_max_fraction', 0.5))))
+    # whole MiB, so the printed value is the value docker gets
+    return size - size % MIB
+
+
+def resource_args(profile, host):
+    """docker run options for `profile` on `host`."""
+    args = []
+    ipc = profile.get('ipc')
+    if ipc:
+        args.append("--ipc={0}".format(ipc))
+    # with the host's IPC namespace docker ignores --shm-size
+    if ipc != 'host':
+        args.append("--shm-size={0}".format(format_size(shm_size(profile, host))))
+    ulimits = profile.get('ulimits') or {}
+    for name in sorted(ulimits):
+        args.extend(["--ulimit", "{0}={1}".format(name, ulimits[name])])
+    if profile.get('hugepages') and host.hugepages and os.path.isdir("/dev/hugepages"):
+        args.extend(["-v", "/dev/hugepages:/dev/hugepages"])
+    return args
+
+
+_host = None
+
+
+def get_host_resources(config=None):
+    """HostResources of this machine, detected once per process."""
+    global _host
+    if _host is None:
+        _host = HostResources.fromHost(config)
+    return _host
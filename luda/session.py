@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+
+"""
+Warm container sessions.
+
+The first `luda run --session` leaves a detached container running the
+bootstrap with a keep-alive command.  Later launches with the same image,
+run options, volumes and environment `docker exec` into it through
+`su-exec` instead of creating a new container.  Sessions are tracked in
+`<cache_dir>/sessions.json`; idle ones are removed after `session_ttl`
+seconds and at most `max_sessions` are kept per user.
+
+A session container also expires on its own: its keep-alive command exits
+once nothing else has run in the container for `session_ttl` seconds, and
+the container is started with `--rm`, so idle sessions go away even if
+luda is never run again.
+"""
+
+import contextlib
+import fcntl
+import json
+import os
+import subprocess
+import time
+
+from .cache import _lock, hash_bytes, load_json
+from .config import get_cache_dir
+from .launch import LaunchPlan, get_user_identity
+from .utils import atomic_write, makedirs
+
+
+SESSION_LABEL = "luda.session"
+
+# written by the keep-alive command once the bootstrap has created the user
+READY_FILE = "/tmp/.luda-session"
+
+# exits once no process but PID 1 and itself has been seen for {ttl} seconds, checking every {interval}
+KEEPALIVE = ('touch {ready} && idle=0 && while [ "$idle" -lt {ttl} ]; do '
+             'sleep {interval}; idle=$((idle + {interval})); '
+             'for proc in /proc/[0-9]*; do case "${{proc#/proc/}}" in 1|$$) ;; *) idle=0 ;; esac; done; done')
+
+# options that only control how luda attaches, not the container itself
+ATTACH_OPTIONS = ("--rm", "-d", "-t", "-i")
+
+
+class SessionError(Exception):
+    """A session container could not be started or reached."""
+
+
+class ExecPlan(LaunchPlan):
+    """A `docker exec` into the running container `image` (a session name)."""
+
+    @property
+    def argv(self):
+        return [self.exe, "exec"] + self.run_args + [self.image] + self.command
+
+
+def keepalive(ttl):
+    """Keep-alive command of a session container idle for at most `ttl` seconds."""
+    ttl = max(1, int(ttl))
+    return ["/bin/sh", "-c", KEEPALIVE.format(ready=READY_FILE, ttl=ttl, interval=min(60, ttl))]
+
+
+def container_args(plan):
+    return [arg for arg in plan.run_args if arg not in ATTACH_OPTIONS]
+
+
+def session_key(plan):
+    """Hash of everything that defines the container: image, options, volumes and env."""
+    return hash_bytes(json.dumps([plan.image] + container_args(plan)).encode("utf-8"))
+
+
+def session_name(user, key):
+    return "luda-session-{0}-{1}".format(user, key.replace("sha256:", "")[:12])
+
+
+def option_value(args, *names):
+    """Value of the last occurrence of option `names` in an argv list, or None."""
+    value = None
+    for idx, arg in enumerate(args):
+        if arg in names and idx + 1 < len(args):
+            value = args[idx + 1]
+        elif "=" in arg and arg.split("=", 1)[0] in names:
+            value = arg.split("=", 1)[1]
+    return value
+
+
+class SessionManager(object):
+    """
+    :param exe: docker executable
+    :param ttl: seconds after its last launch an idle session is removed
+    :param limit: maximum number of sessions per user
+    """
+
+    def __init__(self, exe, ttl=1800, limit=4, cache_dir=None):
+        self.exe = exe
+        self.ttl = ttl
+        self.limit = limit
+        self.sessions_file = os.path.join(cache_dir or get_cache_dir(), "sessions.json")
+
+    def sessions(self):
+        return load_json(self.sessions_file, {})
+
+    @contextlib.contextmanager
+    def locked(self):
+        """Holds the registry against other threads and other luda processes."""
+        makedirs(os.path.dirname(self.sessions_file))
+        with _lock, open(self.sessions_file + ".lock", "a") as handle:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+            yield
+
+    def _save(self, sessions):
+        atomic_write(self.sessions_file, json.dumps(sessions, indent=2, sort_keys=True))
+
+    def _docker(self, *args):
+        with open(os.devnull, "w") as devnull:
+            return subprocess.call([self.exe] + list(args), stdout=devnull, stderr=devnull)
+
+    def states(self, names):
+        """
+        Maps each existing container in `names` to (running, busy), where busy
+        means a `docker exec` is attached to it.
+        """
+        if not names:
+            return {}
+        proc = subprocess.Popen([self.exe, "inspect", "--type", "container"] + list(names),
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stdout, _ = proc.communicate()
+        try:
+            data = json.loads(stdout.decode() or "[]")
+        except ValueError:
+            data = []
+        states = {}
+        for container in data:
+            state = container.get("State") or {}
+            states[container.get("Name", "").lstrip("/")] = (bool(state.get("Running")),
+                                                             bool(container.get("ExecIDs")))
+        return states
+
+    def remove(self, sessions, name):
+        self._docker("rm", "-f", name)
+        sessions.pop(name, None)
+
+    def reap(self, sessions, states, now=None):
+        """Drops sessions whose container is gone and removes idle ones past the TTL."""
+        now = now or time.time()
+        for name, entry in list(sessions.items()):
+            running, busy = states.get(name, (False, False))
+            if not running or (not busy and now - entry["last_used"] > self.ttl):
+                self.remove(sessions, name)
+
+    def make_room(self, sessions, states, user):
+        """Removes the least recently used idle sessions of `user` until a new one fits."""
+        own = sorted((entry["last_used"], name) for name, entry in sessions.items() if entry["user"] == user)
+        idle = [name for _, name in own if not states.get(name, (False, False))[1]]
+        while len(own) >= self.limit:
+            if not idle:
+                raise SessionError("{0} sessions of {1} are in use (max_sessions: {2})".format(
+                    len(own), user, self.limit))
+            name = idle.pop(0)
+            self.remove(sessions, name)
+            own = [item for item in own if item[1] != name]
+
+    def start(self, plan, name, key, baked, user, timeout=30.0):
+        """Starts the detached session container and waits for the bootstrap to finish."""
+        command = ([user] if baked else []) + keepalive(self.ttl)
+        start = LaunchPlan(plan.exe, plan.image, container_args(plan) + [
+            "-d", "--rm", "--name", name, "--label", "{0}={1}".format(SESSION_LABEL, key)], command)
+        if self._docker(*start.argv[1:]) != 0:
+            raise SessionError("could not start session container {0}".format(name))
+        deadline = time.time() + timeout
+        while self._docker("exec", name, "test", "-e", READY_FILE) != 0:
+            if time.time() > deadline:
+                self._docker("rm", "-f", name)
+                raise SessionError("session container {0} did not become ready".format(name))
+            time.sleep(0.05)
+
+    def attach(self, plan, mode, tty=False, stdin=False, detach=False):
+        """
+        Returns an ExecPlan running the plan's command in a matching session,
+        starting the session container first if there is none.
+
+        :param plan: LaunchPlan built with the `bootstrap` or `baked` identity
+        """
+        if mode not in ("bootstrap", "baked"):
+            raise SessionError("sessions need the bootstrap or baked identity, not {0!r}".format(mode))
+        user = get_user_identity()[0]
+        key = session_key(plan)
+        name = session_name(user, key)
+        now = time.time()
+        with self.locked():
+            sessions = self.sessions()
+            states = self.states(sorted(set(sessions) | set([name])))
+            self.reap(sessions, states, now)
+            if name not in sessions:
+                if states.get(name, (False, False))[0]:
+                    # running, but missing from the registry: adopt it
+                    sessions[name] = {"user": user, "image": plan.image, "key": key, "created": now}
+                else:
+                    self.make_room(sessions, states, user)
+                    self._docker("rm", "-f", name)
+                    self.start(plan, name, key, mode == "baked", user)
+                    sessions[name] = {"user": user, "image": plan.image, "key": key, "created": now}
+            sessions[name]["last_used"] = now
+            self._save(sessions)
+
+        exec_plan = ExecPlan(plan.exe, name)
+        if detach:
+            exec_plan.add("-d")
+        if stdin:
+            exec_plan.add("-i")
+        if tty:
+            exec_plan.add("-t")
+        workdir = option_value(plan.run_args, "--workdir", "-w")
+        if workdir:
+            exec_plan.add("--workdir", workdir)
+        if mode == "baked":
+            exec_plan.command = ["/bootstrap/su-exec"] + plan.command
+        else:
+            exec_plan.command = ["/bootstrap/su-exec", user] + (plan.command or ["/bin/bash"])
+        return exec_plan
@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+
+"""
+Staging of datasets to node-local storage.
+
+`--stage SRC:DEST` copies SRC (typically on NFS/Lustre) into the staging
+area (`staging_dir`, ideally node-local NVMe or tmpfs) and mounts the copy
+at DEST.  Every staged source has its own entry, keyed by the source path,
+holding the copy and a manifest of the size and mtime of every file.  A
+repeat launch only copies files whose size or mtime changed and removes
+files that disappeared from the source, so entries are reused across
+launches on the same node.  Entries unused for `staging_ttl` seconds are
+removed, and with the `lru` eviction policy the least recently used
+entries are removed when a new copy would exceed `staging_budget`.
+Eviction never touches an entry another launch is syncing (it holds the
+entry's lock) or one a running container has mounted.  Changed files are
+copied to a temporary name and renamed into place, so a container still
+reading an entry during a resync sees either the old or the new file.
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+from .batch import schedule
+from .cache import load_json
+from .resources import parse_size
+from .utils import atomic_write, makedirs
+
+
+MANIFEST = "manifest.json"
+DATA = "data"
+LOCK = ".lock"
+
+
+def default_staging_dir():
+    return os.path.join(tempfile.gettempdir(), "luda-staging-{0}".format(os.getuid()))
+
+
+def scan(source):
+    """Maps the relative path of every file below `source` to [size, mtime]."""
+    if os.path.isfile(source):
+        stat = os.stat(source)
+        return {os.path.basename(source): [stat.st_size, stat.st_mtime]}
+    files = {}
+    for dirpath, dirnames, filenames in os.walk(source):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            stat = os.stat(path)
+            files[os.path.relpath(path, source)] = [stat.st_size, stat.st_mtime]
+    return files
+
+
+def lock_entry(entry, blocking=True):
+    """
+    The open, exclusively locked lock file of `entry`.  Without `blocking`,
+    None if another launch holds the lock or the entry is gone.
+    """
+    while True:
+        if blocking:
+            makedirs(entry)
+        try:
+            handle = open(os.path.join(entry, LOCK), "a")
+        except (IOError, OSError):
+            return None
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except (IOError, OSError):
+            handle.close()
+            return None
+        if os.fstat(handle.fileno()).st_nlink:
+            return handle
+        # the entry was evicted while we waited; lock the new one
+        handle.close()
+        if not blocking:
+            return None
+
+
+def entry_size(entry):
+    return sum(size for size, _ in (load_json(os.path.join(entry, MANIFEST), {}).get("files") or {}).values())
+
+
+class StageResult(object):
+
+    def __init__(self, source, path, copied=0, removed=0, reused=0, copied_bytes=0, elapsed=0.0):
+        self.source = source
+        self.path = path
+        self.copied = copied
+        self.removed = removed
+        self.reused = reused
+        self.copied_bytes = copied_bytes
+        self.elapsed = elapsed
+
+    def toDict(self):
+        return dict(vars(self), elapsed=round(self.elapsed, 3))
+
+
+class Stager(object):
+    """
+    :param staging_dir: directory holding the staged entries
+    :param budget: bytes the staged entries may use; None for 90% of the staging filesystem
+    :param eviction: `lru` to evict least recently used entries to stay within budget, `none` to fail instead
+    :param ttl: seconds after their last use entries are removed; None keeps them
+    :param concurrency: files copied at once
+    :param exe: docker executable asked which entries running containers mount; None skips the check
+    """
+
+    def __init__(self, staging_dir=None, budget=None, eviction="lru", ttl=None, concurrency=8, exe=None):
+        if eviction not in ("lru", "none"):
+            raise ValueError("unknown staging eviction policy {0!r}, expected lru or none".format(eviction))
+        self.staging_dir = staging_dir or default_staging_dir()
+        self.budget = budget
+        self.eviction = eviction
+        self.ttl = ttl
+        self.concurrency = concurrency
+        self.exe = exe
+
+    @classmethod
+    def fromConfig(cls, config, exe=None):
+        budget = config.get("staging_budget")
+        return cls(config.get("staging_dir"), parse_size(budget) if budget else None,
+                   config.get("staging_eviction", "lru"), config.get("staging_ttl"),
+                   config.get("staging_concurrency", 8), exe)
+
+    def entry(self, source):
+        key = hashlib.sha256(os.path.abspath(source).encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.staging_dir, key)
+
+    def entries(self):
+        if not os.path.isdir(self.staging_dir):
+            return []
+        return [os.path.join(self.staging_dir, name) for name in os.listdir(self.staging_dir)
+                if os.path.isfile(os.path.join(self.staging_dir, name, MANIFEST))]
+
+    def capacity(self):
+        if self.budget is not None:
+            return self.budget
+        stat = os.statvfs(makedirs(self.staging_dir))
+        return int(stat.f_blocks * stat.f_frsize * 0.9)
+
+    def mounted(self):
+        """Host paths mounted by running containers."""
+        if self.exe is None:
+            return set()
+        try:
+            proc = subprocess.Popen([self.exe, "ps", "--quiet", "--no-trunc"], stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE)
+            ids = proc.communicate()[0].decode().split()
+            if not ids:
+                return set()
+            proc = subprocess.Popen([self.exe, "inspect", "--type", "container"] + ids, stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE)
+            containers = json.loads(proc.communicate()[0].decode() or "[]")
+        except (OSError, ValueError):
+            return set()
+        return set(mount.get("Source") for data in containers for mount in data.get("Mounts") or [])
+
+    def remove(self, entry, mounted=()):
+        """
+        Removes `entry` unless another launch holds its lock or a path in
+        `mounted` lies inside it; True if it was removed.
+        """
+        if any(path == entry or path.startswith(entry + os.sep) for path in mounted):
+            return False
+        lock = lock_entry(entry, blocking=False)
+        if lock is None:
+            return False
+        with lock:
+            shutil.rmtree(entry, ignore_errors=True)
+        return True
+
+    def expire(self, now=None, keep=None):
+        """Removes entries other than `keep` not used within `ttl` seconds."""
+        if self.ttl is None:
+            return
+        now = now or time.time()
+        expired = [entry for entry in self.entries() if entry != keep and
+                   now - load_json(os.path.join(entry, MANIFEST), {}).get("last_used", 0) > self.ttl]
+        mounted = self.mounted() if expired else set()
+        for entry in expired:
+            self.remove(entry, mounted)
+
+    def make_room(self, needed, keep):
+        """Evicts least recently used entries other than `keep` until `needed` more bytes fit."""
+        entries = [(load_json(os.path.join(e, MANIFEST), {}).get("last_used", 0), e)
+                   for e in self.entries() if e != keep]
+        used = sum(entry_size(e) for _, e in entries) + entry_size(keep)
+        capacity = self.capacity()
+        mounted = None
+        for _, entry in sorted(entries):
+            if used + needed <= capacity or self.eviction != "lru":
+                break
+            if mounted is None:
+                mounted = self.mounted()
+            size = entry_size(entry)
+            if self.remove(entry, mounted):
+                used -= size
+        if used + needed > capacity:
+            raise ValueError("staging {0} needs {1} bytes, but only {2} of {3} are free in {4}".format(
+                keep, needed, max(0, capacity - used), capacity, self.staging_dir))
+
+    def stage(self, source):
+        """
+        Brings the staged copy of `source` up to date.
+
+        :return: StageResult; `path` is the local copy to mount
+        """
+        start = time.time()
+        source = os.path.abspath(os.path.expanduser(source))
+        if not os.path.exists(source):
+            raise ValueError("staging source {0} does not exist".format(source))
+        entry = self.entry(source)
+        data = os.path.join(entry, DATA)
+        # one launch syncs an entry at a time; others wait and then find it current
+        with lock_entry(entry):
+            self.expire(start, keep=entry)
+            manifest = load_json(os.path.join(entry, MANIFEST), {})
+            staged = manifest.get("files") or {}
+            files = scan(source)
+            changed = [rel for rel, meta in files.items()
+                       if staged.get(rel) != meta or not os.path.exists(os.path.join(data, rel))]
+            removed = [rel for rel in staged if rel not in files]
+            needed = sum(files[rel][0] - (staged.get(rel) or [0])[0] for rel in changed)
+            if needed > 0:
+                self.make_room(needed, entry)
+
+            for rel in removed:
+                path = os.path.join(data, rel)
+                if os.path.exists(path):
+                    os.remove(path)
+
+            def copy(rel):
+                # a container of an earlier launch may have the entry mounted: it keeps reading the old file
+                # until the complete new one is renamed over it, never a truncated one
+                target = os.path.join(data, rel)
+                fd, tmp_path = tempfile.mkstemp(dir=makedirs(os.path.dirname(target)), prefix=".luda-stage-")
+                os.close(fd)
+                try:
+                    shutil.copy2(source if os.path.isfile(source) else os.path.join(source, rel), tmp_path)
+                    os.rename(tmp_path, target)
+                except Exception:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+                    raise
+
+            errors = [err for err in schedule(changed, copy, self.concurrency) if isinstance(err, Exception)]
+            if errors:
+                raise errors[0]
+            makedirs(data)
+            atomic_write(os.path.join(entry, MANIFEST), json.dumps(
+                {"source": source, "files": files, "last_used": time.time()}))
+
+        path = os.path.join(data, os.path.basename(source)) if os.path.isfile(source) else data
+        return StageResult(source, path, copied=len(changed), removed=len(removed),
+                           reused=len(files) - len(changed), copied_bytes=sum(files[rel][0] for rel in changed),
+                           elapsed=time.time() - start)
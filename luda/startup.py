@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+"""
+Cold-start accounting for the `luda` console script.
+
+Plain launches must not import docker-py, requests or jinja2; those are
+loaded lazily on the template build path, and the launch machinery only
+by the command that runs.  `luda --startup-report` imports the entry point
+in a fresh interpreter under `python -X importtime` and compares the total
+against STARTUP_BUDGET_MS.
+"""
+
+import subprocess
+import sys
+
+
+# cumulative import time of ENTRY_MODULES a plain launch is allowed to spend
+STARTUP_BUDGET_MS = 75
+
+# the console script and the CLI it runs when no daemon answers
+ENTRY_MODULES = ('luda.client', 'luda.cli')
+
+# modules that must only be imported when a template is built
+LAZY_MODULES = ('docker', 'requests', 'urllib3', 'jinja2', 'j2docker', 'poyo')
+
+
+class ImportTiming(object):
+
+    def __init__(self, module, self_us, cumulative_us, depth):
+        self.module = module
+        self.self_us = self_us
+        self.cumulative_us = cumulative_us
+        self.depth = depth
+
+
+def parse_importtime(output):
+    """
+    Parses the stderr of `python -X importtime` into ImportTiming entries.
+    """
+    timings = []
+    for line in output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue  # header line
+        name = fields[2].rstrip()
+        depth = (len(name) - len(name.lstrip())) // 2
+        timings.append(ImportTiming(name.strip(), int(fields[0]), int(fields[1]), depth))
+    return timings
+
+
+def measure(modules=ENTRY_MODULES, python=None):
+    """
+    Imports `modules` in order in a fresh interpreter with `-X importtime`.
+
+    :return: (timings, names of LAZY_MODULES that were imported)
+    """
+    code = "import {0}".format(", ".join(modules))
+    proc = subprocess.Popen([python or sys.executable, "-X", "importtime", "-c", code],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    _, stderr = proc.communicate()
+    timings = parse_importtime(stderr.decode())
+    imported = set(t.module.split(".")[0] for t in timings)
+    return timings, sorted(imported.intersection(LAZY_MODULES))
+
+
+def report(modules=ENTRY_MODULES, budget_ms=STARTUP_BUDGET_MS, top=15):
+    """
+    Returns (text, ok) describing where `modules` spend their import time.
+    """
+    timings, eager = measure(modules)
+    # each module's own entry counts what it imported first, so the entries add up without overlap
+    total_ms = sum(t.cumulative_us for t in timings if t.module in modules and t.depth == 0) / 1000.0
+
+    lines = ["{0:>10} {1:>10}  {2}".format("self [ms]", "cum [ms]", "module")]
+    for t in sorted(timings, key=lambda t: t.self_us, reverse=True)[:top]:
+        lines.append("{0:10.1f} {1:10.1f}  {2}".format(t.self_us / 1000.0, t.cumulative_us / 1000.0, t.module))
+    lines.append("")
+    lines.append("import {0}: {1:.1f} ms (budget {2} ms)".format(", ".join(modules), total_ms, budget_ms))
+    ok = total_ms <= budget_ms and not eager
+    if eager:
+        lines.append("eagerly imported: {0}".format(", ".join(eager)))
+    lines.append("OK" if ok else "OVER BUDGET")
+    return "\n".join(lines), ok
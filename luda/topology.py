@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+
+"""
+GPU topology for per-GPU launches.
+
+A topology source lists the node's GPUs with the CPUs and NUMA node each
+one is attached to.  `SysfsTopology` reads the PCI devices in `/sys`; it
+takes the sysfs root as a parameter, so a fake tree can stand in for it on
+a machine without GPUs.
+"""
+
+import glob
+import importlib
+import os
+
+
+NVIDIA_VENDOR = "0x10de"
+
+# PCI classes of NVIDIA compute devices: VGA controller and 3D controller
+GPU_CLASSES = ("0x0300", "0x0302")
+
+
+def parse_cpulist(text):
+    """Parses a kernel cpu list such as `0-3,8,10-11` into a sorted list of ints."""
+    cpus = set()
+    for part in text.strip().split(","):
+        if not part:
+            continue
+        first, _, last = part.partition("-")
+        cpus.update(range(int(first), int(last or first) + 1))
+    return sorted(cpus)
+
+
+def format_cpulist(cpus):
+    """The inverse of `parse_cpulist`, collapsing runs into ranges."""
+    ranges = []
+    for cpu in sorted(set(cpus)):
+        if ranges and cpu == ranges[-1][1] + 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ",".join(str(a) if a == b else "{0}-{1}".format(a, b) for a, b in ranges)
+
+
+class Gpu(object):
+
+    def __init__(self, index, pci_bus_id, numa_node=None, cpus=()):
+        self.index = index
+        self.pci_bus_id = pci_bus_id
+        self.numa_node = numa_node
+        self.cpus = list(cpus)
+
+    def toDict(self):
+        return {"index": self.index, "pci_bus_id": self.pci_bus_id, "numa_node": self.numa_node,
+                "cpus": format_cpulist(self.cpus)}
+
+
+def read_text(path, default=None):
+    try:
+        with open(path) as handle:
+            return handle.read().strip()
+    except (IOError, OSError):
+        return default
+
+
+class SysfsTopology(object):
+    """
+    GPUs from `<root>/sys/bus/pci/devices`, indexed in PCI bus order (the
+    order the NVIDIA driver enumerates them in).
+
+    :param root: filesystem root the `sys` tree is read from
+    """
+
+    def __init__(self, root="/"):
+        self.root = root
+
+    def _sys(self, *parts):
+        return os.path.join(self.root, "sys", *parts)
+
+    def node_cpus(self, node):
+        path = self._sys("devices", "system", "node", "node{0}".format(node), "cpulist")
+        return parse_cpulist(read_text(path, ""))
+
+    def gpus(self):
+        devices = []
+        for path in sorted(glob.glob(self._sys("bus", "pci", "devices", "*"))):
+            if read_text(os.path.join(path, "vendor")) != NVIDIA_VENDOR:
+                continue
+            if (read_text(os.path.join(path, "class")) or "")[:6] not in GPU_CLASSES:
+                continue
+            devices.append(path)
+        gpus = []
+        for index, path in enumerate(devices):
+            node = int(read_text(os.path.join(path, "numa_node"), "-1"))
+            node = node if node >= 0 else None
+            cpus = parse_cpulist(read_text(os.path.join(path, "local_cpulist"), ""))
+            if not cpus and node is not None:
+                cpus = self.node_cpus(node)
+            gpus.append(Gpu(index, os.path.basename(path), node, cpus))
+        return gpus
+
+
+TOPOLOGIES = {
+    "sysfs": SysfsTopology,
+}
+
+
+def get_topology(name="sysfs", root="/"):
+    """
+    Topology source registered as `name`, or a class given as
+    `package.module:Class` providing `gpus()`; it is constructed with `root`.
+    """
+    if name in TOPOLOGIES:
+        return TOPOLOGIES[name](root)
+    module_name, _, class_name = name.partition(":")
+    if not class_name:
+        raise ValueError("unknown topology source {0!r}, expected one of {1} or module:Class".format(
+            name, ", ".join(sorted(TOPOLOGIES))))
+    return getattr(importlib.import_module(module_name), class_name)(root)
+
+
+def gpu_groups(gpus, per_group=1):
+    """
+    Splits `gpus` into groups of `per_group`, filling each group from one
+    NUMA node where possible so a worker's GPUs share a socket.
+    """
+    if per_group < 1:
+        raise ValueError("GPUs per worker must be at least 1")
+    ordered = sorted(gpus, key=lambda gpu: (gpu.numa_node is None, gpu.numa_node, gpu.index))
+    return [ordered[idx:idx + per_group] for idx in range(0, len(ordered), per_group)]
+
+
+def group_args(group):
+    """docker run options that give a worker its GPUs and pin it to their CPUs and NUMA nodes."""
+    args = ["--env", "NVIDIA_VISIBLE_DEVICES={0}".format(",".join(str(gpu.index) for gpu in group))]
+    cpus = [cpu for gpu in group for cpu in gpu.cpus]
+    if cpus:
+        args.append("--cpuset-cpus={0}".format(format_cpulist(cpus)))
+    if all(gpu.numa_node is not None for gpu in group):
+        nodes = sorted(set(gpu.numa_node for gpu in group))
+        args.append("--cpuset-mems={0}".format(",".join(str(node) for node in nodes)))
+    return args
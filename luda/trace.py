@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+"""
+Launch tracing for `luda run --profile`.
+
+Phases are recorded as Chrome trace "complete" events (load the written
+file in chrome://tracing or https://ui.perfetto.dev).  While no tracer is
+active `span` is a no-op, so the instrumented code paths cost nothing.
+
+The bootstrap (`init.sh`) reports its phases by appending `<mark> <epoch ns>`
+lines to `$LUDA_PROFILE`, a file in a profile directory luda mounts next
+to `/bootstrap`; `Tracer.add_container_marks` turns them into events on a
+separate "container" track.
+"""
+
+import json
+import os
+import time
+
+from .utils import atomic_write
+
+
+HOST_TRACK = 1
+CONTAINER_TRACK = 2
+
+# container path of the directory receiving the bootstrap's marks
+CONTAINER_PROFILE_DIR = "/luda-profile"
+MARKS_FILE = "bootstrap.marks"
+
+# consecutive bootstrap marks -> name of the phase between them
+BOOTSTRAP_PHASES = {
+    ("start", "useradd"): "bootstrap: create user",
+    ("useradd", "exec"): "bootstrap: sudoers",
+}
+
+
+class _Span(object):
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.tracer.add(self.name, self.start, time.time(), **self.args)
+
+
+class _NullSpan(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Tracer(object):
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.events = []
+
+    def add(self, name, start, end, track=HOST_TRACK, **args):
+        event = {"name": name, "cat": "luda", "ph": "X", "pid": self.pid, "tid": track,
+                 "ts": int(round(start * 1e6)), "dur": max(0, int(round((end - start) * 1e6)))}
+        if args:
+            event["args"] = args
+        self.events.append(event)
+        return event
+
+    def span(self, name, **args):
+        return _Span(self, name, args)
+
+    def add_container_marks(self, path, launched, finished):
+        """
+        Adds the bootstrap phases from the marks file at `path`.  `launched`
+        and `finished` bracket the docker run; the time until the first mark
+        is container creation and start, and the time after the last mark
+        is the user's command.
+        """
+        marks = []
+        try:
+            with open(path) as handle:
+                for line in handle:
+                    parts = line.split()
+                    # busybox `date` has no %N; such marks are skipped
+                    if len(parts) == 2 and parts[1].isdigit():
+                        marks.append((parts[0], int(parts[1]) / 1e9))
+        except (IOError, OSError):
+            return []
+        if not marks:
+            return []
+        events = [self.add("container create/start", launched, marks[0][1], CONTAINER_TRACK)]
+        for (name, start), (next_name, end) in zip(marks, marks[1:]):
+            phase = BOOTSTRAP_PHASES.get((name, next_name), "bootstrap: {0}".format(name))
+            events.append(self.add(phase, start, end, CONTAINER_TRACK))
+        events.append(self.add("command", marks[-1][1], finished, CONTAINER_TRACK))
+        return events
+
+    def toDict(self):
+        threads = [{"name": "thread_name", "ph": "M", "pid": self.pid, "tid": track, "args": {"name": name}}
+                   for track, name in ((HOST_TRACK, "luda"), (CONTAINER_TRACK, "container"))]
+        return {"traceEvents": threads + sorted(self.events, key=lambda e: e["ts"]), "displayTimeUnit": "ms"}
+
+    def write(self, path):
+        atomic_write(path, json.dumps(self.toDict(), indent=1))
+
+    def summary(self):
+        events = sorted(self.events, key=lambda e: (e["tid"], e["ts"]))
+        width = max([len("phase")] + [len(e["name"]) for e in events])
+        lines = ["{0:<{w}}  {1:>10}".format("phase", "time [ms]", w=width)]
+        for event in events:
+            lines.append("{0:<{w}}  {1:10.1f}".format(event["name"], event["dur"] / 1e3, w=width))
+        return "\n".join(lines)
+
+
+_tracer = None
+
+
+def start_tracing():
+    global _tracer
+    _tracer = Tracer()
+    return _tracer
+
+
+def stop_tracing():
+    global _tracer
+    tracer, _tracer = _tracer, None
+    return tracer
+
+
+def span(name, **args):
+    """Context manager timing `name` on the active tracer; a no-op when not tracing."""
+    if _tracer is None:
+        return _NULL_SPAN
+    return _tracer.span(name, **args)
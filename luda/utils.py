@@ -17,6 +17,22 @@ def cd(newdir, cleanup=lambda: True):
         os.chdir(prevdir)
 
 
+@contextlib.contextmanager
+def environ(env):
+    """Replaces `os.environ` with `env` for the duration; None leaves it as is."""
+    if env is None:
+        yield
+        return
+    saved = dict(os.environ)
+    os.environ.clear()
+    os.environ.update(env)
+    try:
+        yield
+    finally:
+        os.environ.clear()
+        os.environ.update(saved)
+
+
 @contextlib.contextmanager
 def tempdir():
     dirpath = tempfile.mkdtemp()
@@ -24,3 +40,30 @@ def tempdir():
         shutil.rmtree(dirpath)
     with cd(dirpath, cleanup):
         yield dirpath
+
+
+def makedirs(path):
+    """Create `path` and any missing parents; no error if it already exists."""
+    try:
+        os.makedirs(path)
+    except OSError:
+        if not os.path.isdir(path):
+            raise
+    return path
+
+
+def atomic_write(path, data):
+    """
+    Write `data` to `path` via a temporary file and a rename so concurrent
+    readers never observe a partially written file.
+    """
+    dirname = makedirs(os.path.dirname(os.path.abspath(path)))
+    fd, tmp_path = tempfile.mkstemp(dir=dirname, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as handle:
+            handle.write(data if isinstance(data, bytes) else data.encode("utf-8"))
+        os.rename(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
@@ -38,7 +38,7 @@ setup(
     },
     entry_points={
         'console_scripts': [
-            'luda=luda.cli:main'
+            'luda=luda.client:main'
         ]
     },
     include_package_data=True,
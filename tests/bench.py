@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+
+"""
+Benchmarks of the overhead luda adds on top of docker.
+
+Each scenario runs `luda.cli.main` end to end against a fake `docker`
+executable and a fake Engine API socket (see `tests.fakes`) and reports
+the wall time, the number of docker subprocesses, daemon round trips and
+template builds.  Run it with
+
+    python -m tests.bench [--iterations N] [--latency MS] [--json]
+
+`tests/test_bench.py` runs every scenario once and checks the counts, so
+a change that adds a subprocess or round trip to a launch fails the tests.
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from click.testing import CliRunner
+
+from luda import cli
+from .fakes import FakeDocker, FakeEngine
+
+
+IMAGE = "nvcr.io/nvidia/pytorch:17.10"
+INSPECT = {"Id": "sha256:1", "Config": {"Entrypoint": ["/entry.sh"], "Cmd": ["bash", "-l"]}}
+
+
+class Scenario(object):
+    """
+    :param name: label used in the report
+    :param args: arguments passed to `luda`
+    :param warm: run once before measuring, so caches are populated
+    """
+
+    def __init__(self, name, args, warm=False):
+        self.name = name
+        self.args = args
+        self.warm = warm
+
+
+SCENARIOS = [
+    Scenario("cli launch, cold cache", ["--no-exec", "--no-home", "--rm", IMAGE, "true"]),
+    Scenario("cli launch, warm cache", ["--no-exec", "--no-home", "--rm", IMAGE, "true"], warm=True),
+    Scenario("api launch, cold cache", ["--backend", "api", "--no-home", "--rm", IMAGE, "true"]),
+    Scenario("api launch, warm cache", ["--backend", "api", "--no-home", "--rm", IMAGE, "true"], warm=True),
+    Scenario("api template, cold cache", ["--backend", "api", "--no-home", "--rm", "--template", "bench",
+                                          IMAGE, "true"]),
+    Scenario("api template, warm cache", ["--backend", "api", "--no-home", "--rm", "--template", "bench",
+                                          IMAGE, "true"], warm=True),
+]
+
+
+class Measurement(object):
+
+    def __init__(self, scenario, wall_times, subprocesses, round_trips, builds):
+        self.scenario = scenario
+        self.wall_times = wall_times
+        self.subprocesses = subprocesses
+        self.round_trips = round_trips
+        self.builds = builds
+
+    @property
+    def median(self):
+        times = sorted(self.wall_times)
+        return times[len(times) // 2]
+
+    def toDict(self):
+        return {"scenario": self.scenario.name, "median_ms": round(self.median * 1e3, 2),
+                "min_ms": round(min(self.wall_times) * 1e3, 2), "subprocesses": self.subprocesses,
+                "round_trips": self.round_trips, "builds": self.builds}
+
+
+class Workspace(object):
+    """Fake docker, fake daemon, config and template directory in a scratch directory."""
+
+    def __init__(self, root, latency=0.0):
+        self.root = root
+        self.latency = latency
+        bin_dir = os.path.join(root, "bin")
+        os.makedirs(bin_dir)
+        self.docker = FakeDocker(bin_dir, inspect=[INSPECT])
+        self.nvidia_docker = FakeDocker(bin_dir, inspect=[INSPECT], name="nvidia-docker")
+        self.engine = FakeEngine(os.path.join(root, "docker.sock"))
+        self.engine.latency = latency
+        self.engine.images[IMAGE] = INSPECT
+        self.config_path = os.path.join(root, "config")
+        template = os.path.join(self.config_path, "bench")
+        os.makedirs(template)
+        with open(os.path.join(template, "Dockerfile"), "w") as handle:
+            handle.write("RUN true\n")
+        with open(os.path.join(self.config_path, "config.yml"), "w") as handle:
+            handle.write("docker_socket: {0}\n".format(self.engine.socket_path))
+        self.env = {"PATH": bin_dir + os.pathsep + os.environ.get("PATH", ""),
+                    "FAKE_DOCKER_LATENCY": str(latency)}
+
+    def __enter__(self):
+        self.engine.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        self.engine.__exit__(*exc)
+
+    def subprocesses(self):
+        return len(self.docker.calls()) + len(self.nvidia_docker.calls())
+
+    def invoke(self, args, cache_dir):
+        env = dict(self.env, LUDA_CACHE_DIR=cache_dir)
+        return CliRunner(env=env).invoke(cli.main, ["-c", self.config_path] + args)
+
+    def measure(self, scenario, iterations=5):
+        wall_times = []
+        subprocesses = round_trips = builds = 0
+        for idx in range(iterations):
+            cache_dir = os.path.join(self.root, "cache-{0}-{1}".format(id(scenario), idx))
+            if scenario.warm:
+                self.invoke(scenario.args, cache_dir)
+            before = (self.subprocesses(), len(self.engine.calls), len(self.engine.builds))
+            start = time.time()
+            result = self.invoke(scenario.args, cache_dir)
+            wall_times.append(time.time() - start)
+            if result.exception is not None and not isinstance(result.exception, SystemExit):
+                raise result.exception
+            if result.exit_code != 0:
+                raise RuntimeError("{0}: luda exited with {1}\n{2}".format(
+                    scenario.name, result.exit_code, result.output))
+            subprocesses = self.subprocesses() - before[0]
+            round_trips = len(self.engine.calls) - before[1]
+            builds = len(self.engine.builds) - before[2]
+            # every iteration starts from an empty cache directory
+            shutil.rmtree(cache_dir, ignore_errors=True)
+        return Measurement(scenario, wall_times, subprocesses, round_trips, builds)
+
+
+def run_scenarios(scenarios=None, iterations=5, latency=0.0, root=None):
+    """Measures `scenarios` (default: all) and returns a list of Measurement."""
+    root = root or tempfile.mkdtemp(prefix="luda-bench-")
+    try:
+        with Workspace(root, latency) as workspace:
+            return [workspace.measure(scenario, iterations) for scenario in scenarios or SCENARIOS]
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def format_report(measurements):
+    width = max(len(m.scenario.name) for m in measurements)
+    lines = ["{0:<{w}}  {1:>10}  {2:>8}  {3:>11}  {4:>6}".format(
+        "scenario", "median ms", "subproc", "round trips", "builds", w=width)]
+    for m in measurements:
+        lines.append("{0:<{w}}  {1:10.2f}  {2:>8}  {3:>11}  {4:>6}".format(
+            m.scenario.name, m.median * 1e3, m.subprocesses, m.round_trips, m.builds, w=width))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.0, help="latency added to each docker call [ms]")
+    parser.add_argument("--json", action="store_true", help="print the measurements as JSON")
+    args = parser.parse_args(argv)
+    measurements = run_scenarios(iterations=args.iterations, latency=args.latency / 1e3)
+    if args.json:
+        print(json.dumps([m.toDict() for m in measurements], indent=2))
+    else:
+        print(format_report(measurements))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,15 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from luda import resources
+
+from .fakes import FakeDocker
+
+
+@pytest.fixture
+def fake_docker(tmpdir, monkeypatch):
+    monkeypatch.setenv("LUDA_CACHE_DIR", str(tmpdir.join("cache")))
+    # a host with 64 GiB and no GPUs, whatever machine the tests run on
+    monkeypatch.setattr(resources, "_host", resources.HostResources(64 * resources.GIB))
+    return FakeDocker(tmpdir.mkdir("bin"))
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+
+"""
+Stand-ins for the docker daemon used by the tests.
+"""
+
+import json
+import os
+import re
+import stat
+import struct
+import threading
+import time
+
+try:
+    import socketserver
+    from http.server import BaseHTTPRequestHandler
+    from urllib.parse import unquote
+except ImportError:  # python 2
+    import SocketServer as socketserver
+    from BaseHTTPServer import BaseHTTPRequestHandler
+    from urllib import unquote
+
+
+FAKE_DOCKER = """#!/bin/sh
+echo "$@" >> {log}
+sleep ${{FAKE_DOCKER_LATENCY:-0}}
+case "$1" in
+    inspect)
+        if [ "$3" = "container" ]; then
+            cat "${{FAKE_DOCKER_CONTAINERS:-/dev/null}}"
+            exit 0
+        fi
+        cat <<'JSON'
+{inspect}
+JSON
+        exit 0
+        ;;
+    exec|pull|rm|rmi|stop|kill)
+        exit 0
+        ;;
+    ps)
+        cat "${{FAKE_DOCKER_PS:-/dev/null}}"
+        exit 0
+        ;;
+    wait)
+        # the sleep must not hold the output pipes, so killing this script closes them
+        sleep ${{FAKE_DOCKER_SLEEP:-0}} > /dev/null 2>&1
+        echo ${{FAKE_DOCKER_EXIT:-0}}
+        exit 0
+        ;;
+    logs)
+        printf 'step 1\nstep 2\n'
+        exit 0
+        ;;
+    run)
+        if [ "$2 $3 $4" = "--rm --entrypoint cat" ]; then
+            cat "${{FAKE_DOCKER_ROOT:-/nonexistent}}$6" 2> /dev/null
+            exit $?
+        fi
+        for arg; do
+            if [ "$arg" = "-d" ]; then
+                echo 0123456789abcdef
+                exit 0
+            fi
+        done
+        sleep ${{FAKE_DOCKER_SLEEP:-0}}
+        for last; do :; done
+        case "$last" in
+            ''|*[!0-9]*) exit 0 ;;
+            *) exit "$last" ;;
+        esac
+        ;;
+esac
+exit 3
+"""
+
+
+class FakeDocker(object):
+    """
+    A `docker` executable in `directory` that records its calls and answers
+    inspect; `docker run --rm --entrypoint cat IMAGE FILE` reads FILE below
+    `$FAKE_DOCKER_ROOT`.  `$FAKE_DOCKER_LATENCY` seconds are added to every call.
+    """
+
+    def __init__(self, directory, inspect=None, name="docker"):
+        self.path = os.path.join(str(directory), name)
+        self.log = os.path.join(str(directory), name + ".log")
+        inspect = inspect or [{"Id": "sha256:1", "Config": {"Entrypoint": ["/entry.sh"], "Cmd": ["bash", "-l"]}}]
+        with open(self.path, "w") as handle:
+            handle.write(FAKE_DOCKER.format(log=self.log, inspect=json.dumps(inspect)))
+        os.chmod(self.path, os.stat(self.path).st_mode | stat.S_IEXEC)
+
+    def calls(self):
+        if not os.path.exists(self.log):
+            return []
+        with open(self.log) as handle:
+            return [line.split() for line in handle]
+
+
+class FakeEngineHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.engine.connections += 1
+
+    def address_string(self):
+        return "unix"
+
+    def log_message(self, *args):
+        pass
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _reply(self, status, payload=None, content_type="application/json"):
+        data = b""
+        if payload is not None:
+            data = json.dumps(payload).encode("utf-8") if content_type == "application/json" else payload
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _dispatch(self):
+        engine = self.server.engine
+        path, _, query = self.path.partition("?")
+        body = self._body()
+        engine.calls.append((self.command, path, query, body))
+        if engine.latency:
+            time.sleep(engine.latency)
+
+        if path == "/_ping":
+            return self._reply(200, b"OK", "text/plain")
+
+        match = re.match(r"^/images/(.+)/json$", path)
+        if match and self.command == "GET":
+            image = engine.images.get(match.group(1))
+            if image is None:
+                return self._reply(404, {"message": "No such image: " + match.group(1)})
+            return self._reply(200, image)
+
+        if path == "/build" and self.command == "POST":
+            tag = re.search(r"(?:^|&)t=([^&]*)", query)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            for line in engine.build_output:
+                self.wfile.write((json.dumps(line) + "\r\n").encode("utf-8"))
+            if tag:
+                name = unquote(tag.group(1))
+                engine.images[name] = {"Id": "sha256:built-" + name, "Config": {}}
+                engine.builds.append((name, body))
+            self.close_connection = True
+            return
+
+        if path == "/containers/create" and self.command == "POST":
+            container_id = "c{0}".format(len(engine.containers) + 1)
+            engine.containers[container_id] = json.loads(body.decode("utf-8"))
+            return self._reply(201, {"Id": container_id})
+
+        match = re.match(r"^/containers/([^/]+)(?:/(\w+))?$", path)
+        if match:
+            container_id, action = match.groups()
+            if container_id not in engine.containers:
+                return self._reply(404, {"message": "No such container"})
+            if action == "start":
+                return self._reply(204)
+            if action == "wait":
+                return self._reply(200, {"StatusCode": engine.exit_code})
+            if action in ("kill", "stop"):
+                engine.stopped.append((container_id, action))
+                return self._reply(204)
+            if action in ("attach", "logs"):
+                self.send_response(200)
+                self.send_header("Content-Type", "application/vnd.docker.raw-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                for stream_type, data in engine.output:
+                    self.wfile.write(struct.pack(">BxxxL", stream_type, len(data)) + data)
+                self.close_connection = True
+                return
+            if action is None and self.command == "DELETE":
+                engine.removed.append(container_id)
+                return self._reply(204)
+
+        return self._reply(404, {"message": "page not found"})
+
+    do_GET = do_POST = do_DELETE = _dispatch
+
+
+class FakeEngine(object):
+    """
+    A docker daemon stand-in listening on a Unix socket.  It records every
+    request in `calls`, counts accepted connections and delays each response
+    by `latency` seconds.
+    """
+
+    def __init__(self, socket_path):
+        self.socket_path = socket_path
+        self.images = {}
+        self.containers = {}
+        self.removed = []
+        self.stopped = []
+        self.builds = []
+        self.calls = []
+        self.connections = 0
+        self.latency = 0.0
+        self.exit_code = 0
+        self.output = [(1, b"hello\n")]
+        self.build_output = [{"stream": "Step 1/1 : FROM base\n"}, {"stream": "Successfully built\n"}]
+        self.server = socketserver.ThreadingUnixStreamServer(socket_path, FakeEngineHandler)
+        self.server.daemon_threads = True
+        self.server.engine = self
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
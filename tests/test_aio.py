@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_aio
+----------------------------------
+
+Tests for `luda.aio` module.
+"""
+
+import asyncio
+import os
+
+import pytest
+
+from luda import aio, launch
+
+from .fakes import FakeEngine
+
+
+@pytest.fixture
+def exe(fake_docker, monkeypatch):
+    monkeypatch.setattr(launch, "_identity", ("alice", 1000, "staff", 50))
+    return fake_docker.path
+
+
+def calls(exe, command):
+    with open(exe + ".log") as handle:
+        return [line.split() for line in handle if line.split()[0] == command]
+
+
+def test_plan_launch_is_detached(exe, tmpdir):
+    with tmpdir.as_cwd():
+        plan = aio.plan_launch("img", ["python", "train.py"], volumes=["{0}:/data:ro".format(tmpdir)], env={"A": 1},
+                               name="job", home=False, config={}, exe=exe)
+    assert "-d" in plan.run_args and "--rm" not in plan.run_args
+    assert plan.run_args[-4:] == ["--name", "job", "--env", "A=1"]
+    assert plan.image == "img" and plan.command[-2:] == ["python", "train.py"]
+
+
+def test_launch_wait_and_logs(exe, tmpdir, monkeypatch):
+    monkeypatch.setenv("FAKE_DOCKER_EXIT", "3")
+
+    async def main():
+        container = await aio.launch("img", home=False, config={}, exe=exe)
+        lines = [line async for line in container.logs()]
+        return container, lines, await container.wait()
+
+    with tmpdir.as_cwd():
+        container, lines, code = asyncio.run(main())
+    assert container.id == "0123456789abcdef"
+    assert lines == ["step 1", "step 2"]
+    assert code == container.exit_code == 3
+    assert calls(exe, "rm") == [["rm", "--force", container.id]]
+
+
+def test_many_launches_in_one_loop(exe, tmpdir, monkeypatch):
+    monkeypatch.setenv("FAKE_DOCKER_SLEEP", "0.5")
+
+    async def one(idx):
+        container = await aio.launch("img", ["echo", str(idx)], home=False, remove=False, config={}, exe=exe)
+        return await container.wait()
+
+    async def main():
+        return await asyncio.gather(*[one(idx) for idx in range(8)])
+
+    with tmpdir.as_cwd():
+        assert asyncio.run(main()) == [0] * 8
+    assert len(calls(exe, "wait")) == 8
+    assert not calls(exe, "rm")
+
+
+def test_cancelling_wait_stops_container(exe, tmpdir, monkeypatch):
+    monkeypatch.setenv("FAKE_DOCKER_SLEEP", "30")
+
+    async def main():
+        container = await aio.launch("img", home=False, config={}, exe=exe)
+        task = asyncio.ensure_future(container.wait())
+        await asyncio.sleep(0.2)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return container
+
+    with tmpdir.as_cwd():
+        container = asyncio.run(asyncio.wait_for(main(), 10))
+    assert calls(exe, "stop") == [["stop", "--time", "10", container.id]]
+    assert container.exit_code is None
+
+
+def test_launch_error(exe, tmpdir):
+    with tmpdir.as_cwd(), pytest.raises(aio.LaunchError):
+        asyncio.run(aio.launch("img", home=False, config={}, exe=str(tmpdir.join("missing"))))
+
+
+@pytest.fixture
+def engine(tmpdir):
+    with FakeEngine(str(tmpdir.join("docker.sock"))) as fake:
+        fake.images["img"] = {"Id": "sha256:1", "Config": {"Entrypoint": ["/entry.sh"], "Cmd": ["bash"]}}
+        yield fake
+
+
+def test_launch_over_the_api_backend(exe, engine, tmpdir):
+    engine.exit_code = 3
+    engine.output = [(1, b"step 1\nst"), (2, b"ep 2\n")]
+    config = {"backend": "api", "docker_socket": engine.socket_path}
+
+    async def main():
+        container = await aio.launch("img", home=False, config=config, exe=exe)
+        lines = [line async for line in container.logs()]
+        return container, lines, await container.wait()
+
+    with tmpdir.as_cwd():
+        container, lines, code = asyncio.run(main())
+    assert container.engine is not None
+    assert lines == ["step 1", "step 2"]
+    assert code == container.exit_code == 3
+    assert engine.removed == [container.id]
+    actions = [path.rsplit("/", 1)[-1] for _, path, _, _ in engine.calls if path.startswith("/containers/")]
+    assert actions == ["create", "start", "logs", "wait", container.id]
+    assert not os.path.exists(exe + ".log")
+
+
+def test_api_backend_falls_back_to_the_cli(exe, engine, tmpdir):
+    config = {"backend": "api", "docker_socket": engine.socket_path}
+
+    async def main():
+        container = await aio.launch("img", home=False, options=["--privileged"], config=config, exe=exe)
+        return container, await container.wait()
+
+    with tmpdir.as_cwd():
+        container, code = asyncio.run(main())
+    assert container.engine is None and code == 0
+    assert calls(exe, "run") and calls(exe, "wait")
+    assert not engine.containers
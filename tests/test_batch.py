@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_batch
+----------------------------------
+
+Tests for `luda.batch` module.
+"""
+
+import json
+import os
+import threading
+import time
+
+from click.testing import CliRunner
+
+from luda import cli
+from luda.batch import Job, job_log, load_jobs, run_batch, schedule
+
+
+MANIFEST = """
+defaults:
+    image: nv:pytorch:17.10
+    nccl: no
+jobs:
+    ok:
+        command: python train.py --lr 0.1
+        env:
+            SEED: 1
+    fail:
+        command: 3
+"""
+
+
+def test_load_yaml_manifest(tmpdir):
+    path = tmpdir.join("jobs.yml")
+    path.write(MANIFEST)
+    jobs = load_jobs(str(path))
+    assert [j.name for j in jobs] == ["ok", "fail"]
+    assert jobs[0].command == ["python", "train.py", "--lr", "0.1"]
+    assert jobs[0].docker_argv == ["nv:pytorch:17.10", "python", "train.py", "--lr", "0.1"]
+    assert jobs[0].run_args == ["--env", "SEED=1"]
+    assert jobs[0].nccl is False
+    assert jobs[0].image_key == jobs[1].image_key
+
+
+def test_load_jsonl_manifest(tmpdir):
+    path = tmpdir.join("jobs.jsonl")
+    path.write('{"name": "a", "image": "img", "command": ["echo", "a b"]}\n\n{"image": "img"}\n')
+    jobs = load_jobs(str(path))
+    assert [j.name for j in jobs] == ["a", "job1"]
+    assert jobs[0].command == ["echo", "a b"]
+
+
+def test_schedule_bounds_concurrency():
+    lock = threading.Lock()
+    state = {"running": 0, "peak": 0}
+
+    def work(item):
+        with lock:
+            state["running"] += 1
+            state["peak"] = max(state["peak"], state["running"])
+        time.sleep(0.01)
+        with lock:
+            state["running"] -= 1
+        if item == 3:
+            raise RuntimeError("boom")
+        return item * 2
+
+    results = schedule(list(range(8)), work, 3)
+    assert state["peak"] <= 3
+    assert results[:3] == [0, 2, 4]
+    assert isinstance(results[3], RuntimeError)
+
+
+def test_run_batch_resolves_each_image_once(fake_docker, tmpdir):
+    jobs = [Job("a", "img", command=["0"], home=False),
+            Job("b", "img", command=["5"], home=False),
+            Job("c", "img", command=["0"], home=False)]
+    with tmpdir.as_cwd():
+        results = run_batch(jobs, {}, 2, exe=fake_docker.path, log_dir=str(tmpdir.join("logs")))
+    assert [r.exit_code for r in results] == [0, 5, 0]
+    assert not results[1].ok
+    commands = [call[0] for call in fake_docker.calls()]
+    assert commands.count("inspect") == 1
+    assert commands.count("run") == 3
+    assert os.path.exists(str(tmpdir.join("logs", "b.log")))
+
+
+def test_job_options_without_values(fake_docker, tmpdir):
+    job = Job("a", "ubuntu", command="echo hi", docker_args=["--privileged", "--network=host"], env={"A": "1"},
+              home=False)
+    with tmpdir.as_cwd():
+        results = run_batch([job], {}, 1, exe=fake_docker.path)
+    assert results[0].ok
+    run = [call for call in fake_docker.calls() if call[0] == "run"][0]
+    image = run.index("ubuntu")
+    assert run[-2:] == ["echo", "hi"]
+    assert set(["--privileged", "--network=host", "A=1"]) <= set(run[:image])
+
+
+def test_batch_command(fake_docker, tmpdir, monkeypatch):
+    monkeypatch.setenv("PATH", os.path.dirname(fake_docker.path) + os.pathsep + os.environ["PATH"])
+    path = tmpdir.join("jobs.yml")
+    path.write(MANIFEST)
+    runner = CliRunner()
+    with tmpdir.as_cwd():
+        result = runner.invoke(cli.main, ["batch", "--json", "-c", str(tmpdir), str(path)])
+    assert result.exit_code == 1
+    report = json.loads(result.output[result.output.index("{"):])
+    assert [(j["name"], j["exit_code"]) for j in report["jobs"]] == [("ok", 0), ("fail", 3)]
+
+
+def test_job_log_dir_created_by_concurrent_workers(tmpdir):
+    log_dir = str(tmpdir.join("logs", "run"))
+    jobs = [Job("job{0}".format(idx), "img") for idx in range(16)]
+    results = schedule(jobs, lambda job: job_log(log_dir, job), 16)
+    assert results == [os.path.join(log_dir, "job{0}.log".format(idx)) for idx in range(16)]
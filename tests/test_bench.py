@@ -0,0 +1,29 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_bench
+----------------------------------
+
+Runs the launch benchmarks once and pins their subprocess, round trip and
+build counts.
+"""
+
+from .bench import format_report, run_scenarios
+
+
+EXPECTED = {
+    # scenario: (docker subprocesses, daemon round trips, template builds)
+    "cli launch, cold cache": (2, 0, 0),
+    "cli launch, warm cache": (1, 0, 0),
+    "api launch, cold cache": (0, 6, 0),
+    "api launch, warm cache": (0, 5, 0),
+    "api template, cold cache": (0, 8, 1),
+    "api template, warm cache": (0, 5, 0),
+}
+
+
+def test_launch_overhead(tmpdir):
+    measurements = run_scenarios(iterations=1, root=str(tmpdir.join("bench")))
+    counts = dict((m.scenario.name, (m.subprocesses, m.round_trips, m.builds)) for m in measurements)
+    assert counts == EXPECTED, format_report(measurements)
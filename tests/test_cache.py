@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_cache
+----------------------------------
+
+Tests for `luda.cache` module.
+"""
+
+import pytest
+
+from luda.cache import BuildManifest, ImageCache, ImageMetadata, hash_tree, is_pinned
+
+
+def make_inspect(image_id, entrypoint=None, cmd=None):
+    calls = []
+
+    def inspect(name):
+        calls.append(name)
+        return {"Id": image_id, "RepoDigests": [],
+                "Config": {"Entrypoint": entrypoint, "Cmd": cmd, "WorkingDir": "/opt",
+                           "User": "", "Labels": {"a": "b"}}}
+    inspect.calls = calls
+    return inspect
+
+
+@pytest.fixture
+def cache(tmpdir):
+    return ImageCache(str(tmpdir), ttl=60)
+
+
+def test_is_pinned():
+    assert is_pinned("nvcr.io/nvidia/pytorch@sha256:abc")
+    assert is_pinned("sha256:abc")
+    assert not is_pinned("nvcr.io/nvidia/pytorch:17.10")
+
+
+def test_single_inspect_then_hit(cache):
+    inspect = make_inspect("sha256:1", ["/entry.sh"], ["bash"])
+    meta = cache.get("img:1", inspect)
+    assert meta.entrypoint == ["/entry.sh"]
+    assert meta.cmd == ["bash"]
+    assert meta.workdir == "/opt"
+    assert meta.labels == {"a": "b"}
+    again = cache.get("img:1", inspect)
+    assert again.toDict() == meta.toDict()
+    assert inspect.calls == ["img:1"]
+
+
+def test_stale_tag_reinspects_and_follows_move(cache):
+    cache.get("img:1", make_inspect("sha256:1"))
+    cache.ttl = -1
+    inspect = make_inspect("sha256:2", cmd=["python"])
+    meta = cache.get("img:1", inspect)
+    assert meta.id == "sha256:2"
+    assert inspect.calls == ["img:1"]
+
+
+def test_pinned_ignores_ttl(cache):
+    cache.ttl = -1
+    cache.get("img@sha256:1", make_inspect("sha256:1"))
+    inspect = make_inspect("sha256:1")
+    cache.get("img@sha256:1", inspect)
+    assert inspect.calls == []
+
+
+def test_missing_image_not_cached(cache):
+    assert cache.get("missing:1", lambda name: None) is None
+    assert cache.lookup("missing:1") is None
+
+
+def test_metadata_roundtrip():
+    meta = ImageMetadata("sha256:1", entrypoint=None, cmd=["a", "b"])
+    assert ImageMetadata.fromDict(meta.toDict()).cmd == ["a", "b"]
+    assert meta.entrypoint == []
+
+
+def test_hash_tree_tracks_content(tmpdir):
+    tmpdir.join("Dockerfile").write("RUN true")
+    memo = {}
+    first = hash_tree(str(tmpdir), memo=memo)
+    assert hash_tree(str(tmpdir), memo=memo) == first
+    tmpdir.join("extra.txt").write("x")
+    assert hash_tree(str(tmpdir), memo=memo) != first
+    assert hash_tree(str(tmpdir), exclude=("extra.txt",), memo=memo) == first
+
+
+def test_build_manifest(tmpdir):
+    context = tmpdir.mkdir("template")
+    context.join("Dockerfile").write("RUN true")
+    manifest = BuildManifest(str(tmpdir.join("cache")))
+    digest = manifest.context(str(context), ".Dockerfile.luda", "FROM a\nCOPY . /opt").digest
+    key = manifest.build_key("FROM a\nCOPY . /opt", digest, "sha256:1")
+    assert manifest.lookup("luda/a:dev", key) is None
+    manifest.record("luda/a:dev", key, base_id="sha256:1")
+    assert manifest.lookup("luda/a:dev", key)["base_id"] == "sha256:1"
+    assert manifest.build_key("FROM a\nCOPY . /opt", digest, "sha256:2") != key
+    assert manifest.build_key("FROM a\nRUN false", digest, "sha256:1") != key
+    context.join("extra").write("x")
+    assert manifest.context(str(context), ".Dockerfile.luda", "FROM a\nCOPY . /opt").digest != digest
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_config
+----------------------------------
+
+Tests for `luda.config` module.
+"""
+
+import os
+
+import pytest
+
+from luda import config
+
+
+@pytest.fixture
+def layers(tmpdir, monkeypatch):
+    monkeypatch.setenv("LUDA_CACHE_DIR", str(tmpdir.join("cache")))
+    system = tmpdir.join("system.yml")
+    site = tmpdir.join("site.yml")
+    user = tmpdir.mkdir("user")
+    monkeypatch.setattr(config, "SYSTEM_CONFIG_FILE", str(system))
+    monkeypatch.setenv(config.SITE_CONFIG_ENV, str(site))
+    system.write("abbreviations:\n    sys: registry.example.com/{0}\nbatch_concurrency: 2\n")
+    site.write("batch_concurrency: 8\n")
+    user.join("config.yml").write("abbreviations:\n    me: me/{0}\n")
+    return system, site, user
+
+
+def test_layers_merge_in_order(layers):
+    _, _, user = layers
+    merged = config.read_config(str(user))
+    assert merged["abbreviations"] == {"nv": "nvcr.io/nvidia/{0}", "sys": "registry.example.com/{0}",
+                                       "me": "me/{0}"}
+    assert merged["batch_concurrency"] == 8
+    # merging must not leak into the module level defaults
+    assert config.BUILTIN_ABBREVIATIONS == {"nv": "nvcr.io/nvidia/{0}"}
+
+
+def test_compiled_config_is_reused_until_a_source_changes(layers, monkeypatch):
+    _, site, user = layers
+    config.read_config(str(user))
+
+    compiled = []
+    original = config.compile_config
+    monkeypatch.setattr(config, "compile_config", lambda files: compiled.append(files) or original(files))
+    assert config.read_config(str(user))["batch_concurrency"] == 8
+    assert compiled == []
+
+    site.write("batch_concurrency: 16\n")
+    os.utime(str(site), (1, 1))
+    assert config.read_config(str(user))["batch_concurrency"] == 16
+    assert len(compiled) == 1
+
+
+def test_new_source_file_invalidates(layers, tmpdir):
+    user = tmpdir.mkdir("other")
+    assert "extra" not in config.read_config(str(user))
+    user.join("config.yml").write("extra: 1\n")
+    assert config.read_config(str(user))["extra"] == 1
+
+
+def test_changed_defaults_invalidate(layers, monkeypatch):
+    _, _, user = layers
+    config.read_config(str(user))
+    # an upgraded luda with a new default key
+    monkeypatch.setattr(config, "DEFAULT_CONFIG", dict(config.DEFAULT_CONFIG, new_key=1))
+    assert config.read_config(str(user))["new_key"] == 1
+    monkeypatch.setattr("luda.__version__", "99.0.0")
+    compiled = config.compiled_config_file(config.config_files(str(user)))
+    config.read_config(str(user))
+    with open(compiled, "rb") as handle:
+        assert "99.0.0" in repr(config.marshal.load(handle)["sources"])
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_context
+----------------------------------
+
+Tests for `luda.context` module.
+"""
+
+import io
+import os
+import tarfile
+
+from luda.context import BuildContext, DockerIgnore, FusedContext, copy_sources, prefix_sources, select_files
+
+
+DOCKERFILE = """FROM ubuntu:16.04
+# COPY ignored.txt /nowhere
+COPY --chown=1:1 requirements.txt \\
+     setup.cfg /opt/
+ADD ["wheels/*.whl", "/wheels/"]
+ADD https://example.com/file.tgz /tmp/
+COPY --from=builder /out /out
+RUN pip install /wheels/*.whl
+"""
+
+
+def make_template(tmpdir):
+    root = tmpdir.mkdir("template")
+    root.join("Dockerfile").write("RUN true")
+    root.join("requirements.txt").write("numpy")
+    root.join("setup.cfg").write("[x]")
+    root.mkdir("wheels").join("a.whl").write("a")
+    root.join("wheels", "b.whl").write("b")
+    root.join("wheels", "notes.md").write("n")
+    root.mkdir("datasets").join("big.bin").write("0" * 1024)
+    return root
+
+
+def test_copy_sources():
+    assert copy_sources(DOCKERFILE) == ["requirements.txt", "setup.cfg", "wheels/*.whl"]
+    assert copy_sources("FROM a\nCOPY $SRC /x") is None
+
+
+def test_select_files(tmpdir):
+    root = make_template(tmpdir)
+    assert select_files(str(root), DOCKERFILE) == ["requirements.txt", "setup.cfg", "wheels/a.whl", "wheels/b.whl"]
+    assert select_files(str(root), "FROM a\nRUN true") == []
+    assert "datasets/big.bin" in select_files(str(root), "FROM a\nCOPY . /src")
+
+
+def test_dockerignore(tmpdir):
+    root = make_template(tmpdir)
+    root.join(".dockerignore").write("# comment\nwheels/*.whl\n!wheels/b.whl\n")
+    assert select_files(str(root), DOCKERFILE) == ["requirements.txt", "setup.cfg", "wheels/b.whl"]
+    ignore = DockerIgnore(["**/*.bin"])
+    assert ignore.excluded("datasets/big.bin")
+    assert not ignore.excluded("datasets/big.txt")
+    assert DockerIgnore(["datasets"]).excluded("datasets/big.bin")
+
+
+def test_tarball_is_cached_and_holds_dockerfile(tmpdir):
+    root = make_template(tmpdir)
+    cache = str(tmpdir.join("cache"))
+    context = BuildContext(str(root), ".Dockerfile.luda", DOCKERFILE)
+    data = context.tarball(cache)
+    with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+        names = tar.getnames()
+        assert tar.extractfile(".Dockerfile.luda").read().decode() == DOCKERFILE
+    assert names == ["requirements.txt", "setup.cfg", "wheels/a.whl", "wheels/b.whl", ".Dockerfile.luda"]
+    assert len(os.listdir(os.path.join(cache, "contexts"))) == 1
+
+    # same files, different Dockerfile: the cached archive is reused
+    other = BuildContext(str(root), ".Dockerfile.luda", DOCKERFILE.replace("16.04", "18.04"))
+    assert other.digest == context.digest
+    other.tarball(cache)
+    assert len(os.listdir(os.path.join(cache, "contexts"))) == 1
+
+
+def test_empty_context(tmpdir):
+    root = make_template(tmpdir)
+    data = BuildContext(str(root), ".Dockerfile.luda", "FROM a\nRUN true").tarball(str(tmpdir.join("cache")))
+    with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+        assert tar.getnames() == [".Dockerfile.luda"]
+
+
+def test_prefix_sources():
+    assert prefix_sources(DOCKERFILE, "s0").splitlines() == [
+        "FROM ubuntu:16.04",
+        "# COPY ignored.txt /nowhere",
+        "COPY --chown=1:1 s0/requirements.txt s0/setup.cfg /opt/",
+        'ADD ["s0/wheels/*.whl", "/wheels/"]',
+        "ADD https://example.com/file.tgz /tmp/",
+        "COPY --from=builder /out /out",
+        "RUN pip install /wheels/*.whl",
+    ]
+    assert prefix_sources("FROM a\nCOPY . /src", "s1") == "FROM a\nCOPY s1/ /src"
+
+
+def test_fused_context_flagged_json_copy(tmpdir):
+    root = make_template(tmpdir)
+    root.join("a b").write("ab")
+    dockerfile = 'FROM s0\nCOPY --chown=u ["a b", "/dst"]'
+    assert copy_sources(dockerfile) == ["a b"]
+    fused = prefix_sources(dockerfile, "s1")
+    assert fused.splitlines()[1] == 'COPY --chown=u ["s1/a b", "/dst"]'
+    first = BuildContext(str(root), ".Dockerfile.luda", "FROM a AS s0\nCOPY setup.cfg /opt/")
+    second = BuildContext(str(root), ".Dockerfile.luda", dockerfile)
+    context = FusedContext([("s0", first), ("s1", second)], ".Dockerfile.luda", fused)
+    with tarfile.open(fileobj=io.BytesIO(context.tarball(str(tmpdir.join("cache"))))) as tar:
+        assert tar.getnames() == ["s0/setup.cfg", "s1/a b", ".Dockerfile.luda"]
+
+
+def test_fused_context_prefixes_stage_files(tmpdir):
+    root = make_template(tmpdir)
+    cache = str(tmpdir.join("cache"))
+    first = BuildContext(str(root), ".Dockerfile.luda", "FROM a AS s0\nCOPY setup.cfg /opt/")
+    second = BuildContext(str(root), ".Dockerfile.luda", "FROM s0\nCOPY wheels/b.whl /wheels/")
+    context = FusedContext([("s0", first), ("s1", second)], ".Dockerfile.luda", "FROM a AS s0\n")
+    with tarfile.open(fileobj=io.BytesIO(context.tarball(cache))) as tar:
+        assert tar.getnames() == ["s0/setup.cfg", "s1/wheels/b.whl", ".Dockerfile.luda"]
+        assert tar.extractfile("s1/wheels/b.whl").read() == b"b"
+    assert context.digest != FusedContext([("s0", second), ("s1", first)], ".Dockerfile.luda", "").digest
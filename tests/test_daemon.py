@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_daemon
+----------------------------------
+
+Tests for `luda.daemon` and `luda.client` modules.
+"""
+
+import os
+import socket
+import stat
+import threading
+
+import pytest
+
+from luda import client, launch
+from luda.daemon import DaemonError, LudaDaemon, stop
+
+
+@pytest.fixture
+def daemon(fake_docker, tmpdir, monkeypatch):
+    monkeypatch.setattr(launch, "_identity", ("alice", 1000, "staff", 50))
+    monkeypatch.setattr(launch, "which", lambda name: fake_docker.path)
+    path = str(tmpdir.join("luda.sock"))
+    monkeypatch.setenv("LUDA_DAEMON_SOCKET", path)
+    server = LudaDaemon(path)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    yield server
+    server.shutdown()
+    thread.join()
+    server.close()
+
+
+def run(daemon, tmpdir, *args):
+    return client.request(daemon.socket_path, {"op": "run", "args": list(args), "cwd": str(tmpdir)})
+
+
+def test_socket_path(monkeypatch):
+    monkeypatch.delenv("LUDA_DAEMON_SOCKET", raising=False)
+    monkeypatch.setenv("XDG_RUNTIME_DIR", "/run/user/1000")
+    assert client.socket_path() == "/run/user/1000/luda.sock"
+    monkeypatch.delenv("XDG_RUNTIME_DIR")
+    monkeypatch.setenv("TMPDIR", "/scratch")
+    assert client.socket_path() == "/scratch/luda-{0}/luda.sock".format(os.getuid())
+
+
+def test_default_socket_directory_is_private(tmpdir, monkeypatch):
+    monkeypatch.setattr(launch, "_identity", ("alice", 1000, "staff", 50))
+    for name in ("LUDA_DAEMON_SOCKET", "XDG_RUNTIME_DIR"):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setenv("TMPDIR", str(tmpdir))
+    server = LudaDaemon()
+    try:
+        assert stat.S_IMODE(os.stat(os.path.dirname(server.socket_path)).st_mode) == 0o700
+        assert client.trusted_socket(server.socket_path)
+    finally:
+        server.close()
+
+
+def test_untrusted_sockets_are_ignored(tmpdir, monkeypatch):
+    shared = tmpdir.mkdir("shared")
+    path = str(shared.join("luda.sock"))
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(path)
+    try:
+        assert client.trusted_socket(path)
+        shared.chmod(0o777)
+        assert not client.trusted_socket(path)
+        with pytest.raises(DaemonError):
+            LudaDaemon(path)
+    finally:
+        sock.close()
+    tmpdir.join("plain").write("")
+    assert not client.trusted_socket(str(tmpdir.join("plain")))
+    assert not client.trusted_socket(str(tmpdir.join("missing")))
+
+    # a regular file planted at the socket path never gets a request
+    monkeypatch.setenv("LUDA_DAEMON_SOCKET", str(tmpdir.join("plain")))
+    monkeypatch.setattr(client, "request", lambda *args, **kwargs: pytest.fail("request sent"))
+    with pytest.raises(SystemExit):
+        client.main(["--help"])
+
+
+def test_daemon_socket_is_private(daemon):
+    assert stat.S_IMODE(os.stat(daemon.socket_path).st_mode) == 0o600
+    assert client.request(daemon.socket_path, {"op": "ping"})["pid"] == os.getpid()
+
+
+def test_daemon_refuses_second_instance(daemon):
+    with pytest.raises(DaemonError):
+        LudaDaemon(daemon.socket_path)
+
+
+def test_daemon_replaces_stale_socket(fake_docker, tmpdir, monkeypatch):
+    monkeypatch.setattr(launch, "_identity", ("alice", 1000, "staff", 50))
+    path = str(tmpdir.join("stale.sock"))
+    # bound by a daemon that died without removing it
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(path)
+    sock.close()
+    server = LudaDaemon(path)
+    server.close()
+    assert not os.path.exists(path)
+
+
+def test_daemon_resolves_plan_in_client_cwd(daemon, tmpdir):
+    tmpdir.mkdir("data")
+    reply = run(daemon, tmpdir, "--no-home", "-v", "data:/data", "img", "python", "train.py")
+    argv = reply["argv"]
+    assert argv[0] == daemon.exe
+    assert reply["command"] == " ".join(argv)
+    assert reply["exec"] is True
+    assert "{0}:/work".format(tmpdir) in argv
+    assert "{0}:/data".format(tmpdir.join("data")) in argv
+    assert argv[-2:] == ["python", "train.py"]
+    # default run options, as without a daemon
+    assert "--rm" in argv and "-t" in argv and "-i" in argv
+
+
+@pytest.mark.parametrize("args", [
+    ["--session", "img"],
+    ["--display", "img"],
+    ["--stage", "/nfs/data:/data", "img"],
+    ["--help"],
+    ["-d", "--rm", "img"],
+    ["--no-such-option"],
+    [],
+])
+def test_daemon_leaves_launch_to_client(daemon, tmpdir, args):
+    assert run(daemon, tmpdir, *args) == {"fallback": True}
+
+
+def test_daemon_resolves_in_client_environment(daemon, tmpdir, monkeypatch):
+    home = tmpdir.mkdir("home")
+    home.mkdir("data")
+    env = dict(os.environ, HOME=str(home), LUDA_CACHE_DIR=str(tmpdir.join("client-cache")))
+    reply = client.request(daemon.socket_path, {"op": "run", "args": ["-v", "~/data:/data", "img"],
+                                                "cwd": str(tmpdir), "env": env})
+    assert "{0}:/data".format(home.join("data")) in reply["argv"]
+    assert tmpdir.join("client-cache").check(dir=True)
+    # the daemon's own environment is left as it was
+    assert os.environ["HOME"] != str(home)
+
+
+def test_daemon_leaves_builds_to_client(daemon, tmpdir, capsys):
+    tmpdir.mkdir("templates").mkdir("tools").join("Dockerfile").write("RUN true\n")
+    reply = run(daemon, tmpdir, "--template", "tools", "--template-path", str(tmpdir.join("templates")), "img")
+    assert reply == {"fallback": True}
+    # handed back before building, not as an error
+    captured = capsys.readouterr()
+    assert "Building image" not in captured.out and "Traceback" not in captured.err
+
+
+def test_client_execs_daemon_plan(daemon, tmpdir, monkeypatch, capsys):
+    calls = []
+
+    def execvp(exe, argv):
+        calls.append(argv)
+        raise SystemExit(0)
+
+    monkeypatch.setattr(os, "execvp", execvp)
+    with tmpdir.as_cwd(), pytest.raises(SystemExit):
+        client.main(["run", "--no-home", "img"])
+    assert calls[0][0] == daemon.exe and "img" in calls[0]
+    assert capsys.readouterr().out == " ".join(calls[0]) + "\n"
+
+
+def test_client_falls_back_without_daemon(tmpdir, monkeypatch):
+    monkeypatch.setenv("LUDA_DAEMON_SOCKET", str(tmpdir.join("missing.sock")))
+    with pytest.raises(SystemExit) as exc:
+        client.main(["--help"])
+    assert exc.value.code == 0
+
+
+def test_stop(daemon):
+    assert stop(daemon.socket_path)
+    assert not stop(daemon.socket_path + ".missing")
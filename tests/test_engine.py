@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_engine
+----------------------------------
+
+Tests for `luda.engine` module, run against a stand-in daemon.
+"""
+
+import io
+
+import pytest
+
+from luda.engine import EngineClient, EngineError, UnsupportedOption, container_config
+from luda.launch import LaunchPlan
+
+from .fakes import FakeEngine
+
+
+@pytest.fixture
+def engine(tmpdir):
+    with FakeEngine(str(tmpdir.join("docker.sock"))) as fake:
+        fake.images["ubuntu:16.04"] = {"Id": "sha256:1", "Config": {"Cmd": ["bash"]}}
+        yield fake
+
+
+def test_requests_share_one_connection(engine):
+    client = EngineClient(engine.socket_path)
+    assert client.ping()
+    assert client.inspect_image("ubuntu:16.04")["Id"] == "sha256:1"
+    assert client.inspect_image("missing:1") is None
+    assert client.connections_opened == 1
+    assert engine.connections == 1
+
+
+def test_unreachable_daemon(tmpdir):
+    client = EngineClient(str(tmpdir.join("nothing.sock")))
+    with pytest.raises(EngineError):
+        client.ping()
+
+
+def test_build_streams_progress(engine):
+    client = EngineClient(engine.socket_path)
+    chunks = list(client.build(b"context", "luda/ubuntu-16.04:dev"))
+    assert chunks[0]["stream"].startswith("Step 1/1")
+    assert engine.builds == [("luda/ubuntu-16.04:dev", b"context")]
+    assert client.inspect_image("luda/ubuntu-16.04:dev")
+
+
+def test_run_plan(engine):
+    client = EngineClient(engine.socket_path)
+    engine.exit_code = 7
+    engine.output = [(1, b"out\n"), (2, b"err\n")]
+    plan = LaunchPlan("docker", image="ubuntu:16.04", command=["echo", "hi"],
+                      run_args=["--rm", "-v", "/tmp:/tmp:ro", "--env", "A=1", "--shm-size=1g",
+                                "--ulimit", "memlock=-1", "--workdir", "/work"])
+    out, err = io.BytesIO(), io.BytesIO()
+    assert client.run(plan, stdout=Buffered(out), stderr=Buffered(err)) == 7
+    assert out.getvalue() == b"out\n"
+    assert err.getvalue() == b"err\n"
+    config = engine.containers["c1"]
+    assert config["Cmd"] == ["echo", "hi"]
+    assert config["HostConfig"]["Binds"] == ["/tmp:/tmp:ro"]
+    assert config["HostConfig"]["ShmSize"] == 1 << 30
+    assert engine.removed == ["c1"]
+    # create, start, wait and delete reuse the pooled connection; attach gets its own
+    assert client.connections_opened == 2
+
+
+def test_run_refuses_stdin(engine):
+    client = EngineClient(engine.socket_path)
+    with pytest.raises(UnsupportedOption):
+        client.run(LaunchPlan("docker", image="ubuntu:16.04", run_args=["-i"]))
+    assert engine.containers == {}
+
+
+def test_container_config():
+    plan = LaunchPlan("/usr/bin/nvidia-docker", image="img",
+                      run_args=["-d", "--ulimit", "nofile=1024:2048", "--entrypoint", "/bootstrap/init.sh"])
+    config, options = container_config(plan)
+    assert options["detach"]
+    assert config["Entrypoint"] == ["/bootstrap/init.sh"]
+    assert config["HostConfig"]["Runtime"] == "nvidia"
+    assert config["HostConfig"]["Ulimits"] == [{"Name": "nofile", "Soft": 1024, "Hard": 2048}]
+    assert "Cmd" not in config
+    with pytest.raises(UnsupportedOption):
+        container_config(LaunchPlan("docker", image="img", run_args=["--privileged"]))
+
+
+class Buffered(object):
+
+    def __init__(self, buf):
+        self.buffer = buf
+
+    def write(self, data):
+        self.buffer.write(data.encode("utf-8"))
+
+    def flush(self):
+        pass
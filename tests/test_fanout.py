@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_fanout
+----------------------------------
+
+Tests for `luda.fanout` module.
+"""
+
+import os
+
+import pytest
+from click.testing import CliRunner
+
+from luda import cli
+from luda.fanout import LocalTransport, SSHTransport, fan_out, get_transport, rank_plans, read_hostfile
+from luda.launch import LaunchPlan
+
+
+def test_read_hostfile(tmpdir):
+    hostfile = tmpdir.join("hosts")
+    hostfile.write("# cluster\nnode1 slots=2\n\nnode2  # spare\n")
+    assert read_hostfile(str(hostfile)) == ["node1", "node1", "node2"]
+    hostfile.write("node1 gpus=2\n")
+    with pytest.raises(ValueError):
+        read_hostfile(str(hostfile))
+
+
+def test_rank_plans():
+    plan = LaunchPlan("/usr/bin/docker", "img", ["--rm", "-t", "-i"], ["python", "train.py"])
+    plans = rank_plans(plan, ["node1", "node1", "node2"], master_port=1234)
+    assert [p.run_args[:1] for p in plans] == [["--rm"]] * 3
+    env = [arg for arg in plans[2].run_args if "=" in arg]
+    assert env == ["RANK=2", "WORLD_SIZE=3", "LOCAL_RANK=0", "LOCAL_WORLD_SIZE=1", "MASTER_ADDR=node1",
+                   "MASTER_PORT=1234"]
+    assert "LOCAL_RANK=1" in plans[1].run_args
+
+
+def test_ssh_transport_quotes_command():
+    argv = SSHTransport().argv("node1", ["/usr/bin/docker", "run", "img", "sh", "-c", "echo a b"])
+    assert argv == ["ssh", "-n", "-o", "BatchMode=yes", "node1", "docker run img sh -c 'echo a b'"]
+
+
+def test_ranks_do_not_share_stdin(monkeypatch):
+    spawned = []
+    monkeypatch.setattr("subprocess.Popen", lambda argv, **kwargs: spawned.append(kwargs))
+    SSHTransport().spawn("node1", ["docker", "run", "img"])
+    assert spawned[0]["stdin"].name == os.devnull
+
+
+def test_get_transport():
+    assert isinstance(get_transport("local"), LocalTransport)
+    assert isinstance(get_transport("luda.fanout:SSHTransport"), SSHTransport)
+    with pytest.raises(ValueError):
+        get_transport("telnet")
+
+
+def test_fan_out_gathers_exit_codes(fake_docker):
+    lines = []
+    plan = LaunchPlan(fake_docker.path, "img", ["--rm"], ["5"])
+    results = fan_out(plan, ["a", "b"], LocalTransport(), echo=lines.append)
+    assert [(r.rank, r.host, r.exit_code) for r in results] == [(0, "a", 5), (1, "b", 5)]
+    runs = sorted(" ".join(call) for call in fake_docker.calls())
+    assert "RANK=0" in runs[0] and "RANK=1" in runs[1]
+    assert all(r.started <= r.elapsed for r in results)
+
+
+def test_run_hosts(fake_docker, tmpdir, monkeypatch):
+    monkeypatch.setenv("PATH", os.path.dirname(fake_docker.path) + os.pathsep + os.environ["PATH"])
+    hostfile = tmpdir.join("hosts")
+    hostfile.write("localhost slots=2\n")
+    with tmpdir.as_cwd():
+        result = CliRunner().invoke(cli.main, ["--hosts", str(hostfile), "--transport", "local", "--no-home",
+                                               "-c", str(tmpdir), "img", "true"])
+    assert result.exit_code == 0, result.output
+    runs = [call for call in fake_docker.calls() if call[0] == "run"]
+    assert len(runs) == 2
+    assert all("-t" not in run and "--rm" in run for run in runs)
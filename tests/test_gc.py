@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_gc
+----------------------------------
+
+Tests for `luda.gc` module.
+"""
+
+import json
+
+import pytest
+from click.testing import CliRunner
+
+from luda import cli, launch
+from luda.cache import BuildManifest
+from luda.gc import BuiltImage, ImageCollector, record_use, select_victims
+from luda.launch import resolve_image
+from luda.resources import MIB
+
+
+def image(tag, last_used, size=100, base_id="sha256:base"):
+    return BuiltImage(tag, "sha256:" + tag, base_id, size, last_used)
+
+
+def test_select_victims_lru_within_budget():
+    images = [image("a", 3), image("b", 1), image("c", 2)]
+    assert [i.tag for i in select_victims(images, 150)] == ["b", "c"]
+    assert select_victims(images, 300) == []
+
+
+def test_select_victims_keeps_images_in_use():
+    images = [image("a", 3), image("b", 1), image("c", 2)]
+    assert [i.tag for i in select_victims(images, 200, in_use=set(["sha256:b"]))] == ["c"]
+
+
+def test_select_victims_removes_leaves_first():
+    # dev-tools is built on dev; dev only becomes removable once dev-tools is gone
+    images = [image("dev", 1), image("dev-tools", 2, base_id="sha256:dev"), image("other", 3)]
+    assert [i.tag for i in select_victims(images, 250)] == ["dev-tools"]
+    assert [i.tag for i in select_victims(images, 50)] == ["dev-tools", "dev", "other"]
+
+
+@pytest.fixture
+def collector(fake_docker, tmpdir, monkeypatch):
+    manifest = BuildManifest()
+    for idx, tag in enumerate(["luda/a:dev", "luda/b:dev", "luda/c:dev"]):
+        manifest.record(tag, "key", image_id="sha256:" + tag[5], base_id="sha256:base", size=100 * MIB)
+        record_use(tag)
+    # luda/a:dev is the least recently used, but a stopped container was created from it
+    tmpdir.join("ps").write("c1\n")
+    tmpdir.join("containers.json").write(json.dumps([{"Id": "c1", "Image": "sha256:a"}]))
+    monkeypatch.setenv("FAKE_DOCKER_PS", str(tmpdir.join("ps")))
+    monkeypatch.setenv("FAKE_DOCKER_CONTAINERS", str(tmpdir.join("containers.json")))
+    collector = ImageCollector(fake_docker.path, 150 * MIB)
+    collector.fake_docker = fake_docker
+    return collector
+
+
+def test_collect_removes_lru_images(collector):
+    result = collector.collect()
+    assert [i.tag for i in result.removed] == ["luda/b:dev", "luda/c:dev"]
+    assert result.freed == 200 * MIB and result.total == 300 * MIB
+    assert ["rmi", "luda/b:dev"] in collector.fake_docker.calls()
+    assert sorted(collector.manifest.entries()) == ["luda/a:dev"]
+
+
+def test_collect_dry_run(collector):
+    result = collector.collect(dry_run=True)
+    assert len(result.removed) == 2
+    assert not [call for call in collector.fake_docker.calls() if call[0] == "rmi"]
+    assert len(collector.manifest.entries()) == 3
+
+
+def test_collect_within_budget(collector):
+    collector.budget = 300 * MIB
+    assert collector.collect().removed == []
+    assert not [call for call in collector.fake_docker.calls() if call[0] == "ps"]
+
+
+def test_launch_records_use_and_collects(collector, monkeypatch):
+    monkeypatch.setattr(launch, "_identity", ("alice", 1000, "staff", 50))
+    config = {"gc_auto": True, "image_budget": "150m"}
+    resolve_image("luda/b:dev", config, exe=collector.exe)
+    # luda/b:dev is being launched and luda/a:dev is in use, so only luda/c:dev goes
+    assert sorted(collector.manifest.entries()) == ["luda/a:dev", "luda/b:dev"]
+
+
+def test_gc_command(collector, monkeypatch):
+    monkeypatch.setattr(launch, "which", lambda name: collector.exe)
+    result = CliRunner().invoke(cli.main, ["gc", "--budget", "150m", "--dry-run"])
+    assert result.exit_code == 0, result.output
+    assert "would remove luda/b:dev (100.0 MiB)" in result.output
+    assert CliRunner().invoke(cli.main, ["gc"]).exit_code == 2
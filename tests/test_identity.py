@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_identity
+----------------------------------
+
+Tests for `luda.identity` module.
+"""
+
+import pytest
+
+from luda import launch
+from luda.cache import BuildManifest, ImageCache
+from luda.identity import build_identity_image, identity_dockerfile, identity_files, identity_image_name
+from luda.launch import build_plan
+
+
+IDENTITY = ("alice", 1000, "staff", 50)
+
+
+class FakeAPI(object):
+
+    def __init__(self):
+        self.builds = []
+
+    def build(self, **kwargs):
+        self.builds.append(kwargs)
+        return iter([{"stream": "Step 1/4 : FROM ubuntu:16.04\n"}, {"stream": "Successfully built 0123\n"}])
+
+
+class FakeClient(object):
+
+    def __init__(self):
+        self.api = FakeAPI()
+
+
+def test_identity_dockerfile():
+    dockerfile = identity_dockerfile("ubuntu:16.04", IDENTITY)
+    assert dockerfile.startswith("FROM ubuntu:16.04\nUSER root\n")
+    assert "useradd --shell /bin/bash -u 1000 --gid 50" in dockerfile
+    assert 'LABEL luda.identity="alice:1000:staff:50"' in dockerfile
+    assert identity_image_name("ubuntu:16.04", IDENTITY) == "luda/ubuntu-16.04:id1000-50"
+
+
+def test_identity_image_is_reused_until_the_base_changes(tmpdir, monkeypatch):
+    client = FakeClient()
+    monkeypatch.setattr("docker.from_env", lambda: client)
+    base_ids = {"ubuntu:16.04": "sha256:a"}
+
+    def inspect(name):
+        return {"Id": base_ids.get(name, "sha256:" + name), "Config": {}}
+
+    cache = str(tmpdir.join("cache"))
+    kwargs = dict(inspect=inspect, image_cache=ImageCache(cache, ttl=0), manifest=BuildManifest(cache),
+                  verbose=False)
+    assert build_identity_image("ubuntu:16.04", IDENTITY, **kwargs) == ("luda/ubuntu-16.04:id1000-50", True)
+    assert build_identity_image("ubuntu:16.04", IDENTITY, **kwargs) == ("luda/ubuntu-16.04:id1000-50", False)
+    assert len(client.api.builds) == 1
+
+    base_ids["ubuntu:16.04"] = "sha256:b"
+    assert build_identity_image("ubuntu:16.04", IDENTITY, **kwargs)[1]
+    assert len(client.api.builds) == 2
+
+
+def test_baked_plan_launches_su_exec(fake_docker, tmpdir, monkeypatch):
+    monkeypatch.setattr(launch, "_identity", IDENTITY)
+    built = []
+    monkeypatch.setattr("luda.identity.build_identity_image",
+                        lambda image, identity, **kwargs: built.append((image, identity)) or ("luda/img:id", True))
+    with tmpdir.as_cwd():
+        plan = build_plan(["img"], {"identity": "baked"}, home=False, exe=fake_docker.path)
+        empty = build_plan(["img"], {}, home=False, exe=fake_docker.path, identity="baked",
+                           resolved=("luda/img:id", None))
+    assert built == [("img", IDENTITY)]
+    assert plan.image == "luda/img:id"
+    assert plan.run_args[plan.run_args.index("--entrypoint") + 1] == "/bootstrap/su-exec"
+    assert not [arg for arg in plan.run_args if arg.startswith("HOST_")]
+    assert plan.command == ["alice", "/entry.sh", "bash", "-l"]
+    assert empty.command == ["alice", "/bin/bash"]
+
+
+def test_unknown_identity_mode(fake_docker):
+    with pytest.raises(ValueError):
+        build_plan(["img"], {"identity": "nope"}, exe=fake_docker.path)
+
+
+def test_identity_files(tmpdir):
+    passwd, group = identity_files(IDENTITY, str(tmpdir))
+    with open(passwd) as handle:
+        assert handle.read().splitlines()[1] == "alice:x:1000:50::/home/alice:/bin/bash"
+    with open(group) as handle:
+        assert handle.read().splitlines() == ["root:x:0:", "staff:x:50:alice"]
+    assert identity_files(IDENTITY, str(tmpdir)) == (passwd, group)
+
+
+def test_user_plan_keeps_image_entrypoint(fake_docker, tmpdir, monkeypatch):
+    monkeypatch.setattr(launch, "_identity", IDENTITY)
+    with tmpdir.as_cwd():
+        plan = build_plan(["img"], {}, home=False, exe=fake_docker.path, identity="user")
+        command = build_plan(["img", "nvidia-smi"], {"identity": "user"}, home=False, exe=fake_docker.path)
+    assert "--entrypoint" not in plan.run_args
+    assert plan.run_args[plan.run_args.index("--user") + 1] == "1000:50"
+    assert any(arg.endswith(":/etc/passwd:ro") for arg in plan.run_args)
+    assert any(arg.endswith(":/etc/group:ro") for arg in plan.run_args)
+    assert "HOME=/home/alice" in plan.run_args
+    assert plan.command == []
+    assert command.command == ["nvidia-smi"]
+
+
+def test_user_plan_keeps_image_accounts(fake_docker, tmpdir, monkeypatch):
+    root = tmpdir.mkdir("root")
+    root.mkdir("etc").join("passwd").write("root:x:0:0:root:/root:/bin/bash\n"
+                                           "nobody:x:65534:65534:nobody:/nonexistent:/usr/sbin/nologin\n"
+                                           "ubuntu:x:1000:1000::/home/ubuntu:/bin/bash\n")
+    root.join("etc", "group").write("root:x:0:\nstaff:x:50:\nnogroup:x:65534:\n")
+    monkeypatch.setenv("FAKE_DOCKER_ROOT", str(root))
+    monkeypatch.setattr(launch, "_identity", IDENTITY)
+    with tmpdir.as_cwd():
+        plan = build_plan(["img"], {}, home=False, exe=fake_docker.path, identity="user")
+        build_plan(["img"], {}, home=False, exe=fake_docker.path, identity="user")
+    mounts = dict(arg.split(":")[1::-1] for arg in plan.run_args if arg.endswith(":ro"))
+    with open(mounts["/etc/passwd"]) as handle:
+        assert handle.read().splitlines() == ["root:x:0:0:root:/root:/bin/bash",
+                                              "nobody:x:65534:65534:nobody:/nonexistent:/usr/sbin/nologin",
+                                              "alice:x:1000:50::/home/alice:/bin/bash"]
+    with open(mounts["/etc/group"]) as handle:
+        assert handle.read().splitlines() == ["root:x:0:", "nogroup:x:65534:", "staff:x:50:alice"]
+    # the image's files are read once per image id
+    assert len([call for call in fake_docker.calls() if call[:4] == ["run", "--rm", "--entrypoint", "cat"]]) == 2
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_launch
+----------------------------------
+
+Tests for `luda.launch` module.
+"""
+
+import pytest
+
+from luda.launch import LaunchPlan, build_plan, split_docker_args
+
+
+def test_split_docker_args():
+    assert split_docker_args(["--network", "host", "img", "a", "-b"]) == (["--network", "host"], "img", ["a", "-b"])
+    assert split_docker_args(["img"]) == ([], "img", [])
+    assert split_docker_args(["--network", "host"]) == (["--network", "host"], None, [])
+
+
+def test_launch_plan_argv():
+    plan = LaunchPlan("docker", image="img", run_args=["--rm"], command=["bash", "-c", "echo hi"])
+    assert plan.argv == ["docker", "run", "--rm", "img", "bash", "-c", "echo hi"]
+    assert str(plan) == "docker run --rm img bash -c 'echo hi'"
+
+
+def test_launch_plan_no_exec(fake_docker):
+    plan = LaunchPlan(fake_docker.path, image="img", command=["3"])
+    assert plan.execute(exec_=False) == 3
+
+
+def test_build_plan_uses_image_defaults(fake_docker, tmpdir):
+    with tmpdir.as_cwd():
+        plan = build_plan(["nv:pytorch:17.10"], {"abbreviations": {"nv": "nvcr.io/nvidia/{0}"}},
+                          rm=True, home=False, exe=fake_docker.path)
+    assert plan.image == "nvcr.io/nvidia/pytorch:17.10"
+    assert plan.command == ["/entry.sh", "bash", "-l"]
+    assert plan.run_args[:4] == ["--rm", "--shm-size=1g", "--ulimit", "memlock=-1"]
+    entrypoint = plan.run_args.index("--entrypoint")
+    assert plan.run_args[entrypoint + 1] == "/bootstrap/init.sh"
+    assert "{0}:/work".format(str(tmpdir)) in plan.run_args
+
+
+def test_build_plan_keeps_command_argv(fake_docker, tmpdir):
+    with tmpdir.as_cwd():
+        plan = build_plan(["--network", "host", "img", "sh", "-c", "echo a b"], {}, home=False, exe=fake_docker.path)
+    assert plan.command == ["/entry.sh", "sh", "-c", "echo a b"]
+    assert plan.run_args[-2:] == ["--network", "host"]
+
+
+def test_build_plan_requires_image(fake_docker):
+    with pytest.raises(ValueError):
+        build_plan([], {}, exe=fake_docker.path)
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_lockfile
+----------------------------------
+
+Tests for `luda.lockfile` module.
+"""
+
+import json
+
+import pytest
+from click.testing import CliRunner
+
+from luda import cli, launch, lockfile
+from luda.cache import ImageCache, ImageMetadata
+from luda.launch import build_plan, resolve_image
+from luda.lockfile import Lockfile, lock_images, pin_digest, pull_image, repository
+
+from .fakes import FakeDocker
+
+
+DIGEST = "nvcr.io/nvidia/pytorch@sha256:" + "a" * 64
+INSPECT = [{"Id": "sha256:1", "RepoDigests": ["mirror.local/pytorch@sha256:" + "b" * 64, DIGEST],
+            "Config": {"Entrypoint": ["/entry.sh"], "Cmd": ["bash"]}}]
+CONFIG = {"abbreviations": {"nv": "nvcr.io/nvidia/{0}"}}
+
+
+@pytest.fixture
+def docker(fake_docker, tmpdir, monkeypatch):
+    monkeypatch.setattr(launch, "_identity", ("alice", 1000, "staff", 50))
+    docker = FakeDocker(tmpdir.mkdir("registry"), inspect=INSPECT)
+    monkeypatch.setattr(lockfile, "which", lambda name: docker.path)
+    return docker
+
+
+@pytest.mark.parametrize("name,repo", [
+    ("ubuntu", "ubuntu"),
+    ("nvcr.io/nvidia/pytorch:24.01-py3", "nvcr.io/nvidia/pytorch"),
+    ("localhost:5000/team/img:v1", "localhost:5000/team/img"),
+    (DIGEST, "nvcr.io/nvidia/pytorch"),
+])
+def test_repository(name, repo):
+    assert repository(name) == repo
+
+
+def test_pin_digest_prefers_own_repository():
+    metadata = ImageMetadata.fromInspect(INSPECT[0])
+    assert pin_digest("nvcr.io/nvidia/pytorch:24.01-py3", metadata) == DIGEST
+    assert pin_digest("other:latest", metadata) == INSPECT[0]["RepoDigests"][0]
+    assert pin_digest("local:dev", ImageMetadata("sha256:2")) == "sha256:2"
+
+
+def test_pull_drops_the_cached_tag(docker, tmpdir):
+    cache = ImageCache(str(tmpdir.join("cache")))
+    cache.record_tag("ubuntu:16.04", "sha256:old")
+    cache.record_tag("ubuntu:18.04", "sha256:other")
+    assert pull_image(docker.path, "ubuntu:16.04", cache)
+    assert cache.lookup("ubuntu:16.04") is None
+    assert set(cache._load_tags()) == {"ubuntu:18.04"}
+
+
+def test_lock_images_pulls_and_pins(docker, tmpdir):
+    lock = lock_images([("nv:pytorch:24.01-py3", [])], CONFIG, Lockfile(str(tmpdir.join("luda.lock"))))
+    assert lock.images["nv:pytorch:24.01-py3"] == {"image": "nvcr.io/nvidia/pytorch:24.01-py3", "digest": DIGEST,
+                                                   "id": "sha256:1", "templates": []}
+    assert ["pull", "nvcr.io/nvidia/pytorch:24.01-py3"] in docker.calls()
+    lock.write()
+    assert json.loads(tmpdir.join("luda.lock").read())["version"] == 1
+
+
+def test_launch_uses_pinned_digest(docker, tmpdir):
+    with tmpdir.as_cwd():
+        lock_images([("nv:pytorch:24.01-py3", [])], CONFIG, Lockfile("luda.lock"), pull=False).write()
+        calls = len(docker.calls())
+        plan = build_plan(["nv:pytorch:24.01-py3"], CONFIG, home=False, exe=docker.path)
+    assert plan.image == DIGEST
+    # the digest was cached while locking; no tag lookup at launch
+    assert len(docker.calls()) == calls
+
+
+def test_launch_ignores_lockfile_when_disabled(docker, tmpdir):
+    with tmpdir.as_cwd():
+        lock_images([("nv:pytorch:24.01-py3", [])], CONFIG, Lockfile("luda.lock"), pull=False).write()
+        plan = build_plan(["nv:pytorch:24.01-py3"], dict(CONFIG, lockfile=None), home=False, exe=docker.path)
+    assert plan.image == "nvcr.io/nvidia/pytorch:24.01-py3"
+
+
+def test_launch_uses_pinned_template_image(docker, tmpdir):
+    lock = Lockfile(str(tmpdir.join("luda.lock")))
+    lock.pin("img", "img", DIGEST, "sha256:1")
+    lock.add_chain("img", ["dev"])
+    lock.pin_derived(DIGEST, ["dev"], "luda/img-dev:dev", "sha256:1")
+    lock.write()
+    with tmpdir.as_cwd():
+        image_name, _ = resolve_image("img", CONFIG, template=["dev"], exe=docker.path)
+    assert image_name == "luda/img-dev:dev"
+
+
+def test_specs_and_prune(tmpdir):
+    lock = Lockfile(str(tmpdir.join("luda.lock")))
+    lock.pin("img", "img", DIGEST, "sha256:1")
+    lock.add_chain("img", ["dev"])
+    lock.pin_derived(DIGEST, ["dev"], "luda/img:dev", "sha256:3")
+    lock.pin_derived("old@sha256:0", ["dev"], "luda/old:dev", "sha256:4")
+    lock.prune()
+    assert list(lock.derived) == [DIGEST + "+dev"]
+    assert lock.specs() == [("img", []), ("img", ["dev"])]
+
+
+def test_lock_command(docker, tmpdir):
+    runner = CliRunner()
+    with tmpdir.as_cwd():
+        result = runner.invoke(cli.main, ["lock", "--no-pull", "nv:pytorch:24.01-py3"])
+        assert result.exit_code == 0, result.output
+        assert "nv:pytorch:24.01-py3 -> " + DIGEST in result.output
+        # without arguments the existing entries are refreshed
+        result = runner.invoke(cli.main, ["lock", "--no-pull"])
+        assert result.exit_code == 0, result.output
+        assert list(Lockfile.fromFile("luda.lock").images) == ["nv:pytorch:24.01-py3"]
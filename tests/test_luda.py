@@ -8,13 +8,18 @@ test_luda
 Tests for `luda` module.
 """
 
+import json
+import tarfile
+
 import pytest
 
 # from contextlib import contextmanager
 from click.testing import CliRunner
 
-# from luda import luda
+from luda import luda
 from luda import cli
+from luda.cache import BuildManifest, ImageCache
+from luda.progress import build_times_file
 
 
 @pytest.fixture
@@ -41,3 +46,112 @@ def test_command_line_interface():
     help_result = runner.invoke(cli.main, ['--help'])
     assert help_result.exit_code == 0
     assert '--help  Show this message and exit.' in help_result.output
+
+
+def test_derived_image_name():
+    assert luda.derived_image_name("nvidia/cuda:8.0-devel", "dev") == "luda/nvidia-cuda-8.0-devel:dev"
+    assert luda.derived_image_name("luda/nvidia-cuda-8.0-devel:dev", "tools") == \
+        "luda/nvidia-cuda-8.0-devel:dev-tools"
+
+
+class FakeAPI(object):
+
+    def __init__(self):
+        self.builds = []
+
+    def build(self, **kwargs):
+        self.builds.append(kwargs)
+        return iter([{"stream": "Step 1/2 : FROM ubuntu:16.04\n"},
+                     {"stream": "Step 2/2 : RUN true\n"},
+                     {"stream": "Successfully built 0123\n"}])
+
+
+class FakeClient(object):
+
+    def __init__(self):
+        self.api = FakeAPI()
+
+
+def test_generate_dockerfile_extension_reuses_build(tmpdir, monkeypatch):
+    template = tmpdir.mkdir("templates").mkdir("dev")
+    template.join("Dockerfile").write("RUN true\n")
+    client = FakeClient()
+    monkeypatch.setattr("docker.from_env", lambda: client)
+
+    def inspect(name):
+        return {"Id": "sha256:" + name, "Config": {}}
+
+    kwargs = dict(inspect=inspect,
+                  image_cache=ImageCache(str(tmpdir.join("cache"))),
+                  manifest=BuildManifest(str(tmpdir.join("cache"))))
+    config_path = str(tmpdir.join("templates"))
+    image = luda.generate_dockerfile_extension("ubuntu:16.04", "dev", config_path, **kwargs)
+    assert image == "luda/ubuntu-16.04:dev"
+    assert len(client.api.builds) == 1
+    assert luda.generate_dockerfile_extension("ubuntu:16.04", "dev", config_path, **kwargs) == image
+    assert len(client.api.builds) == 1
+
+    template.join("Dockerfile").write("RUN false\n")
+    luda.generate_dockerfile_extension("ubuntu:16.04", "dev", config_path, **kwargs)
+    assert len(client.api.builds) == 2
+
+
+def test_removed_image_is_rebuilt(tmpdir, monkeypatch):
+    tmpdir.mkdir("templates").mkdir("dev").join("Dockerfile").write("RUN true\n")
+    client = FakeClient()
+    monkeypatch.setattr("docker.from_env", lambda: client)
+
+    def inspect(name):
+        return {"Id": "sha256:" + name, "Config": {}}
+
+    cache = str(tmpdir.join("cache"))
+    kwargs = dict(inspect=inspect, image_cache=ImageCache(cache, ttl=0), manifest=BuildManifest(cache))
+    config_path = str(tmpdir.join("templates"))
+    image = luda.generate_dockerfile_extension("ubuntu:16.04", "dev", config_path, **kwargs)
+    assert luda.generate_dockerfile_extension("ubuntu:16.04", "dev", config_path, **kwargs) == image
+    assert len(client.api.builds) == 1
+
+    # `docker rmi luda/ubuntu-16.04:dev`: the manifest entry alone must not be trusted
+    kwargs["inspect"] = lambda name: None if name == image else inspect(name)
+    luda.generate_dockerfile_extension("ubuntu:16.04", "dev", config_path, **kwargs)
+    assert len(client.api.builds) == 2
+
+
+def test_build_records_step_timings(tmpdir, monkeypatch):
+    template = tmpdir.mkdir("templates").mkdir("dev")
+    template.join("Dockerfile").write("RUN true\n")
+    monkeypatch.setattr("docker.from_env", FakeClient)
+    cache = str(tmpdir.join("cache"))
+    luda.build_derived_image("ubuntu:16.04", "dev", str(tmpdir.join("templates")),
+                             inspect=lambda name: {"Id": "sha256:" + name, "Config": {}},
+                             image_cache=ImageCache(cache), manifest=BuildManifest(cache))
+    with open(build_times_file(cache)) as handle:
+        record = json.loads(handle.readline())
+    assert record["template"] == "dev"
+    assert [s["instruction"] for s in record["steps"]] == ["(context upload)", "FROM ubuntu:16.04", "RUN true"]
+
+
+def test_template_chain_builds_once(tmpdir, monkeypatch):
+    templates = tmpdir.mkdir("templates")
+    templates.mkdir("dev").join("Dockerfile").write("RUN true\n")
+    tools = templates.mkdir("tools")
+    tools.join("Dockerfile").write("RUN echo tools\n")
+    client = FakeClient()
+    monkeypatch.setattr("docker.from_env", lambda: client)
+    cache = str(tmpdir.join("cache"))
+    kwargs = dict(inspect=lambda name: {"Id": "sha256:" + name, "Config": {}},
+                  image_cache=ImageCache(cache), manifest=BuildManifest(cache))
+
+    image, built = luda.build_template_chain("ubuntu:16.04", ["dev", "tools"], str(templates), **kwargs)
+    assert built and image.startswith("luda/ubuntu-16.04:dev-tools-")
+    assert len(client.api.builds) == 1
+    with tarfile.open(fileobj=client.api.builds[0]["fileobj"]) as tar:
+        dockerfile = tar.extractfile(".Dockerfile.luda").read().decode()
+    assert "FROM ubuntu:16.04 AS luda-stage-0" in dockerfile
+    assert "FROM luda-stage-0" in dockerfile
+    assert BuildManifest(cache).entries()[image]["template"] == "dev+tools"
+
+    assert luda.build_template_chain("ubuntu:16.04", ["dev", "tools"], str(templates), **kwargs) == (image, False)
+    tools.join("Dockerfile").write("RUN echo more tools\n")
+    assert luda.build_template_chain("ubuntu:16.04", ["dev", "tools"], str(templates), **kwargs)[0] != image
+    assert len(client.api.builds) == 2
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_prebuild
+----------------------------------
+
+Tests for `luda.prebuild` module.
+"""
+
+import pytest
+
+from luda.engine import EngineClient
+from luda.prebuild import format_summary, prebuild
+
+from .fakes import FakeEngine
+
+
+@pytest.fixture
+def engine(tmpdir, monkeypatch):
+    monkeypatch.setenv("LUDA_CACHE_DIR", str(tmpdir.join("cache")))
+    with FakeEngine(str(tmpdir.join("docker.sock"))) as fake:
+        fake.images["nvcr.io/nvidia/pytorch:17.10"] = {"Id": "sha256:pt", "Config": {}}
+        fake.images["ubuntu:16.04"] = {"Id": "sha256:ub", "Config": {}}
+        yield fake
+
+
+@pytest.fixture
+def templates(tmpdir):
+    root = tmpdir.mkdir("templates")
+    for name in ("dev", "tools"):
+        root.mkdir(name).join("Dockerfile").write("RUN echo {0}\n".format(name))
+    return str(root)
+
+
+def test_prebuild_matrix_then_hits(engine, templates):
+    client = EngineClient(engine.socket_path)
+    config = {"abbreviations": {"nv": "nvcr.io/nvidia/{0}"}}
+    images = ["nv:pytorch:17.10", "ubuntu:16.04"]
+
+    results = prebuild(images, ["dev", "tools"], config, 3, template_path=templates, engine=client)
+    assert [r.image for r in results] == ["luda/nvcr.io-nvidia-pytorch-17.10:dev",
+                                          "luda/nvcr.io-nvidia-pytorch-17.10:tools",
+                                          "luda/ubuntu-16.04:dev",
+                                          "luda/ubuntu-16.04:tools"]
+    assert [r.status for r in results] == ["built"] * 4
+    assert len(engine.builds) == 4
+
+    results = prebuild(images, ["dev", "tools"], config, 3, template_path=templates, engine=client)
+    assert [r.status for r in results] == ["hit"] * 4
+    assert len(engine.builds) == 4
+    assert "4 cache hits, 0 built" in format_summary(results, 0.1, 3)
+
+
+def test_prebuild_reports_missing_template(engine, templates):
+    client = EngineClient(engine.socket_path)
+    results = prebuild(["ubuntu:16.04"], ["nope"], {}, 1, template_path=templates, engine=client)
+    assert results[0].status == "error"
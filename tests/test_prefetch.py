@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_prefetch
+----------------------------------
+
+Tests for `luda.prefetch` module.
+"""
+
+import json
+import subprocess
+import sys
+import time
+
+from luda.launch import build_plan
+from luda.luda import Volume
+from luda.prefetch import Prefetcher, list_files, start_prefetch
+
+
+def make_dataset(tmpdir):
+    dataset = tmpdir.mkdir("dataset")
+    dataset.join("a.bin").write("a" * 3000)
+    dataset.mkdir("sub").join("b.bin").write("b" * 2000)
+    return dataset
+
+
+def test_list_files(tmpdir):
+    dataset = make_dataset(tmpdir)
+    assert list_files([str(dataset), str(dataset.join("a.bin"))]) == [
+        str(dataset.join("a.bin")), str(dataset.join("sub", "b.bin")), str(dataset.join("a.bin"))]
+
+
+def test_prefetch_reads_everything_within_budget(tmpdir):
+    dataset = make_dataset(tmpdir)
+    reports = []
+    prefetcher = Prefetcher([str(dataset)], budget=10000, on_progress=lambda p: reports.append(p.toDict())).run()
+    assert (prefetcher.files, prefetcher.bytes) == (2, 5000)
+    assert reports[-1]["done"] and reports[-1]["bytes"] == 5000
+
+    limited = Prefetcher([str(dataset)], budget=4000, concurrency=1).run()
+    assert limited.bytes == 4000
+
+
+def test_start_prefetch_logs_progress(tmpdir):
+    dataset = make_dataset(tmpdir)
+    log = tmpdir.join("prefetch.log")
+    start_prefetch([str(dataset)], budget=10000, log_path=str(log), detach=False)
+    deadline = time.time() + 5
+    while not (log.exists() and log.read().endswith("\n")) and time.time() < deadline:
+        time.sleep(0.01)
+    record = json.loads(log.readlines()[-1])
+    assert record["done"] and record["bytes"] == 5000
+
+
+def test_detached_prefetch_releases_output(tmpdir):
+    # the launching process has exited; a pipe reading its output must not wait for the prefetch
+    script = ("import time, luda.prefetch as p; p.Prefetcher.run = lambda self: time.sleep(3); "
+              "p.start_prefetch([], log_path={0!r}); print('launched')").format(str(tmpdir.join("log")))
+    start = time.time()
+    proc = subprocess.Popen([sys.executable, "-c", script], stdout=subprocess.PIPE)
+    assert proc.communicate()[0] == b"launched\n"
+    assert time.time() - start < 2
+
+
+def test_prefetch_volume_mode(fake_docker, tmpdir):
+    dataset = make_dataset(tmpdir)
+    volume = Volume.fromString("{0}:/data:ro,prefetch".format(dataset))
+    assert volume.spec == "{0}:/data:ro".format(dataset) and volume.prefetch
+    assert not Volume.fromString("{0}:/data:ro".format(dataset)).prefetch
+    with tmpdir.as_cwd():
+        plan = build_plan(["img"], {}, home=False, exe=fake_docker.path, volume=[volume])
+    assert plan.prefetch == [str(dataset)]
+    assert "{0}:/data:ro".format(dataset) in plan.run_args
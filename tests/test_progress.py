@@ -0,0 +1,31 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_progress
+----------------------------------
+
+Tests for `luda.progress` module.
+"""
+
+import pytest
+
+from luda.progress import BuildError, BuildTimer
+
+
+def test_timer_splits_steps_and_echoes():
+    echoed = []
+    timer = BuildTimer("luda/a:dev", echo=echoed.append)
+    timer.consume([{"stream": "Step 1/2 : FROM a\n"}, {"stream": " ---> 123\n"},
+                   {"stream": "Step 2/2 : RUN pip install x\n"}, {"stream": "Successfully built\n"}])
+    data = timer.toDict()
+    assert [s["step"] for s in data["steps"]] == [0, 1, 2]
+    assert data["steps"][2]["instruction"] == "RUN pip install x"
+    assert "".join(echoed).count("Step") == 2
+    assert "total: luda/a:dev" in timer.table()
+
+
+def test_timer_raises_on_error():
+    timer = BuildTimer("luda/a:dev")
+    with pytest.raises(BuildError):
+        timer.consume([{"stream": "Step 1/1 : RUN false\n"}, {"error": "returned a non-zero code: 1"}])
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_resources
+----------------------------------
+
+Tests for `luda.resources` module.
+"""
+
+import pytest
+
+from luda import resources
+from luda.launch import build_plan
+from luda.resources import GIB, HostResources, format_size, get_profile, meminfo, parse_size, resource_args
+
+
+def test_nccl_profile_scales_with_gpus():
+    profile = get_profile("nccl", {})
+    assert resource_args(profile, HostResources(64 * GIB, gpus=0)) == [
+        "--shm-size=1g", "--ulimit", "memlock=-1", "--ulimit", "stack=67108864"]
+    assert resource_args(profile, HostResources(64 * GIB, gpus=8))[0] == "--shm-size=16g"
+    # never more than half the host's memory
+    assert resource_args(profile, HostResources(16 * GIB, gpus=8))[0] == "--shm-size=8g"
+
+
+def test_config_profiles():
+    config = {"resource_profiles": {
+        "nccl": {"shm_per_gpu": "512m"},
+        "ipc": {"ipc": "host", "ulimits": {"nofile": "65536:65536"}},
+    }}
+    assert resource_args(get_profile("nccl", config), HostResources(64 * GIB, gpus=3))[0] == "--shm-size=1536m"
+    assert resource_args(get_profile("ipc", config), HostResources(64 * GIB)) == [
+        "--ipc=host", "--ulimit", "nofile=65536:65536"]
+    assert resource_args(get_profile("small", config), HostResources(64 * GIB, gpus=8))[0] == "--shm-size=256m"
+    with pytest.raises(ValueError):
+        get_profile("huge", config)
+
+
+def test_gpus_are_counted_only_for_per_gpu_profiles(monkeypatch):
+    scans = []
+
+    class Topology(object):
+        def gpus(self):
+            scans.append(1)
+            return [0, 1]
+
+    monkeypatch.setattr(resources, "get_topology", lambda *args: Topology())
+    host = HostResources.fromHost({})
+    assert resource_args(get_profile("small", {}), host)[0] == "--shm-size=256m"
+    assert resource_args({"ipc": "host", "shm_per_gpu": "2g"}, host) == ["--ipc=host"]
+    assert not scans
+    assert resource_args({"shm_per_gpu": "1g", "shm_min": "1m"}, host)[0] == "--shm-size=2g"
+    resource_args(get_profile("nccl", {}), host)
+    assert len(scans) == 1
+
+
+def test_format_size():
+    assert format_size(2 * GIB) == "2g"
+    assert format_size(GIB + GIB // 2) == "1536m"
+
+
+def test_meminfo(tmpdir):
+    path = tmpdir.join("meminfo")
+    path.write("MemTotal:       16318532 kB\nHugePages_Total:       4\n")
+    assert meminfo(str(path)) == {"MemTotal": 16318532 * 1024, "HugePages_Total": 4}
+
+
+def test_build_plan_prints_profile(fake_docker, tmpdir):
+    with tmpdir.as_cwd():
+        plan = build_plan(["img"], {}, home=False, exe=fake_docker.path, resources="small")
+        plain = build_plan(["img"], {}, home=False, exe=fake_docker.path, nccl=False)
+    assert "--shm-size=256m --ulimit memlock=-1" in str(plan)
+    assert "--shm-size" not in str(plain)
+
+
+def test_parse_size():
+    assert parse_size("512m") == 512 << 20
+    assert parse_size("100") == 100
+    assert parse_size(2 * GIB) == parse_size("2g")
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_session
+----------------------------------
+
+Tests for `luda.session` module.
+"""
+
+import json
+import subprocess
+import sys
+
+import pytest
+
+from luda import launch
+from luda.launch import build_plan
+from luda.session import SessionError, SessionManager, session_key, session_name
+
+
+IDENTITY = ("alice", 1000, "staff", 50)
+
+
+@pytest.fixture
+def manager(fake_docker, tmpdir, monkeypatch):
+    monkeypatch.setattr(launch, "_identity", IDENTITY)
+    containers = tmpdir.join("containers.json")
+    containers.write("[]")
+    monkeypatch.setenv("FAKE_DOCKER_CONTAINERS", str(containers))
+    manager = SessionManager(fake_docker.path, ttl=60, limit=2)
+    manager.fake_docker = fake_docker
+    manager.containers = containers
+    return manager
+
+
+def make_plan(manager, tmpdir, *args):
+    with tmpdir.as_cwd():
+        return build_plan(list(args), {}, rm=True, tty=True, stdin=True, home=False, exe=manager.exe)
+
+
+def set_running(manager, *names, **kwargs):
+    busy = kwargs.get("busy", ())
+    manager.containers.write(json.dumps([{"Name": "/" + name, "State": {"Running": True},
+                                          "ExecIDs": ["1"] if name in busy else None} for name in names]))
+
+
+def test_session_key_ignores_attach_options(manager, tmpdir):
+    plan = make_plan(manager, tmpdir, "img")
+    other = make_plan(manager, tmpdir, "img", "python")
+    assert session_key(plan) == session_key(other)
+    plan.run_args.remove("-t")
+    assert session_key(plan) == session_key(other)
+    assert session_key(make_plan(manager, tmpdir, "-e", "A=1", "img")) != session_key(plan)
+
+
+def test_first_launch_starts_then_execs(manager, tmpdir):
+    plan = make_plan(manager, tmpdir, "img", "python")
+    exec_plan = manager.attach(plan, "bootstrap", tty=True, stdin=True)
+    name = session_name("alice", session_key(plan))
+    run = [call for call in manager.fake_docker.calls() if call[0] == "run"][0]
+    # the container expires by itself after session_ttl idle seconds
+    assert "--rm" in run and "-d" in run and name in run
+    assert "/proc/[0-9]*;" in run and "60" in " ".join(run)
+    assert exec_plan.argv[:5] == [manager.exe, "exec", "-i", "-t", "--workdir"]
+    assert exec_plan.argv[6:] == [name, "/bootstrap/su-exec", "alice", "/entry.sh", "python"]
+    assert name in manager.sessions()
+
+    # a matching launch reuses the running container
+    set_running(manager, name)
+    calls = len(manager.fake_docker.calls())
+    manager.attach(make_plan(manager, tmpdir, "img"), "bootstrap")
+    assert [call[0] for call in manager.fake_docker.calls()[calls:]] == ["inspect"]
+
+
+def test_idle_sessions_expire(manager, tmpdir):
+    plan = make_plan(manager, tmpdir, "img")
+    manager.attach(plan, "bootstrap")
+    name = session_name("alice", session_key(plan))
+    set_running(manager, name)
+    sessions = manager.sessions()
+    manager.reap(sessions, manager.states([name]), now=sessions[name]["last_used"] + 61)
+    assert sessions == {}
+    assert ["rm", "-f", name] in manager.fake_docker.calls()
+
+
+def test_session_limit(manager, tmpdir):
+    names = []
+    for env in ("A=1", "A=2"):
+        plan = make_plan(manager, tmpdir, "-e", env, "img")
+        manager.attach(plan, "bootstrap")
+        names.append(session_name("alice", session_key(plan)))
+    set_running(manager, *names, busy=names[1:])
+    manager.attach(make_plan(manager, tmpdir, "-e", "A=3", "img"), "bootstrap")
+    assert names[0] not in manager.sessions() and names[1] in manager.sessions()
+
+    set_running(manager, *manager.sessions(), busy=list(manager.sessions()))
+    with pytest.raises(SessionError):
+        manager.attach(make_plan(manager, tmpdir, "-e", "A=4", "img"), "bootstrap")
+
+
+def test_user_identity_is_not_supported(manager, tmpdir):
+    with pytest.raises(SessionError):
+        manager.attach(make_plan(manager, tmpdir, "img"), "user")
+
+
+def test_registry_is_locked_across_processes(manager):
+    probe = "import fcntl, sys; fcntl.flock(open(sys.argv[1], 'a'), fcntl.LOCK_EX | fcntl.LOCK_NB)"
+    lock_file = manager.sessions_file + ".lock"
+    with manager.locked():
+        assert subprocess.call([sys.executable, "-c", probe, lock_file], stderr=subprocess.PIPE) != 0
+    assert subprocess.call([sys.executable, "-c", probe, lock_file]) == 0
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_staging
+----------------------------------
+
+Tests for `luda.staging` module.
+"""
+
+import json
+import os
+import time
+
+import pytest
+
+from luda.launch import build_plan
+from luda.luda import Volume
+from luda.staging import Stager, lock_entry
+
+
+def make_dataset(tmpdir):
+    dataset = tmpdir.mkdir("nfs").mkdir("imagenet")
+    dataset.join("a.bin").write("a" * 100)
+    dataset.mkdir("train").join("b.bin").write("b" * 200)
+    return dataset
+
+
+def test_stage_is_incremental(tmpdir):
+    dataset = make_dataset(tmpdir)
+    stager = Stager(str(tmpdir.join("staging")))
+    first = stager.stage(str(dataset))
+    assert (first.copied, first.reused, first.copied_bytes) == (2, 0, 300)
+    assert open(os.path.join(first.path, "train", "b.bin")).read() == "b" * 200
+
+    again = stager.stage(str(dataset))
+    assert (again.path, again.copied, again.reused) == (first.path, 0, 2)
+
+    # a container still reading the old copy keeps it intact
+    reader = open(os.path.join(first.path, "a.bin"))
+    dataset.join("a.bin").write("A" * 150)
+    dataset.join("train", "b.bin").remove()
+    changed = stager.stage(str(dataset))
+    assert (changed.copied, changed.removed) == (1, 1)
+    assert open(os.path.join(changed.path, "a.bin")).read() == "A" * 150
+    with reader:
+        assert reader.read() == "a" * 100
+    assert not [name for name in os.listdir(changed.path) if name.startswith(".luda-stage-")]
+    assert not os.path.exists(os.path.join(changed.path, "train", "b.bin"))
+
+
+def test_single_file(tmpdir):
+    source = tmpdir.join("weights.pt")
+    source.write("w")
+    result = Stager(str(tmpdir.join("staging"))).stage(str(source))
+    assert os.path.basename(result.path) == "weights.pt" and open(result.path).read() == "w"
+
+
+def test_lru_eviction(tmpdir):
+    staging = str(tmpdir.join("staging"))
+    sources = []
+    for name in ("one", "two", "three"):
+        source = tmpdir.mkdir(name)
+        source.join("data").write("x" * 100)
+        sources.append(str(source))
+    stager = Stager(staging, budget=250)
+    entries = [stager.stage(source) for source in sources[:2]]
+    stager.stage(sources[2])
+    assert not os.path.exists(entries[0].path) and os.path.exists(entries[1].path)
+
+    with pytest.raises(ValueError):
+        Stager(staging, budget=250, eviction="none").stage(sources[0])
+
+
+def test_eviction_skips_busy_and_mounted_entries(fake_docker, tmpdir, monkeypatch):
+    staging = str(tmpdir.join("staging"))
+    sources = []
+    for name in ("one", "two", "three", "four"):
+        source = tmpdir.mkdir(name)
+        source.join("data").write("x" * 100)
+        sources.append(str(source))
+    stager = Stager(staging, budget=250, exe=fake_docker.path)
+    mounted, busy = [stager.stage(source) for source in sources[:2]]
+    tmpdir.join("ps").write("c1\n")
+    tmpdir.join("containers.json").write(json.dumps([{"Mounts": [{"Source": mounted.path}]}]))
+    monkeypatch.setenv("FAKE_DOCKER_PS", str(tmpdir.join("ps")))
+    monkeypatch.setenv("FAKE_DOCKER_CONTAINERS", str(tmpdir.join("containers.json")))
+
+    # another launch is syncing the second entry
+    lock = lock_entry(stager.entry(sources[1]))
+    try:
+        with pytest.raises(ValueError):
+            stager.stage(sources[2])
+    finally:
+        lock.close()
+    assert os.path.exists(mounted.path) and os.path.exists(busy.path)
+
+    stager.stage(sources[3])
+    assert os.path.exists(mounted.path) and not os.path.exists(busy.path)
+    stager.ttl = 0
+    stager.expire(now=time.time() + 60)
+    assert os.path.exists(mounted.path)
+
+
+def test_ttl(tmpdir):
+    staging = str(tmpdir.join("staging"))
+    old, new = tmpdir.mkdir("old"), tmpdir.mkdir("new")
+    stager = Stager(staging, ttl=60)
+    old_path = stager.stage(str(old)).path
+    stager.expire(now=os.path.getmtime(staging) + 3600)
+    assert not os.path.exists(old_path)
+    assert os.path.exists(stager.stage(str(new)).path)
+
+
+def test_build_plan_mounts_staged_copy(fake_docker, tmpdir, monkeypatch):
+    dataset = make_dataset(tmpdir)
+    config = {"staging_dir": str(tmpdir.join("staging"))}
+    with tmpdir.as_cwd():
+        plan = build_plan(["img"], config, home=False, exe=fake_docker.path,
+                          stage=[Volume.fromString("{0}:/data:ro".format(dataset))])
+    spec = [arg for arg in plan.run_args if arg.endswith(":/data:ro")][0]
+    assert spec.startswith(str(tmpdir.join("staging")))
+    assert str(dataset) not in plan.run_args
@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_startup
+----------------------------------
+
+Tests for `luda.startup` module.
+"""
+
+from luda.startup import measure, parse_importtime, report
+
+
+SAMPLE = """import time: self [us] | cumulative | imported package
+import time:       150 |        150 |   _io
+import time:      2000 |       5000 | luda.cli
+"""
+
+
+def test_parse_importtime():
+    timings = parse_importtime(SAMPLE)
+    assert [t.module for t in timings] == ["_io", "luda.cli"]
+    assert timings[0].depth == 1
+    assert timings[1].cumulative_us == 5000
+
+
+def test_cli_does_not_import_build_dependencies():
+    timings, eager = measure()
+    assert any(t.module == "luda.client" for t in timings)
+    assert any(t.module == "luda.cli" for t in timings)
+    assert eager == []
+    # the launch machinery is imported by `run` itself
+    assert not any(t.module in ("luda.launch", "luda.luda") for t in timings)
+
+
+def test_report_measures_the_entry_point():
+    text, _ = report()
+    assert "import luda.client, luda.cli:" in text
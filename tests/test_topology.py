@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_topology
+----------------------------------
+
+Tests for `luda.topology` module.
+"""
+
+import os
+
+from click.testing import CliRunner
+
+from luda import cli
+from luda.topology import SysfsTopology, format_cpulist, gpu_groups, group_args, parse_cpulist
+
+
+def make_sysfs(tmpdir):
+    """Two sockets with two GPUs each, plus a non-GPU NVIDIA device and a NIC."""
+    devices = tmpdir.join("sys", "bus", "pci", "devices")
+    layout = [
+        ("0000:86:00.0", "0x10de", "0x030200", 1, "20-39"),
+        ("0000:1a:00.0", "0x10de", "0x030200", 0, "0-19"),
+        ("0000:3b:00.0", "0x10de", "0x030000", 0, "0-19"),
+        ("0000:af:00.0", "0x10de", "0x030200", 1, None),
+        ("0000:1b:00.0", "0x10de", "0x040300", 0, "0-19"),
+        ("0000:5e:00.0", "0x15b3", "0x020000", 0, "0-19"),
+    ]
+    for bus_id, vendor, klass, node, cpus in layout:
+        device = devices.join(bus_id)
+        device.ensure(dir=True)
+        device.join("vendor").write(vendor + "\n")
+        device.join("class").write(klass + "\n")
+        device.join("numa_node").write("{0}\n".format(node))
+        if cpus:
+            device.join("local_cpulist").write(cpus + "\n")
+    tmpdir.join("sys", "devices", "system", "node", "node1").ensure(dir=True).join("cpulist").write("20-39\n")
+    return str(tmpdir)
+
+
+def test_cpulist_round_trip():
+    assert parse_cpulist("0-3,8,10-11\n") == [0, 1, 2, 3, 8, 10, 11]
+    assert format_cpulist([11, 0, 1, 2, 3, 8, 10]) == "0-3,8,10-11"
+    assert parse_cpulist("") == []
+
+
+def test_sysfs_topology(tmpdir):
+    gpus = SysfsTopology(make_sysfs(tmpdir)).gpus()
+    assert [(g.index, g.pci_bus_id, g.numa_node) for g in gpus] == [
+        (0, "0000:1a:00.0", 0), (1, "0000:3b:00.0", 0), (2, "0000:86:00.0", 1), (3, "0000:af:00.0", 1)]
+    # no local_cpulist: falls back to the NUMA node's cpus
+    assert format_cpulist(gpus[3].cpus) == "20-39"
+
+
+def test_groups_stay_on_one_socket(tmpdir):
+    gpus = SysfsTopology(make_sysfs(tmpdir)).gpus()
+    groups = gpu_groups(gpus, 2)
+    assert [[g.index for g in group] for group in groups] == [[0, 1], [2, 3]]
+    assert group_args(groups[1]) == ["--env", "NVIDIA_VISIBLE_DEVICES=2,3", "--cpuset-cpus=20-39",
+                                     "--cpuset-mems=1"]
+    assert group_args(gpu_groups(gpus, 1)[0]) == ["--env", "NVIDIA_VISIBLE_DEVICES=0", "--cpuset-cpus=0-19",
+                                                  "--cpuset-mems=0"]
+
+
+def test_run_per_gpu(fake_docker, tmpdir, monkeypatch):
+    monkeypatch.setenv("PATH", os.path.dirname(fake_docker.path) + os.pathsep + os.environ["PATH"])
+    config = tmpdir.mkdir("config")
+    config.join("config.yml").write("sysfs_root: {0}\n".format(make_sysfs(tmpdir.mkdir("root"))))
+    with tmpdir.as_cwd():
+        result = CliRunner().invoke(cli.main, ["--per-gpu", "--no-home", "-c", str(config), "img", "true"])
+    assert result.exit_code == 0, result.output
+    runs = sorted(" ".join(call) for call in fake_docker.calls() if call[0] == "run")
+    assert len(runs) == 4
+    assert all("-t" not in run.split() for run in runs)
+    assert any("NVIDIA_VISIBLE_DEVICES=0 --cpuset-cpus=0-19 --cpuset-mems=0" in run for run in runs)
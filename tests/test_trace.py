@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_trace
+----------------------------------
+
+Tests for `luda.trace` module.
+"""
+
+import json
+import os
+
+from click.testing import CliRunner
+
+from luda import cli, trace
+
+
+def test_span_is_a_noop_without_tracer():
+    assert trace._tracer is None
+    with trace.span("nothing"):
+        pass
+
+
+def test_spans_are_recorded():
+    tracer = trace.start_tracing()
+    try:
+        with trace.span("inspect", image="img"):
+            pass
+    finally:
+        assert trace.stop_tracing() is tracer
+    event, = tracer.events
+    assert event["name"] == "inspect" and event["ph"] == "X" and event["args"] == {"image": "img"}
+    data = tracer.toDict()
+    assert [e["args"]["name"] for e in data["traceEvents"] if e["ph"] == "M"] == ["luda", "container"]
+
+
+def test_container_marks(tmpdir):
+    marks = tmpdir.join("bootstrap.marks")
+    marks.write("start 10500000000\nuseradd 10700000000\nexec 10750000000\nbroken 12N\n")
+    tracer = trace.Tracer()
+    events = tracer.add_container_marks(str(marks), 10.0, 12.0)
+    assert [(e["name"], e["dur"]) for e in events] == [
+        ("container create/start", 500000), ("bootstrap: create user", 200000),
+        ("bootstrap: sudoers", 50000), ("command", 1250000)]
+    assert all(e["tid"] == trace.CONTAINER_TRACK for e in events)
+    assert tracer.add_container_marks(str(tmpdir.join("missing")), 10.0, 12.0) == []
+
+
+def test_run_profile(fake_docker, tmpdir, monkeypatch):
+    monkeypatch.setenv("PATH", os.path.dirname(fake_docker.path) + os.pathsep + os.environ["PATH"])
+    profile = tmpdir.join("trace.json")
+    with tmpdir.as_cwd():
+        result = CliRunner().invoke(cli.main, ["--profile", str(profile), "--no-home", "-c", str(tmpdir),
+                                               "img", "7"])
+    assert result.exit_code == 7
+    run = [call for call in fake_docker.calls() if call[0] == "run"][0]
+    assert any(arg.startswith("LUDA_PROFILE=/luda-profile/") for arg in run)
+    names = [e["name"] for e in json.loads(profile.read())["traceEvents"] if e["ph"] == "X"]
+    assert names[:2] == ["read_config", "build_plan"] and "inspect" in names and "docker run" in names
+    assert trace._tracer is None